@@ -1,6 +1,35 @@
-from bigants.ants import BiGAnts
+# The public API is resolved lazily (PEP 562): "import bigants" only loads the
+# submodule that is actually used, so plotting and annotation libraries are not
+# imported by scripts and worker processes that only run the search.
+import importlib
 
-from bigants.load_data import data_preprocessing
-from bigants.results_processing import results_analysis
+_exports = {
+    "BiGAnts": "bigants.ants",
+    "SingleCellBiGAnts": "bigants.singlecell",
+    "data_preprocessing": "bigants.load_data",
+    "new_patients_preprocessing": "bigants.load_data",
+    "singlecell_preprocessing": "bigants.load_data",
+    "results_analysis": "bigants.results_processing",
+    "parameter_sweep": "bigants.sweep",
+    "GeneIDStore": "bigants.gene_ids",
+    "IDIndex": "bigants.labels",
+    "load_index": "bigants.labels",
+    "LocalEnrichment": "bigants.enrichment",
+    "AnnotationClient": "bigants.annotation",
+    "render_reports": "bigants.reports",
+    "ConsensusAnalysis": "bigants.consensus",
+}
 
+__all__ = list(_exports)
 
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'bigants' has no attribute '{0}'".format(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# matplotlib and seaborn take seconds to import and are only needed for the
+# visualisation helpers, so they are loaded here on first use instead of at
+# "import bigants" time (which also keeps worker start-up cheap)
+
+_configured = False
+
+
+def pyplot():
+    """
+    Returns matplotlib.pyplot and applies the seaborn theme once
+    (same global style that was previously set at import time)
+    """
+    global _configured
+    import matplotlib.pyplot as plt
+    if not _configured:
+        import seaborn as sns
+        sns.set(color_codes=True)
+        _configured = True
+    return plt
+
+
+def seaborn():
+    """
+    Returns the seaborn module with the package theme applied
+    """
+    pyplot()
+    import seaborn as sns
+    return sns
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Adaptive number of ants per iteration for run_search(K_min = ..., K_max = ...).
+
+import numpy as np
+
+
+def solution_key(gene_groups):
+    # hashable identity of a solution: the sorted genes of each group
+    return tuple(tuple(sorted(int(g) for g in group)) for group in gene_groups)
+
+
+class AntScheduler(object):
+    '''
+        Chooses the number of ants of the next iteration from the last round: if many ants found
+        different solutions or their scores vary a lot, the colony is still exploring and the number
+        grows. If nearly all ants returned the same solution with similar scores, it shrinks.
+
+        Attributes:
+        -----------
+        K - number of ants of the first iteration
+        K_min, K_max - bounds of the number of ants
+        low, high - fraction of distinct solutions below which the number shrinks / above which it grows (default 0.2, 0.5)
+        cv - coefficient of variation of the scores above which the number grows, and below a tenth of which
+            it can shrink (default 0.05)
+        step - factor by which the number grows or shrinks (default 1.5)
+    '''
+    def __init__(self, K, K_min, K_max, low = 0.2, high = 0.5, cv = 0.05, step = 1.5):
+        assert 0 < K_min <= K_max, "K_min should be positive and not above K_max"
+        assert step > 1, "step should be greater than 1, the value was: {0}".format(step)
+        self.K_min = K_min
+        self.K_max = K_max
+        self.K = int(min(max(K, K_min), K_max))
+        self.low = low
+        self.high = high
+        self.cv = cv
+        self.step = step
+        # ants of every iteration
+        self.history = []
+
+    def update(self, scores, keys):
+        """
+        Number of ants for the next iteration given the scores and solution keys (solution_key()) of all ants of the last one
+        """
+        self.history.append(len(scores))
+        diversity = len(set(keys))/len(keys)
+        spread = np.std(scores)/max(abs(np.mean(scores)), 1e-12)
+        if diversity >= self.high or spread > self.cv:
+            K = self.K*self.step
+        elif diversity <= self.low and spread < self.cv/10:
+            K = self.K/self.step
+        else:
+            K = self.K
+        self.K = int(min(max(round(K), self.K_min), self.K_max))
+        return self.K
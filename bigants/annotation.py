@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Concurrent client for the annotation web services used by results_analysis: MyGene.info for
+# the conversion of gene IDs and Enrichr for the enrichment analysis. Requests run on asyncio,
+# every service keeps a pool of persistent http.client connections, failed requests are retried
+# with exponential backoff and answers can be cached on disk.
+
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import random
+from urllib.parse import urlencode, urlsplit
+
+import pandas as pd
+
+MYGENE_URL = "https://mygene.info/v3"
+ENRICHR_URL = "https://maayanlab.cloud/Enrichr"
+# answers that are worth another attempt
+RETRY_STATUS = [429, 500, 502, 503, 504]
+# columns of the Enrichr results
+ENRICHR_COLUMNS = ["rank", "term", "p_value", "z_score", "combined_score", "genes", "adj_p_value"]
+
+
+def multipart(fields, boundary):
+    # multipart/form-data body of text fields
+    lines = []
+    for name, value in fields.items():
+        lines += ["--" + boundary, 'Content-Disposition: form-data; name="{0}"'.format(name), "", value]
+    lines += ["--" + boundary + "--", ""]
+    return "\r\n".join(lines).encode()
+
+
+class AnnotationClient(object):
+    '''
+        Pooled, concurrent and retrying client for MyGene.info and Enrichr
+
+        query() converts any number of gene IDs in batches, enrich() runs the enrichment of many gene lists
+        at the same time, annotate() does both for a list of results_analysis objects. The a* methods are the
+        coroutines behind them for use inside a running event loop (e.g. await client.aenrich(...) in a notebook).
+        The base URLs can point to a mirror or to a local stand-in server.
+
+        Attributes:
+        -----------
+        mygene_url - base URL of MyGene.info (default MYGENE_URL)
+        enrichr_url - base URL of Enrichr (default ENRICHR_URL)
+        cache - directory where answers are cached, repeated requests are then not sent again (default - None, no cache)
+        concurrency - maximal number of simultaneous requests and open connections per service (default 8)
+        batch_size - number of IDs per MyGene.info query (default 1000, the limit of the service)
+        retries - number of attempts per request (default 5)
+        backoff - delay before the first retry in seconds, doubled for every further retry (default 0.5)
+        timeout - socket timeout in seconds (default 30)
+    '''
+    def __init__(self, mygene_url = MYGENE_URL, enrichr_url = ENRICHR_URL, cache = None, concurrency = 8, batch_size = 1000,
+                 retries = 5, backoff = 0.5, timeout = 30):
+        assert concurrency > 0, "concurrency should be positive, the value was: {0}".format(concurrency)
+        assert retries > 0, "retries should be positive, the value was: {0}".format(retries)
+        self.mygene_url = mygene_url.rstrip("/")
+        self.enrichr_url = enrichr_url.rstrip("/")
+        self.cache = cache
+        if cache != None:
+            os.makedirs(cache, exist_ok = True)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # idle connections per base URL, the blocking http.client calls run in the executor
+        self._idle = collections.defaultdict(collections.deque)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = 2*concurrency)
+        self._loop = None
+        self._limits = dict()
+        # number of requests sent and answered from the cache
+        self.stats = {"sent": 0, "cached": 0, "retried": 0}
+
+    def close(self):
+        """
+        Closes all pooled connections
+        """
+        for idle in self._idle.values():
+            while len(idle) > 0:
+                idle.pop().close()
+        self._executor.shutdown(wait = False)
+
+    def _connect(self, url):
+        parts = urlsplit(url)
+        if parts.scheme == "https":
+            return http.client.HTTPSConnection(parts.hostname, parts.port, timeout = self.timeout)
+        return http.client.HTTPConnection(parts.hostname, parts.port, timeout = self.timeout)
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body = body, headers = headers)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, response.getheader("Retry-After"), data
+
+    def _limit(self, url):
+        # semaphores belong to the running event loop, every asyncio.run() gets new ones
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._limits = dict()
+        if url not in self._limits:
+            self._limits[url] = asyncio.Semaphore(self.concurrency)
+        return self._limits[url]
+
+    def _cache_path(self, url, method, path, body):
+        key = hashlib.sha1(json.dumps([url, method, path, body.decode() if body != None else None]).encode()).hexdigest()
+        return os.path.join(self.cache, key + ".json")
+
+    async def request(self, url, method, path, body = None, headers = None):
+        """
+        Sends a request to the service at url and returns the decoded JSON answer
+        """
+        cached = self._cache_path(url, method, path, body) if self.cache != None else None
+        if cached != None and os.path.exists(cached):
+            self.stats["cached"] += 1
+            with open(cached) as fh:
+                return json.load(fh)
+        full_path = urlsplit(url).path + path
+        loop = asyncio.get_running_loop()
+        error = None
+        async with self._limit(url):
+            for attempt in range(self.retries):
+                if attempt > 0:
+                    self.stats["retried"] += 1
+                idle = self._idle[url]
+                conn = idle.pop() if len(idle) > 0 else self._connect(url)
+                retry_after = None
+                try:
+                    self.stats["sent"] += 1
+                    status, retry_after, data = await loop.run_in_executor(self._executor, self._send, conn, method, full_path, body, headers or {})
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    error = "{0}: {1}".format(type(e).__name__, e)
+                else:
+                    idle.append(conn)
+                    if status == 200:
+                        answer = json.loads(data.decode())
+                        if cached != None:
+                            tmp = cached + ".{0}.tmp".format(os.getpid())
+                            with open(tmp, "w") as fh:
+                                json.dump(answer, fh)
+                            os.replace(tmp, cached)
+                        return answer
+                    error = "HTTP {0}".format(status)
+                    if status not in RETRY_STATUS:
+                        break
+                delay = self.backoff*2**attempt*(1 + random.random()/2)
+                if retry_after != None and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                if attempt < self.retries - 1:
+                    await asyncio.sleep(delay)
+        raise IOError("{0} {1}{2} failed: {3}".format(method, url, path, error))
+
+    async def aquery(self, ids, scopes, fields = "symbol", species = "human"):
+        """
+        Coroutine of query()
+        """
+        ids = list(dict.fromkeys(str(x) for x in ids))
+        batches = [ids[i:i+self.batch_size] for i in range(0, len(ids), self.batch_size)]
+        answers = await asyncio.gather(*[self.request(self.mygene_url, "POST", "/query",
+            urlencode({"q": ",".join(batch), "scopes": scopes, "fields": fields, "species": species}).encode(),
+            {"Content-Type": "application/x-www-form-urlencoded"}) for batch in batches])
+        return [line for answer in answers for line in answer]
+
+    def query(self, ids, scopes, fields = "symbol", species = "human"):
+        """
+        Looks up gene IDs in MyGene.info (same answer format as mygene.MyGeneInfo().querymany())
+
+        Attributes:
+        -----------
+        ids - gene IDs
+        scopes - type of the IDs, e.g. 'entrezgene', 'ensembl.gene', 'symbol'
+        fields - fields of the answer (default 'symbol')
+        species - (default 'human')
+
+        Returns a list of dictionaries with the query and the fields (or notfound) for every ID
+        """
+        return asyncio.run(self.aquery(ids, scopes, fields, species))
+
+    async def _enrich_list(self, name, genes, library):
+        genes = [str(g) for g in genes]
+        # boundary derived from the content so that cached requests are found again
+        boundary = "bigants" + hashlib.sha1("\n".join(genes + [str(name)]).encode()).hexdigest()
+        added = await self.request(self.enrichr_url, "POST", "/addList", multipart({"list": "\n".join(genes), "description": str(name)}, boundary),
+                                   {"Content-Type": "multipart/form-data; boundary=" + boundary})
+        answer = await self.request(self.enrichr_url, "GET", "/enrich?" + urlencode({"userListId": added["userListId"], "backgroundType": library}))
+        table = pd.DataFrame([row[:len(ENRICHR_COLUMNS)] for row in answer.get(library, [])], columns = ENRICHR_COLUMNS)
+        table["genes"] = [";".join(g) for g in table["genes"]]
+        table.insert(0, "list", name)
+        table.insert(1, "library", library)
+        return table
+
+    async def aenrich(self, gene_lists, library):
+        """
+        Coroutine of enrich()
+        """
+        tables = await asyncio.gather(*[self._enrich_list(name, genes, library) for name, genes in gene_lists.items()])
+        return pd.concat(tables, ignore_index = True) if len(tables) > 0 else pd.DataFrame(columns = ["list", "library"] + ENRICHR_COLUMNS)
+
+    def enrich(self, gene_lists, library):
+        """
+        Enrichr analysis of several gene lists at the same time
+
+        Attributes:
+        -----------
+        gene_lists - dictionary name -> list of gene symbols
+        library - Enrichr library, e.g. 'GO_Biological_Process_2018'
+
+        Returns a pandas data frame with one row per list and term
+        """
+        return asyncio.run(self.aenrich(gene_lists, library))
+
+    async def aannotate(self, results, origID = None, library = None, species = "human"):
+        """
+        Coroutine of annotate()
+        """
+        if origID != None:
+            genes = [g for r in results for g in r.genes1 + r.genes2]
+            out = await self.aquery(genes, origID, "symbol", species)
+            symbols = dict()
+            for line in out:
+                if "symbol" in line:
+                    symbols.setdefault(line["query"], line["symbol"])
+            for r in results:
+                r.mapping = {g: symbols.get(g, g) for g in r.genes1 + r.genes2}
+                r.convert, r.origID = True, origID
+        if library == None:
+            return None
+        names = lambda r, genes: [r.mapping[g] for g in genes] if r.convert else genes
+        gene_lists = {i: names(r, r.genes1 + r.genes2) for i, r in enumerate(results)}
+        return await self.aenrich(gene_lists, library)
+
+    def annotate(self, results, origID = None, library = None, species = "human"):
+        """
+        Annotates many solutions at once: the gene IDs of all of them are converted with batched MyGene.info
+        queries (the mapping of every results_analysis object is set) and the enrichment of their genes is
+        computed with concurrent Enrichr requests
+
+        Attributes:
+        -----------
+        results - list of results_analysis objects
+        origID - original gene ID type, e.g. 'entrezgene' (default - None, IDs are not converted)
+        library - Enrichr library (default - None, no enrichment analysis)
+        species - (default 'human')
+
+        Returns the Enrichr results (column list is the position in results) or None
+        """
+        return asyncio.run(self.aannotate(results, origID, library, species))
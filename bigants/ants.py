@@ -3,30 +3,56 @@
 
 import multiprocessing as mp
 from multiprocessing import Process, Queue
+import queue
 import time
 import pandas as pd
 import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
-from sklearn import preprocessing
 flatten = lambda l: [item for sublist in l for item in sublist]
-import seaborn as sns; sns.set(color_codes=True)
-from sklearn.cluster import KMeans
+from scipy import sparse
 import gc
+# plotting (matplotlib, seaborn) and sklearn are imported inside the functions
+# that use them, so that importing the package and starting workers stays cheap
+from bigants import _plotting
+from bigants import kernels
+from bigants import planner
+from bigants.adaptive import AntScheduler, solution_key
+from bigants.convergence import make_monitor
+from bigants.snapshots import SnapshotRecorder
+from bigants.precision import Precision, P_SCALE, INT16_MAX
 
 
+def indicator(groups, size, offset = 0):
+    # sparse (len(groups) x size) matrix with 1/|group| at the members of each group,
+    # multiplying with it averages over the groups. IDs are shifted by offset (n for patients)
+    lens = [len(g) for g in groups]
+    rows = np.repeat(np.arange(len(groups)), lens)
+    cols = np.asarray(flatten([list(g) for g in groups]), dtype = int) - offset
+    vals = np.repeat([1/l if l > 0 else 0 for l in lens], lens)
+    return sparse.csr_matrix((vals, (rows, cols)), shape = (len(groups), size))
+
 
 class BiGAnts(object):
+    # more patients than genes are allowed (set by SingleCellBiGAnts)
+    wide = False
+
     def __init__(self, GE, G, L_g_min, L_g_max):
         self.GE = GE
         self.G = G
         self.L_g_min = L_g_min
         self.L_g_max = L_g_max
+        self.H = None
+        # precision policy of the cached heuristic information
+        self.H_precision = None
+        # pheromone levels and best solution of the last run, see save_state() and run_search(warm = ...)
+        self.state = None
+        # statistics of the last run (plan, ...)
+        self.run_stats = dict()
     
         
     def run_search(self, n_proc = 1, a = 1, b = 1, K = 20, evaporation = 0.5, th = 0.5, eps = 0.02, 
             times = 6, clusters = 2, cost_limit = 5, max_iter = 200, opt = None,show_pher = False, 
-            show_plot = False, save = None, show_nets = False):
+            show_plot = False, save = None, show_nets = False, prep = None, backend = "auto", cand_k = None, cand_net = False, warm = None, compact = False, memory = None, precision = "short", asynchronous = False, staleness = 2, K_min = None, K_max = None, monitor = None, record = None):
         """
         Parallel implementation of bi-graph Ant Colony Optimisation for Biclustering 
         
@@ -48,36 +74,81 @@ class BiGAnts(object):
         th - similarity threshold (default 0.5 - does not need to be changed)
         eps - conservative convergence criteria: score_max - score_min < eps (default- 0.02)
         times - allows faster convergence criteria: stop if the maximum so far was reached more than x times (default 6)
-        clusters - # of clusters, right now does not work for more than 2
+        clusters - # of clusters (default 2)
         cost_limit - defines the radius of the search for ants (default 5)
         max_iter - maximum number of itaractions allowed (default 200)
         opt - given if the best score is known apriori (in case of simulated data for instance)
-        show_pher - set true if plotting of pheromone heatmap at every iteration is desirable (strickly NOT recommended for # of genes > 2000)
+        show_pher - set true if plotting of pheromone heatmap at every iteration is desirable (strickly NOT recommended for # of genes > 2000,
+            use record to follow the pheromones of large runs)
         show_plot - set true if convergence plots should be shown
         save - set an output file name  if the convergence plot should be saved in the end
         show_nets - set true if the selected network should be shown at each iteration
+        prep - output of prepare(th) to reuse the data dependent precomputation between several runs (default - computed here)
+        backend - "numba" runs the random walks and the pheromone deposit as JIT compiled kernels, "numpy" - pure NumPy, 
+            "auto" - numba if it is installed (default "auto")
+        cand_k - if given, the search area of each patient is its candidate list: the cand_k nodes with the highest
+            heuristic value instead of all nodes above the th threshold. Bounds the size of the probability tables and
+            the cost per step independently of the number of genes (default - None, use th)
+        cand_net - add the network neighbours of the candidate genes to the candidate lists (default - False)
+        warm - state of a previous run (model.state or load_state()) to continue from its pheromone levels and its
+            best solution, e.g. after new patients were added with add_patients(). Pheromones of the new patients
+            start at the initial level (default - None, cold start)
+        compact - keep only the rows of the search area in the probability tables of each patient instead of all
+            n+m rows. The walks are the same, the memory is much lower. Always used with cand_k (default - False)
+        memory - memory budget in GB. If given, the representation (dense, compact or candidate lists) and the number
+            of processes (up to n_proc) are chosen to fit into it before anything is allocated (default - None).
+            The plan is printed with the run time statistics and kept in model.run_stats["plan"]
+        precision - storage of heuristic information, pheromones, probabilities and costs: "short" - the heuristic
+            information is truncated to integers and everything else is float64 (original behaviour), "float32" -
+            float32 everywhere with in place updates, "int16" - int16 fixed point, the least memory (default "short")
+        asynchronous - with n_proc > 1, the processes run ants continuously without waiting for each other. Pheromones are
+            updated after every ant and the probability tables are republished after every n_proc ants. K evaluated ants
+            count as one iteration for the convergence criteria (default - False)
+        staleness - in asynchronous mode, ants that used probability tables more than staleness versions older than the
+            current ones are discarded (default 2)
+        K_min, K_max - if any of them is given, the number of ants changes between K_min and K_max in every iteration
+            (starting from K): it grows while the ants find many different solutions or their scores vary, and shrinks
+            when nearly all ants return the same solution. A missing bound is K. The number of ants of every iteration
+            is kept in model.run_stats["K"] (default - None, K ants in every iteration)
+        monitor - stopping rule that replaces eps and times: "stagnation" stops when the best bicluster and the trend of the
+            scores have both reached a plateau (see convergence.StagnationMonitor), or any convergence.Monitor object.
+            max_iter still applies. The reason of the stop is kept in model.run_stats["stop"] (default - None, eps and times)
+        record - snapshot file name or snapshots.SnapshotRecorder: downsampled (or top-k) pheromone matrices and probability
+            table statistics are appended to the file every 10 iterations (or every N of the recorder) and after the last one.
+            Look at them with bigants-snapshots or bigants.snapshots.plot() (default - None)
         
         """
-        assert self.GE.shape[0] > self.GE.shape[1], "Wrong dimensions of the expression matrix, please pass the transposed version"
+        assert self.wide or self.GE.shape[0] > self.GE.shape[1], "Wrong dimensions of the expression matrix, please pass the transposed version"
         assert n_proc>0, "Set a correct number for n_proc, right now the value is {0}".format(n_proc)
         assert n_proc <= mp.cpu_count()-1, 'n_proc should not exceed {0}. The value of n_proc was: {1}'.format(mp.cpu_count(), n_proc)
         assert n_proc <= K, 'Number of ants (K) can not be lower as number of processes, please set higher K ot lower n_proc'
-        #adjacency matrix 
-        A = nx.adj_matrix(self.G).todense()
-        #hurisic information 
-        H = self.HI_big(self.GE, A)
-        H = H.astype(np.short)
-        
+        backend = kernels.select(backend)
         n,m = self.GE.shape
-        # TODO: rewrite functions such that they all could use numpy matrices
-        ge = self.GE.values
-        # determination of search radious for each patient
-        N = self.neigborhood(H, n, th)
-        # inner patients IDs
-        patients = np.arange(n, n+m)  
-        #cost of transitions for ants
-        cost = H/10
-        cost = np.max(cost)-cost
+        if prep == None:
+            plan = planner.plan_search(n, m, K, n_proc, memory, th, cand_k, backend = backend, precision = precision,
+                                       modes = None if memory != None else [self.mode(cand_k, compact)])
+            cand_k, compact = plan["cand_k"], plan["compact"]
+            prep = self.prepare(th, cand_k, cand_net, compact, precision)
+        else:
+            # the representation is fixed by prep, only the number of processes is planned
+            plan = planner.plan_search(n, m, K, n_proc, memory, th, prep["cand_k"], np.mean([len(x) for x in prep["N"]]),
+                                       [self.mode(prep["cand_k"], prep["rows"] is not None)], backend, prep["precision"].name)
+        n_proc = plan["n_proc"]
+        self.run_stats = {"plan": plan}
+        assert prep["th"] == th, "prep was computed for th = {0}, but th = {1} was given".format(prep["th"], th)
+        assert prep["cand_k"] == cand_k and prep["cand_net"] == cand_net, "prep was computed with different candidate list settings"
+        assert (prep["rows"] is not None) == (compact or cand_k != None), "prep was computed with a different compact setting"
+        assert prep["precision"].name == precision, "prep was computed for precision = {0}".format(prep["precision"].name)
+        pr_policy = prep["precision"]
+        # costs are stored in fixed point for int16
+        cost_limit = cost_limit*pr_policy.cost_scale
+        H = prep["H"]
+        n,m = prep["n"], prep["m"]
+        ge = prep["ge"]
+        N = prep["N"]
+        rows = prep["rows"]
+        patients = prep["patients"]
+        cost = prep["cost"]
         #stores all scores
         scores = []
         avs = []
@@ -85,25 +156,70 @@ class BiGAnts(object):
         max_total_score = 0
         max_round_score = -100
         av_score = 0
+        best_solution, solution_big_best = None, None
         # initial pheramone level set to a maximal possible level (5 standart deviations)
-        t0 = np.ones((n+m, n+m))*5
-        t0 = t0.astype(np.short)
+        t0 = pr_policy.pheromone(n+m, 5)
         t_min = 0
-        #initial probabilities 
+        if warm != None:
+            assert warm.get("precision", "short") == precision, "the warm start state was computed for precision = {0}".format(warm.get("precision", "short"))
+            t0 = self.extend_pher(warm["pher"], n+m, 5*pr_policy.t_scale)
+            # the best solution of the previous run is scored again on the current patients
+            no_int = [list(g) for g in warm["solution"][0]]
+            if len(no_int) == clusters:
+                patients_groups = self.cluster_patients(ge, no_int, clusters, patients, n)
+                gene_groups, sizes = self.clean_net(no_int, patients_groups, clusters, self.L_g_min, self.G, ge)
+                new_scores = self.score(self.G, patients_groups, gene_groups, n, m, ge, sizes, self.L_g_min, self.L_g_max)
+                max_total_score = sum(sc[0]*sc[1] for sc in new_scores)
+                best_solution = (gene_groups, patients_groups)
+                solution_big_best = (no_int, patients_groups)
+            else:
+                print("WARNING: the warm start solution has {0} clusters instead of {1}, only the pheromones are reused".format(len(no_int), clusters))
+        #initial probabilities (shared between runs with the same prep)
         st = time.time()
-        probs= self.prob_upd(H, t0, a, b, n, th, N)
+        if warm != None:
+            probs = self.prob_upd(H, t0, a, b, n, th, N, rows, pr_policy)
+        else:
+            if (a,b) not in prep["probs"]:
+                prep["probs"][(a,b)] = self.prob_upd(H, t0, a, b, n, th, N, rows, pr_policy)
+            probs = prep["probs"][(a,b)]
+        # flat copy of the probabilities for the compiled walks
+        flat = kernels.flatten_probs(probs, N, rows) if backend == "numba" else None
         end = time.time()
         # flag tracks when the score stops improoving and terminates the optimization as convergence is reached
         score_change = []
         print ("Run time statistics:")
         print ("###############################################################")
         print("the joint graph has "+ str(n+m) + " nodes")
+        print("average search area size is {0}".format(round(np.mean([len(x) for x in N]), 1)))
+        print(planner.describe(plan))
         print("probability update takes "+str(round(end-st,3)))
+        print("{0} backend is used for the random walks".format(backend))
         W = 0 #warnongs
         #counts how many times top score was achieved
         count_small = 0            
+        #number of evaluated ants
+        ants = 0
+        if monitor != None:
+            monitor = make_monitor(monitor)
+        stopped = False
+        if isinstance(record, str):
+            record = SnapshotRecorder(record)
+        scheduler = None
+        if K_min != None or K_max != None:
+            assert not asynchronous, "K_min and K_max are not supported in the asynchronous search"
+            scheduler = AntScheduler(K, K_min if K_min != None else K, K_max if K_max != None else K)
+            assert scheduler.K_min >= n_proc, "K_min can not be lower than the number of processes"
+        if asynchronous:
+            assert n_proc > 1, "asynchronous search needs n_proc > 1"
+            assert staleness >= 0, "staleness should be non-negative, the value was: {0}".format(staleness)
+            res = self.run_async(prep, probs, t0, t_min, a, b, K, n_proc, evaporation, eps, times, clusters, cost_limit, max_iter,
+                                 backend, staleness, (max_total_score, best_solution, solution_big_best), monitor, record)
+            t0, max_total_score, best_solution, solution_big_best, count_big, scores, avs, ants, count_small, stopped, max_round_score, av_score = res
         #termination if the improvments are getting too small or if there are any computentional warnings
-        while np.abs(max_round_score-av_score)>eps and count_small<times and count_big < max_iter:
+        while not asynchronous and count_big < max_iter and (not stopped if monitor != None else np.abs(max_round_score-av_score)>eps and count_small<times):
+            K_round = scheduler.K if scheduler != None else K
+            #scores and solutions of all ants of this round for the scheduler
+            round_scores, round_keys = [], []
             #MULTIPROCESSING SCHEMA
             if n_proc > 1:
                 av_score = 0
@@ -111,11 +227,11 @@ class BiGAnts(object):
                 max_round_score = 0
                 result = Queue()
                 jobs = []
-                ants_per_batch = round(K/n_proc)
+                ants_per_batch = round(K_round/n_proc)
                 for pr in range(n_proc):
-                    #random seed to avoid identical random walks
-                    ss = np.random.choice(np.arange(pr*ants_per_batch, pr*ants_per_batch+ants_per_batch), ants_per_batch,replace = False)
-                    p = Process(target = self.ant_job_paral, args = (self.GE, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, self.L_g_min, self.L_g_max, self.G, ge, ants_per_batch, pr, ss, result,))
+                    #new random seeds from the parent generator in every iteration to avoid identical random walks
+                    ss = np.random.randint(2**31-1, size = ants_per_batch)
+                    p = Process(target = self.ant_job_paral, args = (N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, self.L_g_min, self.L_g_max, self.G, ge, ants_per_batch, pr, ss, result, flat, rows,))
                     jobs.append(p)
                     p.start()
                 # black magic to synchronize the whole thing 
@@ -123,16 +239,16 @@ class BiGAnts(object):
                     running = any(p.is_alive() for p in jobs)
                     while not result.empty():
                         res = result.get()
-                        s1,s2 = res[0]
-                        s = s1+s2
-                        av_score = av_score+res[-1]
+                        s = sum(res[0])
+                        av_score = av_score+res[3]
+                        round_scores.extend(res[4])
+                        round_keys.extend(res[5])
                         #if maximum round score is begger than the current value for this round
                         if s>max_round_score:
                             #save the results
                             max_round_score = s
-                            n1 = s1
-                            n2 = s2
-                            solution,solution_big,_ = res[1:]
+                            group_scores = res[0]
+                            solution,solution_big = res[1:3]
                     if not running:
                         break
         
@@ -142,6 +258,7 @@ class BiGAnts(object):
                 #after all ants have finished:
                 scores.append(max_round_score)
                 avs.append(av_score)
+                ants = ants + ants_per_batch*n_proc
                 gc.collect()
     
     
@@ -153,21 +270,24 @@ class BiGAnts(object):
                 max_round_score = 0
                 scores_per_round = []
                 st = time.time()
-                for i in range(K):
+                for i in range(K_round):
                     #for each ant
-                    tot_score, gene_groups, patients_groups, new_scores, wars, no_int = self.ant_job(self.GE, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, self.L_g_min, self.L_g_max, self.G, ge)
+                    tot_score, gene_groups, patients_groups, new_scores, wars, no_int = self.ant_job(N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, self.L_g_min, self.L_g_max, self.G, ge, flat = flat, rows = rows)
                     end = time.time()
                     W = W+wars
                     scores_per_round.append(tot_score)
+                    round_scores.append(tot_score)
+                    round_keys.append(solution_key(gene_groups))
                     av_score = av_score + tot_score
                     if tot_score > max_round_score:
                         max_round_score = tot_score
                         solution = (gene_groups,patients_groups)
                         solution_big = (no_int,patients_groups)
-                        n1,n2 = (new_scores[0][0]*new_scores[0][1],new_scores[1][0]*new_scores[1][1])
+                        group_scores = [sc[0]*sc[1] for sc in new_scores]
     
-                av_score = av_score/K
+                av_score = av_score/K_round
                 avs.append(av_score)
+                ants = ants + K_round
                 #after all ants have finished:
                 scores.append(max_round_score)
                 if max_round_score == max_total_score:
@@ -193,18 +313,27 @@ class BiGAnts(object):
             print("best round score: " + str(round(max_round_score, 3)))
             print("average score: " + str(round(av_score, 3)))
             print("Count small = {}".format(count_small))
+            if monitor != None:
+                stopped = monitor.update(solution, max_round_score, av_score)
+            if scheduler != None:
+                print("{0} ants, {1} in the next iteration".format(len(round_scores), scheduler.update(round_scores, round_keys)))
             #Pheramone update
-            t0 = self.pher_upd(t0,t_min,evaporation,[n1,n2],solution_big_best)
+            t0 = self.pher_upd(t0,t_min,evaporation,group_scores,solution_big_best, backend, pr_policy)
             #Probability update    
-            probs= self.prob_upd(H, t0, a, b, n, th, N)
+            probs= self.prob_upd(H, t0, a, b, n, th, N, rows, pr_policy)
+            if backend == "numba":
+                flat = kernels.flatten_probs(probs, N, rows)
             assert probs[0][0,:].sum() != 0, "bad probability update"
             if count_big == 0:
                 print("One full iteration takes {0} with {1} processes".format(round(time.time()-st,2), n_proc))
             count_big = count_big +1
+            if record != None:
+                record.record(count_big, t0, probs, max_round_score, av_score, n, pr_policy.t_scale)
             #visualization options:
     
             
             if show_pher:
+                plt = _plotting.pyplot()
                 fig = plt.figure(figsize=(18,12))
                 ax = fig.add_subplot(111)
                 t_max = np.max(t0)   
@@ -218,6 +347,7 @@ class BiGAnts(object):
             if show_nets:
                 self.features(solution, self.GE,self.G)    
             if show_plot:
+                plt = _plotting.pyplot()
                 fig = plt.figure(figsize=(10,8))
                 plt.plot(np.arange(count_big),scores, 'g-')
                 plt.plot(np.arange(count_big),avs, '--')
@@ -227,23 +357,32 @@ class BiGAnts(object):
                 plt.close(fig)
     
         if save != None:
+            plt = _plotting.pyplot()
             fig = plt.figure(figsize=(10,8))
             plt.plot(np.arange(count_big),scores, 'g-')
             plt.plot(np.arange(count_big),avs, '--')
             plt.savefig(save+".png")
             plt.close(fig)
             
+        self.run_stats["ants"] = ants
+        if record != None:
+            if count_big % record.every != 0:
+                record.record(count_big, t0, None if asynchronous else probs, max_round_score, av_score, n, pr_policy.t_scale, force = True)
+            self.run_stats["record"] = record.overhead
+            print("pheromone snapshots took {0}s".format(round(record.overhead, 3)))
+        if count_big >= max_iter and not stopped:
+            self.run_stats["stop"] = "max_iter"
+        elif monitor != None:
+            self.run_stats["stop"] = "monitor"
+        else:
+            self.run_stats["stop"] = "times" if count_small >= times else "eps"
+        if scheduler != None:
+            self.run_stats["K"] = scheduler.history
+        print("{0} ants were evaluated".format(ants))
+        # state for a warm start of a later run
+        self.state = {"pher": t0, "solution": solution_big_best, "score": max_total_score, "H": self.H, "precision": precision}
         #after the solutution is found we make sure to cluster patients the last time with that exact solution:
-        data_new = ge[solution[0][0]+solution[0][1],:]
-        kmeans = KMeans(n_clusters=2, random_state=0).fit(data_new.T)
-        labels = kmeans.labels_
-        patients_groups =[]
-        for clust in range(clusters):
-            wh = np.where(labels == clust)[0]
-            group_p = [patients[i] for i in wh]
-            patients_groups.append(group_p)
-        if np.mean(ge[best_solution[0][0],:][:,(np.asarray(patients_groups[0])-n)])<np.mean(ge[best_solution[0][1],:][:,(np.asarray(patients_groups[0])-n)]):
-            patients_groups = patients_groups[::-1]
+        patients_groups = self.cluster_patients(ge, best_solution[0], clusters, patients, n)
         best_solution = [best_solution[0],patients_groups]
         
         print("best total score: "+str(max_total_score))
@@ -252,32 +391,298 @@ class BiGAnts(object):
         return(best_solution,[count_big, scores, avs])
     
 
-    def ant_job_paral(self, GE, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, ants_per_batch, pr, ss, result):
+    def run_async(self, prep, probs, t0, t_min, a, b, K, n_proc, evaporation, eps, times, clusters, cost_limit, max_iter, backend, staleness, best, monitor = None, record = None):
+        # asynchronous search: n_proc processes run ants continuously on the newest probability tables they find
+        # in a shared ring buffer. Here results are consumed as they arrive: every ant evaporates the pheromones by
+        # 1-(1-evaporation)^(1/K) and deposits its group scores / K on the best solution, so K ants correspond to one
+        # synchronous iteration. The updates of the ants are applied in place, together before the tables are
+        # recomputed and published after every n_proc ants (and at the end of an iteration). The buffer has
+        # staleness+2 slots, so a slot is only overwritten when its ants are too old to be accepted anyway.
+        H, N, rows, n, m, th = prep["H"], prep["N"], prep["rows"], prep["n"], prep["m"], prep["th"]
+        pr_policy = prep["precision"]
+        P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len = kernels.flatten_probs(probs, N, rows)
+        heights = np.asarray([P.shape[0] for P in probs], dtype = np.int64)
+        layout = (P_off, widths, heights, N_flat, N_off, R_flat, R_off, R_len, P_flat.dtype, P_flat.size)
+        slots = staleness + 2
+        typecode = {np.dtype(np.float64): "d", np.dtype(np.float32): "f", np.dtype(np.int16): "h"}[P_flat.dtype]
+        shared = mp.RawArray(typecode, P_flat.size*slots)
+        buffer = np.frombuffer(shared, dtype = P_flat.dtype)
+        buffer[:P_flat.size] = P_flat
+        del P_flat
+        version = mp.RawValue("l", 0)
+        lock = mp.Lock()
+        stop = mp.Event()
+        result = Queue()
+        jobs = []
+        for pr in range(n_proc):
+            p = Process(target = self.ant_job_async, args = (N, H, th, clusters, a, b, prep["cost"], m, n, prep["patients"], cost_limit, self.L_g_min, self.L_g_max, self.G, prep["ge"], layout, rows, shared, slots, version, lock, stop, result, np.random.randint(2**31-1), backend == "numba",))
+            jobs.append(p)
+            p.start()
+        p_ant = 1-(1-evaporation)**(1/K)
+        if pr_policy.name == "short":
+            #the initial short matrix is int16, the pheromones are float64 after the first update
+            t0 = t0.astype(np.float64)
+        #(group scores, best solution) of the ants since the last update
+        pending = []
+        max_total_score, best_solution, solution_big_best = best
+        scores, avs = [], []
+        count_big, count_small, ants, stale, accepted = 0, 0, 0, 0, 0
+        max_round_score, av_score, round_total = -100, 0, 0
+        improved, stopped = False, False
+        current = 0
+        st = time.time()
+        try:
+            while count_big < max_iter and (not stopped if monitor != None else np.abs(max_round_score-av_score)>eps and count_small<times):
+                try:
+                    res = result.get(timeout = 1)
+                except queue.Empty:
+                    assert any(p.is_alive() for p in jobs), "all ant processes have stopped"
+                    continue
+                v = res[0]
+                ants = ants + 1
+                if current - v > staleness:
+                    stale = stale + 1
+                    continue
+                assert res[1] != None, "ant failed: {0}".format(res[2])
+                tot_score, gene_groups, patients_groups, group_scores, no_int = res[1:]
+                if tot_score > max_total_score or solution_big_best == None:
+                    max_total_score = tot_score
+                    best_solution = (gene_groups, patients_groups)
+                    solution_big_best = (no_int, patients_groups)
+                    improved = True
+                if accepted % K == 0 or tot_score > max_round_score:
+                    max_round_score = tot_score
+                    round_solution = (gene_groups, patients_groups)
+                round_total = round_total + tot_score
+                accepted = accepted + 1
+                pending.append(([sc/K for sc in group_scores], solution_big_best))
+                if accepted % n_proc == 0 or accepted % K == 0:
+                    t0 = self.pher_upd_batch(t0, t_min, p_ant, pending, backend, pr_policy)
+                    pending = []
+                if accepted % n_proc == 0:
+                    #publish new tables in the next slot
+                    probs = self.prob_upd(H, t0, a, b, n, th, N, rows, pr_policy)
+                    current = current + 1
+                    P_new = buffer[(current % slots)*layout[-1]:(current % slots+1)*layout[-1]]
+                    for w, P in enumerate(probs):
+                        P_new[P_off[w]:P_off[w]+P.size] = P.ravel()
+                    with lock:
+                        version.value = current
+                if accepted % K == 0:
+                    #K ants are one iteration for the convergence criteria
+                    av_score = round_total/K
+                    round_total = 0
+                    scores.append(max_round_score)
+                    avs.append(av_score)
+                    #same rule as the synchronous search: count how often the best score is reached again
+                    if np.round(max_round_score,3) == np.round(max_total_score, 3):
+                        count_small = count_small +1
+                    if improved:
+                        count_small = 0
+                    improved = False
+                    if monitor != None:
+                        stopped = monitor.update(round_solution, max_round_score, av_score)
+                    count_big = count_big + 1
+                    if record != None:
+                        record.record(count_big, t0, probs, max_round_score, av_score, n, pr_policy.t_scale)
+                    print("Iteration # {0} ({1} ants, {2} stale, {3}s)".format(count_big, ants, stale, round(time.time()-st, 2)))
+                    print("best round score: " + str(round(max_round_score, 3)))
+                    print("average score: " + str(round(av_score, 3)))
+                    print("Count small = {}".format(count_small))
+        finally:
+            stop.set()
+            for p in jobs:
+                while p.is_alive():
+                    try:
+                        result.get(timeout = 0.1)
+                    except queue.Empty:
+                        pass
+                p.join()
+        if len(pending) > 0:
+            t0 = self.pher_upd_batch(t0, t_min, p_ant, pending, backend, pr_policy)
+        self.run_stats["stale"] = stale
+        if len(scores) > 0:
+            #scores of the last full iteration, results after it could already have changed max_round_score
+            max_round_score, av_score = scores[-1], avs[-1]
+        return t0, max_total_score, best_solution, solution_big_best, count_big, scores, avs, ants, count_small, stopped, max_round_score, av_score
+
+    def ant_job_async(self, N, H, th, clusters, a, b, cost, m, n, patients, cost_limit, L_g_min, L_g_max, G, ge, layout, rows, shared, slots, version, lock, stop, result, seed, compiled):
+        # worker of run_async(): runs ants on the newest published probability tables until stop is set
+        np.random.seed(seed)
+        P_off, widths, heights, N_flat, N_off, R_flat, R_off, R_len, dtype, size = layout
+        buffer = np.frombuffer(shared, dtype = dtype)
+        while not stop.is_set():
+            with lock:
+                v = version.value
+            P_flat = buffer[(v % slots)*size:(v % slots+1)*size]
+            probs = [P_flat[P_off[w]:P_off[w]+heights[w]*widths[w]].reshape(heights[w], widths[w]) for w in range(m)]
+            flat = (P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len) if compiled else None
+            try:
+                tot_score, gene_groups, patients_groups, new_scores, wars, no_int = self.ant_job(N, H, th, clusters, probs, a, b, cost, m, n, patients, 0, cost_limit, L_g_min, L_g_max, G, ge, flat = flat, rows = rows)
+            except ValueError as e:
+                #the tables can be overwritten while a very slow ant reads them, such results are stale anyway
+                result.put([v, None, str(e)])
+                continue
+            result.put([v, tot_score, gene_groups, patients_groups, [sc[0]*sc[1] for sc in new_scores], no_int])
+
+    def cluster_patients(self, ge, gene_groups, clusters, patients, n):
+        # k-means clustering of patients on the genes of a solution, oriented to the gene groups
+        from sklearn.cluster import KMeans
+        data_new = ge[flatten(gene_groups),:]
+        kmeans = KMeans(n_clusters=clusters, random_state=0).fit(data_new.T)
+        labels = kmeans.labels_
+        patients_groups =[]
+        for clust in range(clusters):
+            wh = np.where(labels == clust)[0]
+            group_p = [patients[i] for i in wh]
+            patients_groups.append(group_p)
+        return self.orient(ge, gene_groups, patients_groups, n)
+
+    def add_patients(self, GE_new):
+        """
+        Appends new patients to the model. The gene-gene block of the heuristic information is kept,
+        only the gene-patient columns of the new patients and the patient-patient block are computed.
+        The search can then be continued with run_search(warm = model.state).
+        
+        Attributes:
+        -----------
+        GE_new - processed expression of the new patients with the same genes (rows) as the model,
+            columns are the next internal patient IDs, see new_patients_preprocessing()
+        """
+        n,m = self.GE.shape
+        assert list(GE_new.index) == list(self.GE.index), "The new patients should have the same genes as the model"
+        assert list(GE_new.columns) == list(range(n+m, n+m+GE_new.shape[1])), "The new patients should have the internal IDs {0}...{1}".format(n+m, n+m+GE_new.shape[1]-1)
+        GE = pd.concat([self.GE, GE_new], axis = 1)
+        if self.H is not None:
+            self.H = self.HI_extend(self.H, GE, m, Precision(self.H_precision))
+        self.GE = GE
+
+    def extend_pher(self, t, dim, level = 5):
+        # pheromone matrix of a smaller graph (before new patients were added) padded with the initial level
+        if len(t) == dim:
+            return np.copy(t)
+        assert len(t) < dim, "The pheromone matrix is larger than the current graph"
+        t_new = np.full((dim, dim), level, dtype = t.dtype)
+        t_new[:len(t),:len(t)] = t
+        return t_new
+
+    def save_state(self, path):
+        """
+        Saves the pheromone levels, the best solution and the heuristic information of the last run (compressed .npz)
+        """
+        assert self.state != None, "There is no state to save, run the search first"
+        arrays = {"pher": self.state["pher"], "score": np.asarray(self.state["score"]), "precision": np.asarray(self.state["precision"])}
+        if self.state["H"] is not None:
+            arrays["H"] = self.state["H"]
+        for i, (g, p) in enumerate(zip(*self.state["solution"])):
+            arrays["genes{0}".format(i)] = np.asarray(g, dtype = int)
+            arrays["patients{0}".format(i)] = np.asarray(p, dtype = int)
+        np.savez_compressed(path, **arrays)
+
+    def load_state(self, path):
+        """
+        Loads a state written by save_state(). The heuristic information is reused (and extended
+        if patients were added since then), the state is returned and kept in model.state
+        """
+        data = np.load(path)
+        k = len([x for x in data.files if x.startswith("genes")])
+        solution = ([list(data["genes{0}".format(i)]) for i in range(k)], [list(data["patients{0}".format(i)]) for i in range(k)])
+        precision = str(data["precision"]) if "precision" in data.files else "short"
+        H = data["H"] if "H" in data.files else None
+        if H is not None:
+            n,m = self.GE.shape
+            if len(H) < n+m:
+                H = self.HI_extend(H, self.GE, len(H)-n, Precision(precision))
+            assert len(H) == n+m, "The saved heuristic information does not match the expression data"
+            self.H = H
+            self.H_precision = precision
+        self.state = {"pher": data["pher"], "solution": solution, "score": float(data["score"]), "H": H, "precision": precision}
+        return self.state
+
+    def mode(self, cand_k, compact):
+        # name of the representation of the probability tables, see planner.MODES
+        if cand_k != None:
+            return "candidate"
+        return "sparse" if compact else "dense"
+
+    def prepare(self, th = 0.5, cand_k = None, cand_net = False, compact = False, precision = "short"):
+        """
+        Computes everything run_search() needs that depends only on the data and on th:
+        heuristic information H, transition costs and the search area of each patient.
+        The heuristic information is computed once per model (and precision) and reused for other values of th.
+        
+        Attributes:
+        -----------
+        th - similarity threshold (default 0.5)
+        cand_k - size of the candidate list of each patient, see run_search() (default - None)
+        cand_net - add network neighbours to the candidate lists (default - False)
+        compact - probability tables only with the rows of the search area, see run_search() (default - False)
+        precision - precision policy, see run_search() (default "short")
+        
+        Returns a dictionary that can be passed to run_search(prep = ...) for any number of runs
+        with the same th, cand_k, cand_net, compact and precision. Initial probabilities are added to it by run_search() for each (a, b).
+        """
+        policy = Precision(precision)
+        if getattr(self, "H", None) is None or getattr(self, "H_precision", None) != precision:
+            self.H = None
+            #adjacency matrix 
+            A = nx.adj_matrix(self.G).todense()
+            #hurisic information 
+            self.H = self.HI_big(self.GE, A, policy)
+            self.H_precision = precision
+        H = self.H
+        n,m = self.GE.shape
+        # determination of search radious for each patient
+        N = self.neigborhood(H, n, th, cand_k, self.G if cand_net else None)
+        # rows of the compact probability tables: the search area and the patient itself
+        rows = None
+        if compact or cand_k != None:
+            rows = [np.union1d(N[w], [n+w]) for w in range(m)]
+        #cost of transitions for ants
+        cost = policy.cost(H)
+        # inner patients IDs
+        patients = np.arange(n, n+m)
+        return {"th": th, "cand_k": cand_k, "cand_net": cand_net, "H": H, "N": N, "rows": rows, "cost": cost, "ge": self.GE.values, "n": n, "m": m, "patients": patients, "probs": dict(), "precision": policy}
+
+    def ant_job_paral(self, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, ants_per_batch, pr, ss, result, flat = None, rows = None):
         # organising parallel distribution of work between ants batches
         max_round_score = -100
         W = 0
         av_score = 0
+        ant_scores, keys = [], []
         for i in range(ants_per_batch):
             seed = ss[i]
-            tot_score, gene_groups, patients_groups, new_scores, wars, no_int = self.ant_job(GE, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, seed)
+            tot_score, gene_groups, patients_groups, new_scores, wars, no_int = self.ant_job(N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, seed, flat, rows)
             W = W+wars
             av_score = av_score+ tot_score
+            ant_scores.append(tot_score)
+            keys.append(solution_key(gene_groups))
             if tot_score > max_round_score:
                 max_round_score = tot_score
                 solution = (gene_groups,patients_groups)
                 solution_big = (no_int,patients_groups)
-                new_scores_best = new_scores
-                s1 = new_scores_best[0][0]*new_scores_best[0][1]
-                s2 = new_scores_best[1][0]*new_scores_best[1][1]
-        result.put([(s1,s2), solution, solution_big, av_score/ants_per_batch])
+                group_scores = [sc[0]*sc[1] for sc in new_scores]
+        result.put([group_scores, solution, solution_big, av_score/ants_per_batch, ant_scores, keys])
 
-    def neigborhood(self, H, n, th):
+    def neigborhood(self, H, n, th, cand_k = None, G = None):
         #defines search area for each ant
+        #cand_k - keep only the cand_k nodes with the highest heuristic value (candidate list),
+        #G - if given, network neighbours of the selected genes are added to the candidate list
     
         N_per_patient = []
         dim = len(H)
         for i in range(n,dim):
-            if th<0:
+            if cand_k != None:
+                #partial sort: top cand_k entries of the row without sorting all of it
+                k = min(cand_k, dim-1)
+                N = np.argpartition(H[i,:], dim-k)[dim-k:]
+                N = N[H[i,N]>0.001]
+                if G != None:
+                    genes = N[N<n]
+                    nbrs = set().union(*[G[g] for g in genes])
+                    N = np.union1d(N, np.asarray(list(nbrs), dtype = int))
+                N = np.sort(N)
+            elif th<0:
                 N = np.where(H[i,:]>0.001)[0]
             else:
                 rad = np.mean(H[i,:]) + th*np.std(H[i,:])
@@ -288,39 +693,77 @@ class BiGAnts(object):
         return N_per_patient
 
 
-    def prob_upd(self, H, t, a, b, n, th, N_per_patient):
+    def prob_upd(self, H, t, a, b, n, th, N_per_patient, rows = None, precision = None):
         #updates probability
         P_per_patient = []
         dim = len(H)
-        temp_t = np.power(t,a)
-        temp_H = np.power(H,b)
-        temp = temp_t*temp_H 
+        legacy = precision == None or precision.name == "short"
+        if legacy:
+            temp_t = np.power(t,a)
+            temp_H = np.power(H,b)
+            temp = temp_t*temp_H 
+        else:
+            #one float32 work matrix, updated in place
+            temp = np.multiply(t, 1/precision.t_scale, dtype = np.float32)
+            if a != 1:
+                np.power(temp, a, out = temp)
+            if b == 1:
+                temp *= H
+                if precision.H_scale != 1:
+                    temp *= 1/precision.H_scale
+            else:
+                temp_H = np.multiply(H, 1/precision.H_scale, dtype = np.float32)
+                np.power(temp_H, b, out = temp_H)
+                temp *= temp_H
+                del temp_H
     
         for i in range(n,dim):
             N_temp = N_per_patient[i-n]
-            P = temp[:,N_temp]
+            if rows is not None:
+                #compact table: only rows of the search area
+                P = temp[np.ix_(rows[i-n], N_temp)]
+            else:
+                P = temp[:,N_temp]
             s = np.sum(P,axis = 1)
             s[s <1.e-4] = 1
-            sum_p = 1/s
-            sum_p = sum_p[:,None]
-            P_new = P*sum_p[:np.newaxis]
+            if legacy:
+                sum_p = 1/s
+                sum_p = sum_p[:,None]
+                P_new = P*sum_p[:np.newaxis]
+            else:
+                #P is a copy, it is normalised in place
+                P /= s[:,None]
+                P_new = P
+                if precision.p_dtype == np.int16:
+                    P *= precision.p_scale
+                    np.rint(P, out = P)
+                    P_new = P.astype(np.int16)
             P_per_patient.append(P_new)
     
         return(P_per_patient)
         
     
-    def walk(self, start, Nn, P_small, cost, k, n, seed = None):
+    def walk(self, start, Nn, P_small, cost, k, n, seed = None, rows = None):
         #Initialize a random walk
         path = []
         path.append(start)
         go = True
         while go == True:
-            P_new = P_small[start,:]
+            if rows is not None:
+                P_new = P_small[np.searchsorted(rows, start),:]
+            else:
+                P_new = P_small[start,:]
+            total = np.sum(P_new)
+            if P_new.dtype.kind == "i":
+                #fixed point table
+                total = total/P_SCALE
             #if there is any node inside the radious - keep mooving
-            if np.sum(P_new)> 0.5:
+            if total> 0.5:
                 #transition:
                 if seed != None:
                     np.random.seed(seed)
+                if P_new.dtype != np.float64:
+                    P_new = P_new/np.sum(P_new, dtype = np.float64)
                 tr = np.random.choice(Nn,1,False,p = P_new)[0]
                 c = cost[start,tr]
                 #if there is any cost left we keep going
@@ -344,75 +787,88 @@ class BiGAnts(object):
 
   
 
-    def ant_job(self, GE, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, seed = None):
+    def ant_job(self, N, H, th, clusters, probs, a, b, cost, m, n, patients, count_big, cost_limit, L_g_min, L_g_max, G, ge, seed = None, flat = None, rows = None):
     
         paths = []
         wars = 0
-        #set an ant on every patient
-        for w in range(m):
-            #print(w)
-            k = cost_limit
-            start = patients[w]
-            Nn = N[w] #neigbohood
-            P_small = probs[w]
-            path = self.walk(start,Nn,P_small,cost,k,n)
-            paths.append(path)
+        if flat != None:
+            #compiled walks (flat - output of kernels.flatten_probs)
+            if seed == None:
+                seed = np.random.randint(2**31-1)
+            paths = kernels.walks(flat, patients, cost, cost_limit, n, seed)
+        else:
+            #set an ant on every patient
+            for w in range(m):
+                #print(w)
+                k = cost_limit
+                start = patients[w]
+                Nn = N[w] #neigbohood
+                P_small = probs[w]
+                path = self.walk(start,Nn,P_small,cost,k,n,rows = rows[w] if rows is not None else None)
+                paths.append(path)
     #    print("Random walks: {0}\n".format(end-st))
-        data_new = ge[list(set(flatten(paths))),:]
-        kmeans = KMeans(n_clusters=2).fit(data_new.T)
+        # genes of all paths and the walker of each of them
+        genes = np.concatenate([np.asarray(p, dtype = int) for p in paths])
+        walker = np.repeat(np.arange(len(paths)), [len(p) for p in paths])
+        visited = np.zeros(n, dtype = bool)
+        visited[genes] = True
+        from sklearn.cluster import KMeans
+        data_new = ge[visited,:]
+        kmeans = KMeans(n_clusters=clusters).fit(data_new.T)
         labels = kmeans.labels_
     #    print("Patients clustering: {0}\n".format(end-st))
     
-        gene_groups_set =[]
         patients_groups =[]
         for clust in range(clusters):
             wh = np.where(labels == clust)[0]
-            group_g = [paths[i] for i in wh]
-            group_g = flatten(group_g)
-            gene_groups_set.append(set(group_g))
-            #save only most common genes for a group
             group_p = [patients[i] for i in wh]
             patients_groups.append(group_p)
-            
-        #delete intersecting genes between groups
-        
-        I = set.intersection(*gene_groups_set)
-        no_int =[list(gene_groups_set[i].difference(I)) for i in range(clusters)]
+        # gene masks of the groups (clusters x n): genes visited by the walkers of each cluster
+        in_group = np.zeros((clusters, n), dtype = bool)
+        in_group[labels[walker], genes] = True
+        #delete genes that were selected for more than one group
+        in_group &= in_group.sum(axis = 0) == 1
+        no_int = [np.flatnonzero(row).tolist() for row in in_group]
         gene_groups = no_int
     #    print("Genes clustering: {0}\n".format(end-st))
     
+        # mean expression of every gene in each patient group, computed once for this partition
+        means = self.patient_means(ge, patients_groups, n)
         # make sure that gene clusters correspond to patients clusters:
-        if np.mean(ge[gene_groups[0],:][:,(np.asarray(patients_groups[0])-n)])<np.mean(ge[gene_groups[1],:][:,(np.asarray(patients_groups[0])-n)]):
-            patients_groups = patients_groups[::-1]
+        order = self.orient_order(self.group_means(ge, gene_groups, patients_groups, n, means))
+        patients_groups = [patients_groups[j] for j in order]
+        means = means[:,order]
     #    print("Switch: {0}\n".format(end-st))
     
     
-        gene_groups,sizes= self.clean_net(gene_groups,patients_groups, clusters,L_g_min,G,GE)
+        gene_groups,sizes= self.clean_net(gene_groups,patients_groups, clusters,L_g_min,G,ge, means = means)
     #    print("Clean net: {0}\n".format(end-st))
     
-        new_scores = self.score(G,patients_groups,gene_groups,n,m,ge,sizes,L_g_min,L_g_max)
+        new_scores = self.score(G,patients_groups,gene_groups,n,m,ge,sizes,L_g_min,L_g_max, means)
     #    print("Score: {0}\n".format(end-st))
     
         
-        tot_score = new_scores[0][0]*new_scores[0][1]+new_scores[1][0]*new_scores[1][1]   
+        tot_score = sum(sc[0]*sc[1] for sc in new_scores)
         return(tot_score,gene_groups,patients_groups,new_scores,wars,no_int)
         
-    def pher_upd(self, t, t_min, p, scores, solution):
+    def pher_upd(self, t, t_min, p, scores, solution, backend = "numpy", precision = None):
+        if precision != None and precision.name != "short":
+            return self.pher_upd_inplace(t, t_min, p, scores, solution, backend, precision)
         t = t*(1-p)
         t_new = np.copy(t)
         assert t_new.sum() > 0, "bad pheramone input"
-        for i in range(len(solution[0])):
-            group_g = solution[0][i]
-            group_p = solution[1][i]
-            sc = scores[i]
-            #ge_score = new_scores[i][0]*10
-            #ppi_score = new_scores[i][1]*10
-            for g1 in group_g:
-                for p1 in group_p:
-                    t_new[g1,p1] = t[g1,p1]+ sc
-                    t_new[p1,g1] = t[p1,g1]+ sc
-                for g2 in group_g:
-                    t_new[g1,g2] = t[g1,g2]+ sc
+        if backend == "numba":
+            t_new = kernels.deposit(t_new, solution, scores)
+        else:
+            for i in range(len(solution[0])):
+                group_g = np.asarray(solution[0][i], dtype = int)
+                group_p = np.asarray(solution[1][i], dtype = int)
+                sc = scores[i]
+                #ge_score = new_scores[i][0]*10
+                #ppi_score = new_scores[i][1]*10
+                t_new[np.ix_(group_g,group_p)] = t[np.ix_(group_g,group_p)]+ sc
+                t_new[np.ix_(group_p,group_g)] = t[np.ix_(group_p,group_g)]+ sc
+                t_new[np.ix_(group_g,group_g)] = t[np.ix_(group_g,group_g)]+ sc
     
         assert t_new.sum() >=0, "negative pheramone update"
         t_new[t_new < t_min] = t_min
@@ -420,24 +876,50 @@ class BiGAnts(object):
     
         
         return(t_new)
+
+    def pher_upd_inplace(self, t, t_min, p, scores, solution, backend, precision):
+        # pher_upd() for the float32 and int16 policies: evaporation and deposits change t itself
+        return self.pher_upd_batch(t, t_min, p, [(scores, solution)], backend, precision)
+
+    def pher_upd_batch(self, t, t_min, p, deposits, backend, precision):
+        # in place pher_upd() of several ants in a row, deposits - (scores, solution) of each ant in order.
+        # The same as one update per ant, but t is evaporated only once by (1-p)^k and the deposit of
+        # every ant is evaporated by the ants after it
+        k = len(deposits)
+        precision.evaporate(t, 1-(1-p)**k, t_min)
+        assert t.sum() > 0, "bad pheramone input"
+        for j, (scores, solution) in enumerate(deposits):
+            scores = [sc*(1-p)**(k-1-j) for sc in scores]
+            if backend == "numba" and precision.t_dtype != np.int16:
+                t = kernels.deposit(t, solution, scores)
+                continue
+            for i in range(len(solution[0])):
+                group_g = np.asarray(solution[0][i], dtype = int)
+                group_p = np.asarray(solution[1][i], dtype = int)
+                sc = scores[i]*precision.t_scale
+                for ix in [np.ix_(group_g,group_p), np.ix_(group_p,group_g), np.ix_(group_g,group_g)]:
+                    if precision.t_dtype == np.int16:
+                        #saturating fixed point addition
+                        t[ix] = np.minimum(t[ix].astype(np.int32) + int(round(sc)), INT16_MAX)
+                    else:
+                        t[ix] += sc
+        assert t.sum() >=0, "negative pheramone update"
+        precision.floor(t, t_min)
+        assert t.sum() != 0, "bad pheramone update"
+        return(t)
     
         
         
         
         
-    def score(self, G, patients_groups, gene_groups, n, m, ge, sizes, L_g_min, L_g_max):
+    def score(self, G, patients_groups, gene_groups, n, m, ge, sizes, L_g_min, L_g_max, means = None):
         clusters = len(patients_groups)
-        conf_matrix = np.zeros((clusters,clusters))
+        # mean expression of every gene group in every patient group
+        conf_matrix = self.group_means(ge, gene_groups, patients_groups, n, means)
         conect_ppi = []
         for i in range(clusters): #over genes
-            group_g = np.asarray(gene_groups[i])
             s = sizes[i]
-            if len(group_g)>0:
-                for j in range(clusters): #over patients
-                    group_p = np.asarray(patients_groups[j])
-                    if len(group_p)>0:
-                    # gene epression inside the group
-                        conf_matrix[i,j] = np.mean(ge[group_g,:][:,(group_p-n)])
+            if len(gene_groups[i])>0:
                 #ppi score    
                 con_ppi = 1
                 if s<L_g_min:
@@ -447,22 +929,72 @@ class BiGAnts(object):
                 conect_ppi.append(con_ppi)
             else:
                 conect_ppi.append(0)           
-        ans = []
-        for i in range(clusters):
-            all_ge = np.sum(conf_matrix[i,:])
-            in_group = conf_matrix[i,i]
-            out_group = all_ge - in_group
-            ge_con = in_group-out_group
-            #scaled = scaleBetween(num,0,0.5,0,1)
-            ans.append((ge_con ,conect_ppi[i]))
-            
+        in_group = np.diag(conf_matrix)
+        out_group = conf_matrix.sum(axis = 1) - in_group
+        ge_con = in_group - out_group
+        ans = [(ge_con[i], conect_ppi[i]) for i in range(clusters)]
         return(ans)
     
+    def patient_means(self, ge, patients_groups, n):
+        """
+        Mean expression of every gene in each patient group (genes x clusters) with one sparse
+        product ge * Ip^T. Empty groups get a mean of 0
+        """
+        Ip = indicator(patients_groups, ge.shape[1], offset = n)
+        # only the columns of the grouped patients are touched
+        return np.asarray(ge @ Ip.T)
+
+    def group_means(self, ge, gene_groups, patients_groups, n, means = None):
+        """
+        Mean expression of each gene group (rows) in each patient group (columns): Ig * (ge * Ip^T).
+        means - output of patient_means() for patients_groups if it is already known
+        """
+        if means is None:
+            means = self.patient_means(ge, patients_groups, n)
+        Ig = indicator(gene_groups, means.shape[0])
+        return np.asarray(Ig @ means)
+    
+    def orient(self, ge, gene_groups, patients_groups, n, means = None):
+        """
+        Orders patient groups such that i-th patient group corresponds to the i-th gene group:
+        each patient group (in the given order) is matched with the remaining gene group 
+        that has the highest mean expression in it. For 2 clusters the groups are swapped
+        if the second gene group is higher expressed in the first patient group
+        """
+        order = self.orient_order(self.group_means(ge, gene_groups, patients_groups, n, means))
+        return [patients_groups[j] for j in order]
+
+    def orient_order(self, conf_matrix):
+        # the i-th oriented patient group is the order[i]-th one of the mean matrix (gene groups x patient groups)
+        clusters = conf_matrix.shape[1]
+        order = [None]*clusters
+        free = list(range(clusters))
+        for j in range(clusters):
+            i = max(free, key = lambda x: conf_matrix[x,j])
+            order[i] = j
+            free.remove(i)
+        return order
 
 
 
-    def HI_big(self, data_aco, A_new):
+    def HI_big(self, data_aco, A_new, precision = None):
+        # precision - if given, H is assembled block by block in the storage type of the policy
+        # without (n+m) x (n+m) float64 temporaries, otherwise a float64 matrix is returned
+        from sklearn import preprocessing
         scaler = preprocessing.MinMaxScaler(feature_range=(0, 1))#
+        if precision != None:
+            n,m = data_aco.shape
+            H_full = np.empty((n+m, n+m), dtype = precision.H_dtype)
+            H_g_to_g = scaler.fit_transform(data_aco.T.corr())*10
+            np.fill_diagonal(H_g_to_g, 0)
+            H_full[:n,:n] = precision.heuristic(np.multiply(H_g_to_g, A_new))
+            del H_g_to_g
+            H_full[:n,n:] = precision.heuristic(scaler.fit_transform(data_aco)*10)
+            H_full[n:,:n] = H_full[:n,n:].T
+            H_p_to_p = scaler.fit_transform(data_aco.corr())*10
+            np.fill_diagonal(H_p_to_p, 0)
+            H_full[n:,n:] = precision.heuristic(H_p_to_p)
+            return(H_full)
         H_g_to_g = (data_aco.T.corr())
         H_p_to_p = data_aco.corr()
         H_g_to_g = scaler.fit_transform(H_g_to_g)
@@ -501,55 +1033,76 @@ class BiGAnts(object):
 #        return(H_full)
 
 
+    def HI_extend(self, H, data_aco, m_old, precision = None):
+        # heuristic information for data_aco where only the last patients are new (H was computed for the first m_old):
+        # the gene-gene block and the scaled columns of the old patients are copied, the patient-patient block is
+        # computed again since its scaling depends on all patients. New blocks are stored with the precision policy of H
+        if precision == None:
+            precision = Precision()
+        from sklearn import preprocessing
+        scaler = preprocessing.MinMaxScaler(feature_range=(0, 1))#
+        n,m = data_aco.shape
+        H_full = np.zeros((n+m, n+m), dtype = H.dtype)
+        H_full[:n,:n] = H[:n,:n]
+        H_full[:n,n:n+m_old] = H[:n,n:]
+        H_full[:n,n+m_old:] = precision.heuristic(scaler.fit_transform(data_aco.iloc[:,m_old:])*10)
+        H_full[n:,:n] = H_full[:n,n:].T
+        H_p_to_p = scaler.fit_transform(data_aco.corr())*10
+        np.fill_diagonal(H_p_to_p, 0)
+        H_full[n:,n:] = precision.heuristic(H_p_to_p)
+        return(H_full)
+
+
     def print_clusters(self, GE, solution):
+        # clustermap of the expression data with the patient groups and gene groups of the solution (any number of groups)
+        clusters = len(solution[0])
         grouping_p = []
         p_num = list(GE.columns)
         for p in p_num:
-            if p in solution[1][0]:
-                grouping_p.append(1)
-            else:
-                grouping_p.append(2)
+            grouping_p.append(next((i+1 for i in range(clusters) if p in solution[1][i]), clusters+1))
         grouping_p = pd.DataFrame(grouping_p,index = p_num)
         grouping_g = []
         g_num = list(GE.index)
         for g in g_num:
-            if g in solution[0][0]:
-                grouping_g.append(1)
-            elif  g in solution[0][1]:
-                grouping_g.append(2)
-            else:
-                grouping_g.append(3)
+            grouping_g.append(next((i+1 for i in range(clusters) if g in solution[0][i]), clusters+1))
                 
         grouping_g = pd.DataFrame(grouping_g,index = g_num)
+        sns = _plotting.seaborn()
+        colors = ['#A52A2A', '#7FFFD4']
+        if clusters > 2:
+            colors = colors + list(sns.color_palette("Set2", clusters-2).as_hex())
+        lut = {i+1: colors[i] for i in range(clusters)}
+        lut[clusters+1] = '#FAEBD7'
         species = grouping_p[0]
-        lut = {1: '#A52A2A', 2: '#7FFFD4'}
         row_colors = species.map(lut)
         species = grouping_g[0]
-        lut = {1: '#A52A2A', 2: '#7FFFD4', 3:'#FAEBD7'}
         col_colors = species.map(lut)
         sns.clustermap(GE.T, row_colors=row_colors, col_colors = col_colors,figsize=(15, 10))
     
     def features(self, solution, GE, G, pos = None):
-        genes1,genes2 = solution[0]
-        patients1, patients2 = solution[1]
-        
-        means1 = list(np.mean(GE[patients1].loc[genes1],axis = 1)-np.mean(GE[patients2].loc[genes1],axis = 1).values)
-        means2 = list(np.mean(GE[patients1].loc[genes2],axis = 1)-np.mean(GE[patients2].loc[genes2],axis = 1).values)
-        G_small = nx.subgraph(G,genes1+genes2)
+        # network of the gene groups, each gene coloured by its mean difference between its patient group and all other patients
+        gene_groups, patients_groups = solution
+        clusters = len(gene_groups)
+        means = []
+        for i in range(clusters):
+            others = flatten([patients_groups[j] for j in range(clusters) if j != i])
+            means.append(list(np.mean(GE[patients_groups[i]].loc[gene_groups[i]],axis = 1)-np.mean(GE[others].loc[gene_groups[i]],axis = 1).values))
+        G_small = nx.subgraph(G,flatten(gene_groups))
         
+        plt = _plotting.pyplot()
         fig = plt.figure(figsize=(15,10))
         vmin = -2
         vmax = 2
         if pos == None:
             pos = nx.spring_layout(G_small)
         ec = nx.draw_networkx_edges(G_small,pos)
-        nc1 = nx.draw_networkx_nodes(G_small,nodelist =genes1, pos = pos,node_color=means1, node_size=200,alpha=1.0,
-                                     vmin=vmin, vmax=vmax,node_shape = "^",cmap =plt.cm.PRGn)
-        nc2 = nx.draw_networkx_nodes(G_small,nodelist =genes2, pos = pos,node_color=means2, node_size=200,
-                                     alpha=1.0,
-                                     vmin=vmin, vmax=vmax,node_shape = "o",cmap =plt.cm.PRGn)
+        shapes = ["^", "o", "s", "D", "v", "p", "h", "*"]
+        nc = []
+        for i in range(clusters):
+            nc.append(nx.draw_networkx_nodes(G_small,nodelist =gene_groups[i], pos = pos,node_color=means[i], node_size=200,alpha=1.0,
+                                         vmin=vmin, vmax=vmax,node_shape = shapes[i % len(shapes)],cmap =plt.cm.PRGn))
         nx.draw_networkx_labels(G_small,pos)
-        plt.colorbar(nc1)
+        plt.colorbar(nc[0])
         plt.axis('off')
         
         plt.show(block=False)
@@ -558,15 +1111,22 @@ class BiGAnts(object):
 
     
     
-    def clean_net(self, gene_groups, patients_groups, clusters, L_g,G, GE, d_cut =2):    
+    def clean_net(self, gene_groups, patients_groups, clusters, L_g,G, ge, d_cut =2, means = None):    
+        # ge - expression values (a data frame is accepted as well), means - output of patient_means() if known
         genes_components = []
         sizes = []
+        if isinstance(ge, pd.DataFrame):
+            ge = ge.values
+        n = ge.shape[0]
+        if means is None:
+            means = self.patient_means(ge, patients_groups, n)
+        lens = np.asarray([len(p) for p in patients_groups])
         for clust in range(clusters):
             group_g = gene_groups[clust]
-            if clust == 0:
-                not_clust = 1
-            else:
-                not_clust = 0
+            # mean in the patients of this cluster minus the mean in the patients of all other clusters
+            rest = lens.sum() - lens[clust]
+            out = (means @ lens - means[:,clust]*lens[clust])/rest if rest > 0 else 0
+            dif_all = means[:,clust] - out
             if len(group_g)>=L_g:
                 g = nx.subgraph(G,group_g)
                 #we are taking only the biggest connected component
@@ -582,17 +1142,18 @@ class BiGAnts(object):
                 while max_out >0:
                     #measure the difference in the expression between two groups for d == 1 nodes
     
-                    dif = np.mean(GE[patients_groups[clust]].loc[ones],axis = 1)-np.mean(GE[patients_groups[not_clust]].loc[ones],axis = 1)
-                    dif = dif.sort_values()
+                    ones = np.asarray(ones, dtype = int)
+                    dif = dif_all[ones]
+                    order = np.argsort(dif, kind = "stable")
                     #therefore we select the nodes with d == 1 and low difference
-                    ones = list(dif[dif<1.5].index)
+                    ones = [int(ones[i]) for i in order if dif[i]<1.5]
                     if len(ones)>0:
                         if len(ones)<=max_out:
                             outsiders = ones
                         else:
                             outsiders = list(ones)[:max_out]
          
-                        nodes  = list(set(nodes) - set(outsiders))
+                        nodes  = np.setdiff1d(nodes, outsiders).tolist()
                         g = nx.subgraph(G,nodes)
                         comp_big = max(nx.connected_component_subgraphs(g), key=len)
                         dg = dict(nx.degree(comp_big))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch runner for many BiGAnts searches described in one job manifest.
+
+Usage:
+    bigants-batch manifest.json --cores 16 --output results/
+
+Manifest (JSON):
+    {
+      "defaults": {"search": {"K": 20, "max_iter": 100}},
+      "jobs": [
+        {"name": "lung_10_15",
+         "expr": "data/gse30219_lung.csv",
+         "net": "data/biogrid.human.entrez.tsv",
+         "preprocessing": {"log2": false, "size": 2000},
+         "model": {"L_g_min": 10, "L_g_max": 15},
+         "search": {"n_proc": 2, "K": 30}},
+        ...
+      ]
+    }
+
+"preprocessing" holds keyword arguments of data_preprocessing(), "model" the
+subnetwork sizes of BiGAnts() and "search" keyword arguments of
+BiGAnts.run_search(). Values in "defaults" are used for every job unless the
+job overrides them. Each job needs search["n_proc"] cores (default 1) and jobs
+are started as long as the sum of their cores fits into --cores.
+
+Jobs with the same input files and preprocessing parameters share one
+preprocessed copy of the data which is cached in <output>/.cache (and reused
+by later runs as long as the input files do not change).
+Every job writes <output>/<name>.csv in the format of results_analysis.save(),
+its log to <output>/<name>.log and the batch writes a summary.csv.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import time
+
+_sections = ["preprocessing", "model", "search"]
+
+
+def load_manifest(path):
+    """
+    Reads a job manifest and merges the defaults into every job
+
+    Attributes:
+    -----------
+    path - path to the JSON manifest
+    """
+    with open(path, "r") as fh:
+        manifest = json.load(fh)
+    assert "jobs" in manifest and len(manifest["jobs"]) > 0, "The manifest does not contain any jobs"
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    names = set()
+    for i, job in enumerate(manifest["jobs"]):
+        merged = {"name": job.get("name", "job{0}".format(i))}
+        for key in ["expr", "net"]:
+            value = job.get(key, defaults.get(key))
+            assert value != None, "'{0}' is not set for job {1}".format(key, merged["name"])
+            # relative paths are resolved with respect to the manifest
+            merged[key] = os.path.join(base, value)
+        for section in _sections:
+            merged[section] = dict(defaults.get(section, {}))
+            merged[section].update(job.get(section, {}))
+        assert "L_g_min" in merged["model"] and "L_g_max" in merged["model"], "L_g_min and L_g_max have to be set for job {0}".format(merged["name"])
+        assert merged["name"] not in names, "Job name {0} is used more than once".format(merged["name"])
+        names.add(merged["name"])
+        jobs.append(merged)
+    return jobs
+
+
+def data_key(job):
+    # jobs share the preprocessed data if inputs and preprocessing parameters match
+    files = []
+    for key in ["expr", "net"]:
+        st = os.stat(job[key])
+        files.append([os.path.abspath(job[key]), st.st_size, st.st_mtime])
+    raw = json.dumps([files, job["preprocessing"]], sort_keys = True)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _preprocess(job, cache_file):
+    from bigants.load_data import data_preprocessing
+    data = data_preprocessing(job["expr"], job["net"], **job["preprocessing"])
+    tmp = cache_file + ".tmp{0}".format(os.getpid())
+    with open(tmp, "wb") as fh:
+        pickle.dump(data, fh, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_file)
+
+
+def _run_job(job, cache_file, output):
+    # runs in a separate process; the log of run_search goes to <name>.log
+    log = open(os.path.join(output, job["name"] + ".log"), "w")
+    sys.stdout = log
+    sys.stderr = log
+    from bigants.ants import BiGAnts
+    from bigants.results_processing import results_analysis
+    with open(cache_file, "rb") as fh:
+        GE, G, labels, _ = pickle.load(fh)
+    model = BiGAnts(GE, G, job["model"]["L_g_min"], job["model"]["L_g_max"])
+    solution, sc = model.run_search(**job["search"])
+    results_analysis(solution, labels).save(os.path.join(output, job["name"] + ".csv"))
+    with open(os.path.join(output, job["name"] + ".scores.json"), "w") as fh:
+        json.dump({"iterations": sc[0], "best": [float(x) for x in sc[1]], "average": [float(x) for x in sc[2]]}, fh)
+    log.close()
+
+
+def _schedule(tasks, cores):
+    """
+    Runs (name, cores, target, args) tasks as separate processes such that the
+    sum of cores of the running tasks never exceeds the budget.
+    Returns a dictionary name -> (exit code, run time)
+    """
+    pending = list(tasks)
+    running = {}
+    done = {}
+    while pending or running:
+        free = cores - sum(t[1] for t, _, _ in running.values())
+        # start every pending task that fits, biggest first
+        pending.sort(key = lambda t: -t[1])
+        for task in list(pending):
+            if task[1] <= free:
+                p = mp.Process(target = task[2], args = task[3])
+                p.start()
+                running[task[0]] = (task, p, time.time())
+                pending.remove(task)
+                free = free - task[1]
+        time.sleep(0.2)
+        for name in list(running):
+            task, p, st = running[name]
+            if not p.is_alive():
+                p.join()
+                done[name] = (p.exitcode, time.time() - st)
+                del running[name]
+                print("{0} finished with code {1} after {2}s".format(name, p.exitcode, round(done[name][1], 1)))
+    return done
+
+
+def run_batch(jobs, cores, output):
+    """
+    Preprocesses the data of all jobs (once per unique input) and runs the searches
+
+    Attributes:
+    -----------
+    jobs - list of jobs as returned by load_manifest()
+    cores - total number of cores that can be used at the same time
+    output - directory for the results
+    """
+    import pandas as pd
+    for job in jobs:
+        n_proc = job["search"].get("n_proc", 1)
+        assert n_proc <= cores, "Job {0} needs {1} cores, but only {2} are available".format(job["name"], n_proc, cores)
+    cache = os.path.join(output, ".cache")
+    os.makedirs(cache, exist_ok = True)
+    keys = {job["name"]: data_key(job) for job in jobs}
+    prep = []
+    for job in jobs:
+        cache_file = os.path.join(cache, keys[job["name"]] + ".pkl")
+        if not os.path.exists(cache_file) and cache_file not in [t[3][1] for t in prep]:
+            prep.append(("preprocessing " + keys[job["name"]][:8], 1, _preprocess, (job, cache_file)))
+    print("{0} jobs, {1} distinct inputs need preprocessing".format(len(jobs), len(prep)))
+    _schedule(prep, cores)
+
+    tasks = []
+    status = {}
+    for job in jobs:
+        cache_file = os.path.join(cache, keys[job["name"]] + ".pkl")
+        if os.path.exists(cache_file):
+            tasks.append((job["name"], job["search"].get("n_proc", 1), _run_job, (job, cache_file, output)))
+        else:
+            status[job["name"]] = (None, 0)
+    status.update(_schedule(tasks, cores))
+
+    summary = []
+    for job in jobs:
+        code, rt = status[job["name"]]
+        if code == None:
+            state = "preprocessing failed"
+        elif code == 0:
+            state = "done"
+        else:
+            state = "failed"
+        summary.append([job["name"], state, round(rt, 2), job["expr"], keys[job["name"]]])
+    summary = pd.DataFrame(summary, columns = ["name", "status", "runtime", "expr", "data"])
+    summary.to_csv(os.path.join(output, "summary.csv"), index = False)
+    return summary
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "bigants-batch", description = "Runs BiGAnts searches for all jobs of a manifest")
+    parser.add_argument("manifest", help = "JSON job manifest")
+    parser.add_argument("-c", "--cores", type = int, default = max(1, mp.cpu_count() - 1), help = "total number of cores to use (default: all but one)")
+    parser.add_argument("-o", "--output", default = "results", help = "output directory (default: results)")
+    args = parser.parse_args(argv)
+    jobs = load_manifest(args.manifest)
+    os.makedirs(args.output, exist_ok = True)
+    summary = run_batch(jobs, args.cores, args.output)
+    failed = (summary["status"] != "done").sum()
+    if failed > 0:
+        print("{0} of {1} jobs failed, see the logs in {2}".format(failed, len(summary), args.output))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _comb2(x):
+    # number of pairs, elementwise
+    return x * (x - 1) / 2
+
+
+class ConsensusAnalysis(object):
+    '''
+        Stability and consensus analysis over many BiGAnts solutions
+        (restarts, bootstraps, parameter sweeps) of the same data.
+
+        All statistics are computed from two sparse indicator matrices:
+        genes (runs x genes) and patient assignments (runs*clusters x patients).
+
+        Attributes:
+        -----------
+        solutions - list of run_search() solutions or results_analysis objects
+        n - number of genes (GE.shape[0])
+        m - number of patients (GE.shape[1])
+    '''
+    def __init__(self, solutions, n, m):
+        solutions = [s.solution if hasattr(s, "solution") else s for s in solutions]
+        assert len(solutions) > 0, "No solutions given"
+        self.n, self.m = n, m
+        self.S = len(solutions)
+        self.k = max(len(s[1]) for s in solutions)
+        # genes selected in each run (any group)
+        genes = [np.unique(np.asarray([g for group in s[0] for g in group], dtype = int)) for s in solutions]
+        self.genes = sparse.csr_matrix((np.ones(sum(len(g) for g in genes), dtype = np.float32),
+                                        (np.repeat(np.arange(self.S), [len(g) for g in genes]), np.concatenate(genes))),
+                                       shape = (self.S, n))
+        # patient cluster labels of each run, -1 if a patient is not assigned
+        self.labels = -np.ones((self.S, m), dtype = int)
+        for i, s in enumerate(solutions):
+            for j, group in enumerate(s[1]):
+                self.labels[i, np.asarray(group, dtype = int) - n] = j
+        run, pat = np.nonzero(self.labels >= 0)
+        # one row per (run, cluster)
+        self.assign = sparse.csr_matrix((np.ones(len(run), dtype = np.float32), (run * self.k + self.labels[run, pat], pat)),
+                                        shape = (self.S * self.k, m))
+
+    def co_assignment(self):
+        '''
+        Fraction of runs in which each pair of patients is placed in the same cluster (m x m)
+        '''
+        C = np.asarray((self.assign.T @ self.assign).todense())
+        return C / self.S
+
+    def gene_frequency(self):
+        '''
+        Fraction of runs in which each gene is part of the solution (length n)
+        '''
+        return np.asarray(self.genes.sum(axis = 0)).ravel() / self.S
+
+    def jaccard(self):
+        '''
+        Pairwise Jaccard index between the gene sets of all runs (S x S)
+        '''
+        inter = np.asarray((self.genes @ self.genes.T).todense())
+        sizes = np.diag(inter)
+        union = sizes[:, None] + sizes[None, :] - inter
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            J = np.where(union > 0, inter / union, 0)
+        return J
+
+    def ari(self):
+        '''
+        Pairwise adjusted Rand index between the patient partitions of all runs (S x S),
+        computed over the patients assigned in both runs
+        '''
+        S, k = self.S, self.k
+        # contingency tables of all pairs of runs at once
+        cont = np.asarray((self.assign @ self.assign.T).todense()).reshape(S, k, S, k)
+        index = _comb2(cont).sum(axis = (1, 3))
+        a = _comb2(cont.sum(axis = 3)).sum(axis = 1)
+        b = _comb2(cont.sum(axis = 1)).sum(axis = 2)
+        total = _comb2(cont.sum(axis = (1, 3)))
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            expected = np.where(total > 0, a * b / total, 0)
+            max_index = (a + b) / 2
+            ari = np.where(max_index != expected, (index - expected) / (max_index - expected), 1)
+        return ari
+
+    def consensus_partition(self, k = None, method = "average"):
+        '''
+        Consensus clustering of patients: hierarchical clustering of 1 - co-assignment
+
+        Attributes:
+        -----------
+        k - number of clusters (default - number of clusters in the solutions)
+        method - linkage method, see scipy.cluster.hierarchy.linkage (default - 'average')
+
+        Returns a list of k lists with internal patient IDs, like in the solutions
+        '''
+        from scipy.cluster.hierarchy import linkage, fcluster
+        from scipy.spatial.distance import squareform
+        if k == None:
+            k = self.k
+        D = 1 - self.co_assignment()
+        np.fill_diagonal(D, 0)
+        Z = linkage(squareform(D, checks = False), method = method)
+        labels = fcluster(Z, k, criterion = "maxclust") - 1
+        return [list(np.where(labels == c)[0] + self.n) for c in range(k)]
+
+    def summary(self, labels = None):
+        '''
+        Gene selection frequencies as a data frame sorted by frequency
+
+        Attributes:
+        -----------
+        labels - data preprocessing labels to report the original gene IDs (default - None)
+        '''
+        freq = self.gene_frequency()
+        idx = np.nonzero(freq)[0]
+        table = pd.DataFrame({"gene": idx, "frequency": freq[idx]})
+        if labels != None:
+            table["gene"] = [labels[x] for x in idx]
+        return table.sort_values("frequency", ascending = False).reset_index(drop = True)
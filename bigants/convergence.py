@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Stopping rules for run_search(monitor = ...). Without a monitor the search stops with the
+# eps / times criteria of the original algorithm.
+
+import numpy as np
+
+
+class Monitor(object):
+    '''
+        Base class of the stopping rules. update() is called after every iteration with the best
+        solution of the iteration (gene groups, patient groups), its score and the average score
+        of the ants, and returns True when the search should stop. reset() is called when a run starts
+    '''
+    def reset(self):
+        pass
+
+    def update(self, solution, max_round_score, av_score):
+        return False
+
+
+def overlap(a, b):
+    # mean Jaccard index of the gene groups and of the patient groups of two solutions
+    jac = []
+    for groups_a, groups_b in zip(a, b):
+        for x, y in zip(groups_a, groups_b):
+            x, y = set(x), set(y)
+            jac.append(len(x & y)/len(x | y) if len(x | y) > 0 else 1)
+    return np.mean(jac)
+
+
+def trend(y):
+    # least squares slope of y over the iterations and its standard error
+    x = np.arange(len(y)) - (len(y)-1)/2
+    y = np.asarray(y, dtype = float)
+    slope = (x @ (y - y.mean()))/(x @ x)
+    resid = y - y.mean() - slope*x
+    se = np.sqrt((resid @ resid)/max(len(y)-2, 1)/(x @ x))
+    return slope, se
+
+
+class StagnationMonitor(Monitor):
+    '''
+        Stops when the best bicluster and the score distribution have both stopped changing over the
+        last window iterations: the best solutions of consecutive iterations overlap by at least
+        min_overlap on average (genes and patients, Jaccard index) and the upper confidence bound of
+        the trend of the average ant score is below tol * |average score| per iteration
+
+        Attributes:
+        -----------
+        window - number of iterations that are compared (default 5)
+        min_overlap - average overlap of consecutive best solutions (default 0.9)
+        tol - relative score increase per iteration that still counts as a plateau (default 0.01)
+        z - one-sided normal quantile of the confidence bound (default 1.645, 95%)
+    '''
+    def __init__(self, window = 5, min_overlap = 0.9, tol = 0.01, z = 1.645):
+        assert window > 2, "window should be at least 3, the value was: {0}".format(window)
+        self.window = window
+        self.min_overlap = min_overlap
+        self.tol = tol
+        self.z = z
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.overlaps = []
+        self.avs = []
+
+    def update(self, solution, max_round_score, av_score):
+        if self.last != None:
+            self.overlaps.append(overlap(self.last, solution))
+        self.last = solution
+        self.avs.append(av_score)
+        if len(self.avs) < self.window:
+            return False
+        stable = np.mean(self.overlaps[-(self.window-1):]) >= self.min_overlap
+        slope, se = trend(self.avs[-self.window:])
+        flat = slope + self.z*se < self.tol*max(abs(np.mean(self.avs[-self.window:])), 1e-12)
+        return bool(stable and flat)
+
+
+MONITORS = {"stagnation": StagnationMonitor}
+
+
+def make_monitor(monitor):
+    """
+    Monitor for run_search(monitor = ...): a name from MONITORS (default settings) or a Monitor object
+    """
+    if isinstance(monitor, str):
+        assert monitor in MONITORS, "Unknown monitor {0}, use any of {1} or a Monitor object".format(monitor, list(MONITORS))
+        return MONITORS[monitor]()
+    assert isinstance(monitor, Monitor), "monitor should be a name or a Monitor object"
+    monitor.reset()
+    return monitor
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def read_gmt(path):
+    """
+    Reads a GMT file (term <tab> description <tab> gene1 <tab> gene2 ...)
+    Returns a dictionary term -> list of genes
+    """
+    opener = gzip.open if str(path).endswith(".gz") else open
+    sets = dict()
+    with opener(path, "rt") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                continue
+            # Enrichr libraries sometimes append weights as GENE,1.0
+            sets[fields[0]] = [g.split(",")[0] for g in fields[2:] if g != ""]
+    return sets
+
+
+def fdr_bh(pvals, n_tests = None):
+    """
+    Benjamini-Hochberg adjusted p-values
+
+    Attributes:
+    -----------
+    pvals - array of p-values
+    n_tests - total number of tests if not all p-values are given (the rest are assumed to be 1)
+    """
+    pvals = np.asarray(pvals, dtype = float)
+    if n_tests == None:
+        n_tests = len(pvals)
+    if len(pvals) == 0:
+        return pvals
+    order = np.argsort(pvals)
+    ranked = pvals[order] * n_tests / np.arange(1, len(pvals) + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adj = np.empty_like(ranked)
+    adj[order] = np.minimum(ranked, 1)
+    return adj
+
+
+class LocalEnrichment(object):
+    '''
+        Offline over-representation analysis with gene set libraries in GMT format
+        (e.g. the Enrichr libraries from https://maayanlab.cloud/Enrichr/#libraries)
+
+        Each library is loaded once into a sparse term x gene membership matrix, the overlaps
+        of many gene lists with all terms are computed with one sparse product and
+        hypergeometric p-values are Benjamini-Hochberg corrected per gene list and library.
+
+        Attributes:
+        -----------
+        libraries - dictionary name -> path of a GMT file (default - None, add them with load())
+    '''
+    def __init__(self, libraries = None):
+        self.libraries = dict()
+        if libraries != None:
+            for name, path in libraries.items():
+                self.load(path, name)
+
+    def load(self, path, name = None):
+        '''
+        Loads a GMT library
+
+        Attributes:
+        -----------
+        path - path to the GMT file (can be gzipped)
+        name - library name (default - file name without extension)
+        '''
+        if name == None:
+            name = str(path).split("/")[-1].split(".gmt")[0]
+        self.add_library(name, read_gmt(path))
+
+    def add_library(self, name, sets):
+        '''
+        Adds a library given as a dictionary term -> list of genes
+        '''
+        terms = list(sets)
+        genes = sorted(set(g for t in terms for g in sets[t]))
+        index = pd.Index(genes)
+        rows = np.repeat(np.arange(len(terms)), [len(set(sets[t])) for t in terms])
+        cols = index.get_indexer([g for t in terms for g in sorted(set(sets[t]))])
+        M = sparse.csr_matrix((np.ones(len(cols), dtype = np.int32), (rows, cols)), shape = (len(terms), len(genes)))
+        self.libraries[name] = {"terms": np.asarray(terms), "genes": index, "M": M, "sizes": np.asarray(M.sum(axis = 1)).ravel()}
+
+    def enrich(self, gene_lists, libraries = None, background = None, cutoff = 0.05):
+        '''
+        Enrichment of many gene lists at once
+
+        Attributes:
+        -----------
+        gene_lists - dictionary name -> list of genes (or a list of lists, named by position)
+        libraries - names of the libraries to use (default - all loaded)
+        background - list of background genes, e.g. all genes of the expression matrix
+            (default - all genes of the library, as in Enrichr)
+        cutoff - only terms with an adjusted p-value below cutoff are returned (default 0.05, None - all)
+
+        Returns a pandas data frame with one row per gene list and enriched term
+        '''
+        from scipy.stats import hypergeom
+        if not isinstance(gene_lists, dict):
+            gene_lists = dict(enumerate(gene_lists))
+        if libraries == None:
+            libraries = list(self.libraries)
+        names = list(gene_lists)
+        out = []
+        for lib in libraries:
+            assert lib in self.libraries, "Library {0} is not loaded".format(lib)
+            L = self.libraries[lib]
+            M, genes = L["M"], L["genes"]
+            sizes = L["sizes"]
+            if background is not None:
+                # restrict the library to the background genes
+                keep = genes.get_indexer(pd.Index(background).unique())
+                keep = keep[keep >= 0]
+                mask = np.zeros(len(genes), dtype = np.int32)
+                mask[keep] = 1
+                M = M.multiply(mask).tocsr()
+                M.eliminate_zeros()
+                sizes = np.asarray(M.sum(axis = 1)).ravel()
+                N = len(keep)
+            else:
+                mask = np.ones(len(genes), dtype = np.int32)
+                N = len(genes)
+            # query x gene indicator matrix of all lists
+            idx = [genes.get_indexer(pd.Index(gene_lists[q]).unique()) for q in names]
+            idx = [i[i >= 0] for i in idx]
+            idx = [i[mask[i] > 0] for i in idx]
+            Q = sparse.csr_matrix((np.ones(sum(len(i) for i in idx), dtype = np.int32),
+                                  (np.repeat(np.arange(len(names)), [len(i) for i in idx]), np.concatenate(idx + [np.zeros(0, dtype = int)]))),
+                                  shape = (len(names), len(genes)))
+            list_sizes = np.asarray(Q.sum(axis = 1)).ravel()
+            # overlaps of all lists with all terms in one product
+            O = (Q @ M.T).tocoo()
+            k = O.data
+            p = hypergeom.sf(k - 1, N, sizes[O.col], list_sizes[O.row])
+            # FDR correction per gene list over all terms of the library
+            adj = np.empty_like(p)
+            order = np.argsort(O.row, kind = "stable")
+            bounds = np.flatnonzero(np.diff(O.row[order])) + 1
+            for sel in np.split(order, bounds):
+                adj[sel] = fdr_bh(p[sel], n_tests = len(sizes))
+            Qc = Q.tocsr()
+            for r, c, kk, pv, ap in zip(O.row, O.col, k, p, adj):
+                if cutoff == None or ap < cutoff:
+                    members = genes[np.intersect1d(Qc.indices[Qc.indptr[r]:Qc.indptr[r + 1]], M.indices[M.indptr[c]:M.indptr[c + 1]])]
+                    out.append([names[r], lib, L["terms"][c], "{0}/{1}".format(kk, sizes[c]), pv, ap, ";".join(members)])
+        res = pd.DataFrame(out, columns = ["list", "library", "term", "overlap", "p_value", "adjusted_p_value", "genes"])
+        return res.sort_values(["list", "library", "adjusted_p_value"]).reset_index(drop = True)
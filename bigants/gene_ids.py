@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# MyGene.info field names -> columns of the local table
+FIELDS = {"entrezgene": "entrezgene", "ensembl.gene": "ensembl_gene", "symbol": "symbol"}
+
+
+class GeneIDStore(object):
+    '''
+        Local SQLite store for mapping between Entrez, Ensembl and symbol gene IDs,
+        used by results_analysis instead of (or before) the MyGene.info web service
+
+        Attributes:
+        -----------
+        path - path to the SQLite file (created if it does not exist)
+        species - species used for queries of the remote fallback (default - 'human')
+
+        Build it once from a downloaded annotation file, e.g. NCBI gene_info
+        (https://ftp.ncbi.nlm.nih.gov/gene/DATA/GENE_INFO/Mammalia/Homo_sapiens.gene_info.gz):
+            store = GeneIDStore("genes.sqlite")
+            store.build_from_gene_info("Homo_sapiens.gene_info.gz")
+        and pass it to results_analysis(..., convert = True, origID = 'entrezgene', id_store = store)
+    '''
+    def __init__(self, path, species = "human"):
+        self.path = path
+        self.species = species
+        self._cache = dict()
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS genes (entrezgene TEXT, ensembl_gene TEXT, symbol TEXT)")
+            for col in FIELDS.values():
+                con.execute("CREATE INDEX IF NOT EXISTS idx_{0} ON genes ({0})".format(col))
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute("SELECT COUNT(*) FROM genes").fetchone()[0]
+
+    def add(self, table):
+        '''
+        Adds rows to the store
+
+        Attributes:
+        -----------
+        table - pandas data frame with any of the columns 'entrezgene', 'ensembl.gene', 'symbol'
+        '''
+        table = table[[c for c in FIELDS if c in table.columns]].rename(columns = FIELDS)
+        table = table.reindex(columns = list(FIELDS.values()))
+        table = table.dropna(how = "all").drop_duplicates()
+        rows = [tuple(None if pd.isna(x) else str(x) for x in row) for row in table.itertuples(index = False, name = None)]
+        with self._connect() as con:
+            con.executemany("INSERT INTO genes VALUES (?, ?, ?)", rows)
+        self._cache = dict()
+
+    def build_from_gene_info(self, path, tax_id = 9606):
+        '''
+        Fills the store from an NCBI gene_info file (plain or gzipped). Ensembl IDs are taken from the dbXrefs column
+
+        Attributes:
+        -----------
+        path - path to the gene_info file
+        tax_id - taxonomy ID of the species to keep (default - 9606, human)
+        '''
+        info = pd.read_csv(path, sep = "\t", usecols = ["#tax_id", "GeneID", "Symbol", "dbXrefs"], dtype = str)
+        if tax_id != None:
+            info = info[info["#tax_id"] == str(tax_id)]
+        table = pd.DataFrame({"entrezgene": info["GeneID"].values,
+                              "ensembl.gene": info["dbXrefs"].str.extract(r"Ensembl:(ENS[A-Z]*G\d+)", expand = False).values,
+                              "symbol": info["Symbol"].values})
+        self.add(table)
+
+    def build_from_table(self, path, sep = "\t", columns = None):
+        '''
+        Fills the store from a delimited annotation table, e.g. a BioMart export
+
+        Attributes:
+        -----------
+        path - path to the table
+        sep - delimiter (default - tab)
+        columns - dictionary that renames the columns of the file to 'entrezgene', 'ensembl.gene' and 'symbol'
+            e.g. {"NCBI gene ID": "entrezgene", "Gene stable ID": "ensembl.gene", "Gene name": "symbol"}
+        '''
+        table = pd.read_csv(path, sep = sep, dtype = str)
+        if columns != None:
+            table = table.rename(columns = columns)
+        assert len(set(FIELDS).intersection(table.columns)) >= 2, "The table needs at least two of the columns {0}".format(list(FIELDS))
+        self.add(table)
+
+    def _pair(self, origID, target):
+        # whole origID -> target mapping as a pandas series, loaded once per pair
+        key = (origID, target)
+        if key not in self._cache:
+            src, dst = FIELDS[origID], FIELDS[target]
+            with self._connect() as con:
+                rows = con.execute("SELECT {0}, {1} FROM genes WHERE {0} IS NOT NULL AND {1} IS NOT NULL".format(src, dst)).fetchall()
+            if len(rows) > 0:
+                keys, values = zip(*rows)
+            else:
+                keys, values = [], []
+            series = pd.Series(values, index = keys, dtype = object)
+            self._cache[key] = series[~series.index.duplicated()]
+        return self._cache[key]
+
+    def convert(self, ids, origID, target = "symbol", remote = False):
+        '''
+        Maps a list of IDs in one vectorised lookup
+
+        Attributes:
+        -----------
+        ids - list of gene IDs
+        origID - type of the given IDs: 'entrezgene', 'ensembl.gene' or 'symbol'
+        target - type of the returned IDs (default - 'symbol')
+        remote - query MyGene.info for IDs missing in the store and add the answers to it (default - False)
+
+        Returns a pandas series indexed by the given IDs, unmapped IDs are NaN
+        '''
+        assert origID in FIELDS and target in FIELDS, "Only {0} are supported".format(list(FIELDS))
+        ids = [str(x) for x in ids]
+        out = self._pair(origID, target).reindex(ids)
+        missing = list(set(np.asarray(ids)[out.isna().values]))
+        if remote and len(missing) > 0:
+            try:
+                self.fetch(missing, origID)
+                out = self._pair(origID, target).reindex(ids)
+            except Exception as e:
+                # e.g. no network access on compute nodes
+                print("WARNING: {0} IDs are not in the store and MyGene.info could not be queried: {1}".format(len(missing), e))
+        return out
+
+    def fetch(self, ids, origID):
+        '''
+        Queries MyGene.info for the given IDs and writes the answers to the store
+        '''
+        import mygene
+        mg = mygene.MyGeneInfo()
+        res = mg.querymany(ids, scopes = origID, fields = "entrezgene,ensembl.gene,symbol", species = self.species, verbose = False)
+        rows = []
+        for line in res:
+            if line.get("notfound", False):
+                continue
+            ens = line.get("ensembl", {})
+            # several Ensembl genes can be returned for one query
+            if isinstance(ens, list):
+                ens = ens[0] if len(ens) > 0 else {}
+            rows.append({"entrezgene": line.get("entrezgene"), "ensembl.gene": ens.get("gene"), "symbol": line.get("symbol")})
+        if len(rows) > 0:
+            self.add(pd.DataFrame(rows))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Optional JIT compiled versions of the random walks and the pheromone deposit.
+# numba is not a requirement: without it run_search() uses the NumPy implementation
+# in BiGAnts.walk() / BiGAnts.pher_upd(). numba is only imported (and the kernels compiled)
+# when the first kernel runs, so importing bigants stays fast.
+
+import importlib.util
+
+import numpy as np
+
+from bigants.precision import P_SCALE
+
+BACKENDS = ["auto", "numpy", "numba"]
+# compiled kernels by name, filled by compiled()
+_jit = dict()
+
+
+def available():
+    """
+    True if numba is installed (without importing it)
+    """
+    return importlib.util.find_spec("numba") != None
+
+
+def select(backend):
+    """
+    Resolves the backend name: "auto" uses numba if it is installed, "numba" falls back to "numpy" without it
+    """
+    assert backend in BACKENDS, "backend should be one of {0}, the value was: {1}".format(BACKENDS, backend)
+    if backend == "auto":
+        return "numba" if available() else "numpy"
+    if backend == "numba" and not available():
+        print("WARNING: numba is not installed, the NumPy backend is used instead")
+        return "numpy"
+    return backend
+
+
+def flatten_probs(probs, N, rows = None):
+    """
+    Packs the per patient probability tables (dim x |N_w|, or |rows_w| x |N_w| for compact tables)
+    and neighbourhoods into flat arrays for the kernels
+    """
+    widths = np.asarray([len(x) for x in N], dtype = np.int64)
+    heights = np.asarray([P.shape[0] for P in probs], dtype = np.int64)
+    P_off = np.zeros(len(probs), dtype = np.int64)
+    P_off[1:] = np.cumsum(widths[:-1] * heights[:-1])
+    N_off = np.zeros(len(N), dtype = np.int64)
+    N_off[1:] = np.cumsum(widths[:-1])
+    P_flat = np.concatenate([np.ascontiguousarray(P).ravel() for P in probs])
+    N_flat = np.concatenate([np.asarray(x, dtype = np.int64) for x in N])
+    # row IDs of compact tables, empty for full tables (row = node ID)
+    R_len = np.zeros(len(probs), dtype = np.int64)
+    if rows is not None:
+        R_len[:] = heights
+    R_off = np.zeros(len(probs), dtype = np.int64)
+    R_off[1:] = np.cumsum(R_len[:-1])
+    R_flat = np.concatenate([np.asarray(x, dtype = np.int64) for x in rows]) if rows is not None else np.zeros(0, dtype = np.int64)
+    return P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len
+
+
+def _walks(starts, P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len, cost, cost_limit, n, seed, unit):
+    # one walk per start node, same transitions as BiGAnts.walk(): the next node is drawn by
+    # inverse CDF sampling like numpy.random.choice, so with the same seed the same paths are produced.
+    # unit - sum of a full row of the tables (1 or the fixed point scale)
+    np.random.seed(seed)
+    m = len(starts)
+    out = np.empty(16 * m + 16, dtype = np.int64)
+    ptr = np.zeros(m + 1, dtype = np.int64)
+    cnt = 0
+    for w in range(m):
+        start = starts[w]
+        k = cost_limit
+        width = widths[w]
+        while True:
+            pos = start
+            if R_len[w] > 0:
+                pos = np.searchsorted(R_flat[R_off[w]:R_off[w] + R_len[w]], start)
+            row = P_off[w] + pos * width
+            total = 0.0
+            for j in range(width):
+                total += P_flat[row + j]
+            #if there is any node inside the radious - keep mooving
+            if not total > 0.5 * unit:
+                break
+            u = np.random.random()
+            tr = N_flat[N_off[w] + width - 1]
+            acc = 0.0
+            for j in range(width):
+                acc += P_flat[row + j]
+                if acc / total > u:
+                    tr = N_flat[N_off[w] + j]
+                    break
+            c = cost[start, tr]
+            #if there is any cost left we keep going
+            if k - c > 0:
+                #we are saving only genes
+                if tr < n:
+                    if cnt == len(out):
+                        bigger = np.empty(2 * len(out), dtype = np.int64)
+                        bigger[:cnt] = out[:cnt]
+                        out = bigger
+                    out[cnt] = tr
+                    cnt += 1
+                start = tr
+                k = k - c
+            else:
+                break
+        ptr[w + 1] = cnt
+    return out[:cnt], ptr
+
+
+def _deposit(t, genes, patients, sc):
+    # same update as BiGAnts.pher_upd() for one gene/patient group
+    for g1 in genes:
+        for p1 in patients:
+            t[g1, p1] += sc
+            t[p1, g1] += sc
+        for g2 in genes:
+            t[g1, g2] += sc
+
+
+def compiled(name):
+    # JIT compiled kernel "walks" or "deposit", numba is imported on the first call
+    if name not in _jit:
+        import numba
+        _jit[name] = numba.njit(cache = True)({"walks": _walks, "deposit": _deposit}[name])
+    return _jit[name]
+
+
+def walks(flat, starts, cost, cost_limit, n, seed):
+    """
+    Runs one walk from every start node with the compiled kernel
+
+    Attributes:
+    -----------
+    flat - output of flatten_probs()
+    starts - start node (patient) of each walk
+    cost - transition costs
+    cost_limit - defines the radius of the search for ants
+    n - number of genes
+    seed - seed of the random generator used by the kernel
+
+    Returns a list with the genes visited by each walk
+    """
+    P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len = flat
+    # tables and costs are used in their storage type (float64, float32 or int16 fixed point)
+    unit = float(P_SCALE) if P_flat.dtype.kind == "i" else 1.0
+    out, ptr = compiled("walks")(np.asarray(starts, dtype = np.int64), P_flat, P_off, widths, N_flat, N_off, R_flat, R_off, R_len,
+                                    np.ascontiguousarray(cost), float(cost_limit), n, seed, unit)
+    return [out[ptr[w]:ptr[w + 1]] for w in range(len(starts))]
+
+
+def deposit(t, solution, scores):
+    """
+    Adds the scores of each group of the solution to the pheromone matrix t in place
+    """
+    kernel = compiled("deposit")
+    for i in range(len(solution[0])):
+        kernel(t, np.asarray(solution[0][i], dtype = np.int64), np.asarray(solution[1][i], dtype = np.int64), float(scores[i]))
+    return t
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Array backed index between the internal node IDs (0...n-1 genes, n...n+m-1 patients) and the
+# original gene and patient IDs. It is a read-only mapping, so it can be used wherever the labels
+# dictionary of data_preprocessing() is used, and its rev attribute replaces rev_labels.
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class IDIndex(Mapping):
+    '''
+        Bidirectional index internal ID -> original ID backed by NumPy arrays
+
+        index[5] and index.rev["TP53"] look up single IDs, decode() and encode() convert whole
+        arrays of IDs at once. save() writes the index next to the results, load_index() reads it
+
+        Attributes:
+        -----------
+        ids - original IDs in the order of the internal IDs 0...len(ids)-1 (converted to strings, must be unique)
+    '''
+    def __init__(self, ids):
+        self.ids = np.asarray([str(x) for x in ids])
+        # sorted original IDs and their internal IDs for the binary search of encode()
+        self._order = np.argsort(self.ids, kind = "stable")
+        self._sorted = self.ids[self._order]
+        assert len(self.ids) == 0 or not np.any(self._sorted[1:] == self._sorted[:-1]), "The IDs should be unique"
+        self.rev = ReverseIndex(self)
+
+    def __getitem__(self, node):
+        if isinstance(node, (bool, np.bool_)) or not isinstance(node, (int, np.integer)) or not 0 <= node < len(self.ids):
+            raise KeyError(node)
+        return str(self.ids[node])
+
+    def __iter__(self):
+        return iter(range(len(self.ids)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node):
+        return isinstance(node, (int, np.integer)) and 0 <= node < len(self.ids)
+
+    def decode(self, nodes):
+        """
+        Original IDs (array of strings) of an array of internal IDs
+        """
+        return self.ids[np.asarray(nodes, dtype = int)]
+
+    def encode(self, ids, missing = None):
+        """
+        Internal IDs of an array of original IDs. Unknown IDs are an error, or get the value missing if it is given (e.g. -1)
+        """
+        ids = np.asarray([str(x) for x in ids]) if not isinstance(ids, np.ndarray) else ids.astype(str)
+        if len(self.ids) == 0:
+            assert missing != None or len(ids) == 0, "The index is empty"
+            return np.full(len(ids), missing if missing != None else 0, dtype = int)
+        pos = np.minimum(np.searchsorted(self._sorted, ids), len(self.ids) - 1)
+        found = self._sorted[pos] == ids
+        if missing == None:
+            assert np.all(found), "Unknown IDs: {0}".format(list(ids[~found][:5]))
+            return self._order[pos]
+        return np.where(found, self._order[pos], missing)
+
+    def extend(self, ids):
+        """
+        New index with ids appended (they get the next internal IDs)
+        """
+        return IDIndex(list(self.ids) + list(ids))
+
+    def save(self, path):
+        """
+        Saves the index (compressed .npz)
+        """
+        np.savez_compressed(path, ids = self.ids)
+
+
+class ReverseIndex(Mapping):
+    # original ID -> internal ID view of an IDIndex (the rev_labels of data_preprocessing())
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, key):
+        node = self.index.encode([key], missing = -1)[0]
+        if node < 0:
+            raise KeyError(key)
+        return int(node)
+
+    def __iter__(self):
+        return iter(str(x) for x in self.index.ids)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return self.index.encode([key], missing = -1)[0] >= 0
+
+
+def load_index(path):
+    """
+    Loads an IDIndex written by IDIndex.save()
+    """
+    with np.load(path) as data:
+        return IDIndex(data["ids"])
+
+
+def decode(labels, nodes):
+    """
+    Original IDs (list of strings) of internal IDs for an IDIndex or a labels dictionary
+    """
+    if isinstance(labels, IDIndex):
+        return labels.decode(nodes).tolist()
+    return [str(labels[x]) for x in nodes]
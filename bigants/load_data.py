@@ -4,9 +4,12 @@
 import pandas as pd
 import numpy as np
 from scipy import stats
+from scipy import sparse
 import networkx as nx
 import csv
 
+from bigants.labels import IDIndex
+
 def data_preprocessing(path_expr, path_net,log2 = True, zscores = True, size = 2000, no_zero = None, formats = []):
     """
     Raw data processing for further analysis
@@ -22,15 +25,19 @@ def data_preprocessing(path_expr, path_net,log2 = True, zscores = True, size = 2
     z-scores - indicates if z-scores normalization should be applied (default - True)
     no_zero - proportion of non-zero elements for each gene. If there are less values then a gene will not be maintained
     format = list of data types for gene expression matrix and the ppi network. Example ["csv", "tsv"]. Used if the automatic delimeter needs to be ommited
+    
+    Returns the processed expression, the network, labels (IDIndex internal ID -> original ID, see bigants.labels)
+    and rev_labels (original ID -> internal ID)
     """
+    formats = list(formats) + [None, None]
     if formats[0] == "csv" or formats[0] == "tsv":
         d_expr = formats[0]
     else:
-        d_expr == None
+        d_expr = None
     if formats[1] == "csv" or formats[1] == "tsv":
         d_ppi = formats[1]
     else:
-        d_ppi == None
+        d_ppi = None
         
     expr = open_file(path_expr, d_expr)
     
@@ -80,30 +87,139 @@ def data_preprocessing(path_expr, path_net,log2 = True, zscores = True, size = 2
     if zscores:
         expr = pd.DataFrame(stats.zscore(expr) ,columns = expr.columns, index = expr.index)
     
-    labels = dict()
-    rev_labels = dict()
-    node = 0
-    #nodes = set(deg_nodes + genes_aco)
-    for g in genes_for_expr:
-       labels[node] = g
-       rev_labels[g] = node
-       node = node+1
-    for p in patients_new:
-       labels[node] = p
-       rev_labels[p] = node
-       node = node+1
+    # internal IDs: genes 0...n-1, patients n...n+m-1
+    labels = IDIndex(list(genes_for_expr) + list(patients_new))
+    rev_labels = labels.rev
     n,m = expr.shape    
-    G = nx.Graph()
-    G.add_nodes_from(np.arange(n))
-    for row in net.itertuples():
-        node1 = str(row[1])
-        node2 = str(row[2])
-        if node1 in set(genes_for_expr) and node2 in set(genes_for_expr):    
-            G.add_edge(rev_labels[node1],rev_labels[node2])
+    G = network(net, labels, n)
     expr.index = np.arange(n)
     expr.columns =  np.arange(n,n+m)
     return expr,G,labels, rev_labels
 
+def new_patients_preprocessing(path_expr, GE, labels, rev_labels, log2 = True, zscores = True, formats = []):
+    """
+    Processing of new patients for a model that was set up with data_preprocessing(): the genes
+    of the model are kept and the new patients get the next internal IDs (see BiGAnts.add_patients())
+    
+    Attributes:
+    -----------
+    non-default:
+    path_expr - path for gene expression of the new patients, same format as for data_preprocessing()
+    GE - processed gene expression used by the model
+    labels, rev_labels - outputs of data_preprocessing()
+    default:
+    log2 - log2 transform (if needed)
+    zscores - indicates if z-scores normalization should be applied (default - True). As in data_preprocessing()
+    z-scores are computed per patient, so they do not depend on the other patients
+    format - data type of the gene expression file ("csv" or "tsv")
+    
+    Returns the expression of the new patients and the extended labels and rev_labels
+    """
+    formats = list(formats) + [None]
+    if formats[0] == "csv" or formats[0] == "tsv":
+        d_expr = formats[0]
+    else:
+        d_expr = None
+    expr = open_file(path_expr, d_expr)
+    expr = expr.set_index(expr.columns[0])
+    expr.index = [str(x) for x in expr.index]
+    expr = expr.loc[~expr.index.duplicated()]
+    known = [p for p in expr.columns if p in rev_labels]
+    if len(known) > 0:
+        print("WARNING: {0} patients are already part of the model and will be skipped".format(len(known)))
+    patients_new = [p for p in expr.columns if p not in rev_labels]
+    assert len(patients_new) > 0, "There are no new patients"
+    genes = [labels[g] for g in GE.index]
+    missing = len([g for g in genes if g not in expr.index])
+    if missing > 0:
+        print("WARNING: {0} genes of the model are missing for the new patients, they are set to the patient mean".format(missing))
+    expr = expr.reindex(genes)[patients_new]
+    if log2:
+        minimal = expr.min().min()
+        if minimal <= 0:
+            expr+= np.abs(minimal-1)
+        expr = np.log2(expr)
+    expr = expr.fillna(expr.mean())
+    if zscores:
+        expr = pd.DataFrame(stats.zscore(expr) ,columns = expr.columns, index = expr.index)
+    if isinstance(labels, IDIndex):
+        labels = labels.extend(patients_new)
+        rev_labels = labels.rev
+    else:
+        labels = dict(labels)
+        rev_labels = dict(rev_labels)
+        node = max(labels) + 1
+        for p in patients_new:
+           labels[node] = p
+           rev_labels[p] = node
+           node = node+1
+    expr.index = GE.index
+    expr.columns = [rev_labels[p] for p in patients_new]
+    return expr, labels, rev_labels
+
+def singlecell_preprocessing(X, genes, cells, path_net, log1p = True, size = 2000, formats = []):
+    """
+    Processing of single-cell data for SingleCellBiGAnts. The expression matrix stays sparse,
+    genes are selected by their variance without densifying it
+    
+    Attributes:
+    -----------
+    non-default:
+    X - genes x cells expression matrix, scipy.sparse or numpy array (for an AnnData object: adata.X.T)
+    genes - gene IDs of the rows (same IDs as in the network)
+    cells - cell IDs of the columns
+    path_net - path for ppi
+    default:
+    log1p - log(1+x) transform of the counts (default - True)
+    size - number of genes with the highest variance that are kept (default 2000)
+    format - data type of the ppi network ("csv" or "tsv")
+    
+    Returns the processed expression (scipy.sparse.csr_matrix, genes x cells), the network and labels, rev_labels
+    as for data_preprocessing(): genes are 0...n-1, cells are n...n+cells-1
+    """
+    formats = list(formats) + [None]
+    if formats[0] == "csv" or formats[0] == "tsv":
+        d_ppi = formats[0]
+    else:
+        d_ppi = None
+    X = sparse.csr_matrix(X, dtype = np.float32)
+    assert X.shape == (len(genes), len(cells)), "X should have len(genes) rows and len(cells) columns, the shape was {0}".format(X.shape)
+    net = open_file(path_net, d_ppi, header = None)
+    nodes_ppi = set([str(x) for x in set(net[0]).union(set(net[1]))])
+    genes = [str(x) for x in genes]
+    idx = []
+    seen = set()
+    for i, g in enumerate(genes):
+        if g in nodes_ppi and g not in seen:
+            idx.append(i)
+            seen.add(g)
+    assert len(idx) > 0, "The identifiers in the expression matrix and network file do not match"
+    X = X[idx,:]
+    if log1p:
+        X = X.log1p()
+    if size != None and len(idx) > size:
+        mean = np.asarray(X.mean(axis = 1)).ravel()
+        var = np.asarray(X.multiply(X).mean(axis = 1)).ravel() - mean**2
+        keep = np.sort(np.argsort(var)[len(var)-size:])
+        X = X[keep,:]
+        idx = [idx[i] for i in keep]
+    genes_for_expr = [genes[i] for i in idx]
+    
+    labels = IDIndex(list(genes_for_expr) + list(cells))
+    rev_labels = labels.rev
+    G = network(net, labels, len(genes_for_expr))
+    return X.tocsr(), G, labels, rev_labels
+
+def network(net, labels, n):
+    # graph of the genes 0...n-1 with the edges of the network table whose both ends are selected genes
+    G = nx.Graph()
+    G.add_nodes_from(np.arange(n))
+    node1 = labels.encode(net[0].astype(str).values, missing = -1)
+    node2 = labels.encode(net[1].astype(str).values, missing = -1)
+    keep = (node1 >= 0) & (node1 < n) & (node2 >= 0) & (node2 < n)
+    G.add_edges_from(zip(node1[keep].tolist(), node2[keep].tolist()))
+    return G
+
 # allows to determine the delimeter automatically given the path or directly the object
 def open_file(file_name, d, **kwards):
     if d == None:
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Memory and run time planning for run_search(). Everything is estimated from the problem
+# size before any of the (n+m) x (n+m) arrays is allocated.
+
+import math
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+# representations of the probability tables of the ants, from the most to the least memory:
+# dense - a dim x |N| table per patient, sparse - only the rows of the search area (|N|+1 x |N|),
+# candidate - sparse tables over top-k candidate lists
+MODES = ["dense", "sparse", "candidate"]
+# candidate list sizes that are tried, largest first
+CAND_SIZES = [500, 200, 100, 50, 20]
+# rough number of steps of one random walk and fixed costs per step / per ant (seconds)
+STEPS = 10
+STEP_TIME = {"numpy": 2e-5, "numba": 2e-7}
+ANT_TIME = 0.02
+# bytes per entry of H, of the pheromone / cost matrices and of the probability tables for each precision policy
+ITEMSIZE = {"short": (2, 8, 8), "float32": (4, 4, 4), "int16": (2, 2, 2)}
+
+_elem_time = []
+
+
+def elem_time():
+    """
+    Seconds per element of a simple NumPy array operation on this machine (measured once)
+    """
+    if len(_elem_time) == 0:
+        x = np.ones(10 ** 6)
+        y = np.empty_like(x)
+        #timing loop, the product is written to a preallocated array
+        st = time.time()
+        for _ in range(5):
+            np.multiply(x, x, out = y)
+        _elem_time.append(max((time.time() - st) / 5 / x.size, 1e-10))
+    return _elem_time[0]
+
+
+def search_area(n, m, th = 0.5, cand_k = None):
+    """
+    Expected average search area size: top-k candidate lists or the nodes above mean + th*std,
+    which is a fraction 1 - Phi(th) of all nodes for normally distributed similarities
+    """
+    dim = n + m
+    if cand_k != None:
+        return min(cand_k, dim - 1)
+    if th < 0:
+        return dim - 1
+    return max(1, dim * (1 - 0.5 * (1 + math.erf(th / math.sqrt(2)))))
+
+
+def estimate(n, m, avg_N, K = 20, n_proc = 1, mode = "dense", backend = "numpy", precision = "short"):
+    """
+    Peak memory (bytes) and time per iteration (seconds) of run_search() for one representation
+
+    Attributes:
+    -----------
+    n, m - number of genes and patients
+    avg_N - average search area size
+    K - number of ants
+    n_proc - number of processes
+    mode - one of MODES
+    backend - "numpy" or "numba"
+    precision - precision policy (default "short")
+    """
+    h_size, t_size, p_size = ITEMSIZE[precision]
+    dim = n + m
+    rows = dim if mode == "dense" else avg_N + 1
+    probs = m * rows * avg_N * p_size
+    if backend == "numba":
+        # flat copy of the tables for the kernels
+        probs = probs * 2
+    square = dim * dim
+    # H, cost and the expression data are kept for the whole run
+    base = square * h_size + square * t_size + n * m * 8
+    # probability update: pheromones, the dim x dim temporaries (three float64 or one float32)
+    # and the old and new tables
+    temp = square * 8 * 3 if precision == "short" else square * 4
+    upd = square * t_size + temp + probs * 2
+    # ants: tables and pheromones plus per process clustering data, the tables are copied
+    # to the processes unless they are forked
+    worker = n * m * 8
+    if n_proc > 1 and mp.get_start_method(allow_none = True) not in (None, "fork"):
+        worker = worker + probs + base
+    ants = square * t_size + probs + worker * n_proc
+    memory = base + max(upd, ants)
+
+    e = elem_time()
+    walks = K * m * STEPS * (STEP_TIME[backend] + avg_N * e)
+    ants_time = (walks + K * ANT_TIME) / n_proc
+    upd_time = (3 * square + m * rows * avg_N) * e
+    return memory, ants_time + upd_time
+
+
+def plan_search(n, m, K = 20, n_proc = 1, memory = None, th = 0.5, cand_k = None, avg_N = None, modes = None, backend = "numpy", precision = "short"):
+    """
+    Chooses the representation of the probability tables and the number of processes for run_search().
+    Without a memory budget the requested setting is only estimated. With a budget the first
+    representation of MODES (with the largest candidate list) and the largest number of processes
+    up to n_proc that fit are chosen.
+
+    Attributes:
+    -----------
+    n, m - number of genes and patients
+    K - number of ants (default 20)
+    n_proc - requested number of processes (default 1)
+    memory - memory budget in GB (default - None, no planning)
+    th - similarity threshold (default 0.5)
+    cand_k - requested candidate list size (default - None)
+    avg_N - average search area size if it is already known (default - estimated with search_area())
+    modes - representations that can be chosen (default - all, or only "candidate" if cand_k is given)
+    backend - "numpy" or "numba" (default "numpy")
+    precision - precision policy, see run_search() (default "short")
+
+    Returns a dictionary with mode, compact, cand_k, n_proc, avg_N, memory (GB), time (seconds per iteration) and fits
+    """
+    def make(mode, k, procs):
+        size = avg_N if avg_N != None else search_area(n, m, th, k)
+        if k != None and avg_N != None:
+            size = min(avg_N, k)
+        mem, sec = estimate(n, m, size, K, procs, mode, backend, precision)
+        return {"mode": mode, "compact": mode != "dense", "cand_k": k, "n_proc": procs, "avg_N": round(size, 1),
+                "memory": mem / 1e9, "time": sec, "budget": memory,
+                "fits": memory == None or mem / 1e9 <= memory}
+
+    if modes == None:
+        modes = ["candidate"] if cand_k != None else MODES
+    for mode in modes:
+        assert mode in MODES, "Unknown mode {0}, use any of {1}".format(mode, MODES)
+    requested = make(modes[0], cand_k, n_proc)
+    if memory == None:
+        return requested
+    for mode in modes:
+        if mode == "candidate":
+            sizes = [cand_k] if cand_k != None else [k for k in CAND_SIZES if k < search_area(n, m, th)]
+        else:
+            sizes = [None]
+        for k in sizes:
+            for procs in range(n_proc, 0, -1):
+                plan = make(mode, k, procs)
+                if plan["fits"]:
+                    return plan
+    print("WARNING: no setting fits into {0} GB, the smallest estimate is used".format(memory))
+    if modes[-1] != "candidate":
+        return make(modes[-1], None, 1)
+    return make(modes[-1], cand_k if cand_k != None else CAND_SIZES[-1], 1)
+
+
+def describe(plan):
+    """
+    One line summary of a plan for the run statistics
+    """
+    budget = "" if plan["budget"] == None else " (budget {0} GB)".format(plan["budget"])
+    cand = "" if plan["cand_k"] == None else ", cand_k = {0}".format(plan["cand_k"])
+    return "plan: {0} probability tables{1}, {2} processes, average search area {3}, estimated peak memory {4:.2f} GB{5}, {6:.2f}s per iteration".format(
+        plan["mode"], cand, plan["n_proc"], plan["avg_N"], plan["memory"], budget, plan["time"])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Storage types of the heuristic information, pheromones, probability tables and transition costs.
+
+import numpy as np
+
+POLICIES = ["short", "float32", "int16"]
+# fixed point scales of the int16 policy: heuristic information 0..10, pheromones up to 32,
+# probabilities 0..1 and costs 0..1
+H_SCALE = 1024
+T_SCALE = 1024
+P_SCALE = 16384
+COST_SCALE = 4096
+INT16_MAX = np.iinfo(np.int16).max
+# entries of the pheromone matrix that are evaporated at once in fixed point
+CHUNK = 2**20
+# fixed point evaporation rates below this are rounded stochastically: rounded to the nearest integer,
+# pheromones below 0.5/p would never decay (e.g. below 15 for the per-ant rate of the asynchronous search)
+STOCHASTIC_P = 0.1
+
+
+class Precision(object):
+    '''
+        Precision policy of run_search()
+
+        short - heuristic information truncated to integers 0..10 (int16), pheromones, probabilities
+            and costs in float64. This is the original behaviour of the algorithm
+        float32 - everything in float32, pheromone and probability updates are done in place
+        int16 - everything in int16 fixed point (see the *_SCALE constants), pheromones saturate at 32
+            and probabilities are resolved to 1/16384. Half the memory of float32
+
+        Attributes:
+        -----------
+        name - one of POLICIES (default "short")
+    '''
+    def __init__(self, name = "short"):
+        assert name in POLICIES, "precision should be one of {0}, the value was: {1}".format(POLICIES, name)
+        self.name = name
+        if name == "short":
+            self.H_dtype, self.t_dtype, self.p_dtype, self.cost_dtype = np.short, np.float64, np.float64, np.float64
+        elif name == "float32":
+            self.H_dtype, self.t_dtype, self.p_dtype, self.cost_dtype = np.float32, np.float32, np.float32, np.float32
+        else:
+            self.H_dtype, self.t_dtype, self.p_dtype, self.cost_dtype = np.int16, np.int16, np.int16, np.int16
+        fixed = name == "int16"
+        self.H_scale = H_SCALE if fixed else 1
+        self.t_scale = T_SCALE if fixed else 1
+        self.p_scale = P_SCALE if fixed else 1
+        self.cost_scale = COST_SCALE if fixed else 1
+
+    def heuristic(self, H):
+        '''
+        Converts (a block of) the heuristic information from float values 0..10 to the storage type
+        '''
+        if self.name == "int16":
+            return np.rint(np.asarray(H) * self.H_scale).astype(np.int16)
+        return np.asarray(H).astype(self.H_dtype)
+
+    def pheromone(self, dim, level = 5):
+        '''
+        Initial pheromone matrix with the given level
+        '''
+        if self.name == "short":
+            # the original matrix: int16 at first, float64 after the first update
+            return (np.ones((dim, dim)) * level).astype(np.short)
+        return np.full((dim, dim), level * self.t_scale, dtype = self.t_dtype)
+
+    def evaporate(self, t, p, t_min = 0):
+        '''
+        Multiplies the stored pheromones by 1-p in place. Fixed point values are rounded through a float32
+        buffer of a few rows (to the nearest integer, stochastically for rates below STOCHASTIC_P) and are
+        not evaporated below level(t_min), so they never reach zero
+        '''
+        if self.name != "int16":
+            t *= 1-p
+            return t
+        low = self.level(t_min)
+        step = max(1, CHUNK // t.shape[1])
+        scratch = np.empty((min(step, t.shape[0]), t.shape[1]), dtype = np.float32)
+        for st in range(0, t.shape[0], step):
+            block = t[st:st + step]
+            buf = scratch[:len(block)]
+            np.multiply(block, 1-p, out = buf, dtype = np.float32)
+            if p < STOCHASTIC_P:
+                #rounds up with the probability of the fractional part, the expected value is kept
+                buf += np.random.random_sample(buf.shape)
+                np.floor(buf, out = buf)
+            else:
+                np.rint(buf, out = buf)
+            np.maximum(buf, low, out = buf)
+            block[...] = buf
+        return t
+
+    def level(self, t_min):
+        '''
+        Stored value of the pheromone level t_min, at least 1 in fixed point
+        '''
+        if self.name == "int16":
+            return np.int16(max(1, round(t_min*self.t_scale)))
+        return t_min*self.t_scale
+
+    def floor(self, t, t_min):
+        '''
+        Raises the stored pheromones to at least level(t_min) in place
+        '''
+        np.maximum(t, t.dtype.type(self.level(t_min)), out = t)
+        return t
+
+    def cost(self, H):
+        '''
+        Transition costs max(H)/10 - H/10 from the stored heuristic information
+        '''
+        if self.name == "short":
+            cost = H/10
+            return np.max(cost)-cost
+        cost = np.subtract(np.max(H), H, dtype = np.float32)
+        cost *= 1 / (10 * self.H_scale)
+        if self.name == "int16":
+            cost *= self.cost_scale
+            np.rint(cost, out = cost)
+            return cost.astype(np.int16)
+        return cost
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import multiprocessing as mp
+import os
+
+# data shared with the rendering workers, set once per worker by _init_worker()
+_shared = {}
+
+KINDS = ["networks", "clustermap", "convergence"]
+
+
+def _init_worker(GE, G, dpi, fmt, headless = True):
+    if headless:
+        # non-interactive backend: figures are only written to files
+        import matplotlib
+        matplotlib.use("Agg")
+    _shared["GE"] = GE
+    _shared["G"] = G
+    _shared["dpi"] = dpi
+    _shared["fmt"] = fmt
+
+
+def _layout(G_small):
+    import networkx as nx
+    return nx.spring_layout(G_small)
+
+
+def _render(args):
+    name, results, scores, pos, kinds, output = args
+    GE, G, dpi, fmt = _shared["GE"], _shared["G"], _shared["dpi"], _shared["fmt"]
+    files = []
+    if "networks" in kinds:
+        path = os.path.join(output, "{0}.network.{1}".format(name, fmt))
+        results.show_networks(GE, G, output = path, show = False, pos = pos, dpi = dpi)
+        files.append(path)
+    if "clustermap" in kinds:
+        path = os.path.join(output, "{0}.clustermap.{1}".format(name, fmt))
+        results.show_clustermap(GE, G, output = path, show = False, dpi = dpi)
+        files.append(path)
+    if "convergence" in kinds and scores != None:
+        path = os.path.join(output, "{0}.convergence.{1}".format(name, fmt))
+        results.convergence_plot(scores, output = path, show = False)
+        files.append(path)
+    return name, files
+
+
+def render_reports(results, GE, G, output, scores = None, names = None, kinds = KINDS, n_proc = 1, dpi = 150, fmt = "png"):
+    """
+    Writes network, clustermap and convergence figures for many solutions without displaying them.
+    Figures are rendered with a non-interactive backend in a pool of processes and the spring
+    layout of every distinct subnetwork is computed only once.
+
+    Attributes:
+    -----------
+    results - list of results_analysis objects
+    GE - processed gene expression data from data_preprocessing() function
+    G - processed PPI network from data_preprocessing() function
+    output - directory where the figures are saved as <name>.network.png, <name>.clustermap.png, <name>.convergence.png
+    scores - list with the second output of run_search() for each solution, needed for convergence plots (default - None)
+    names - file name prefix for each solution (default - run0, run1, ...)
+    kinds - figures to produce, any of "networks", "clustermap", "convergence" (default - all)
+    n_proc - number of processes (default 1)
+    dpi - resolution of the figures (default 150)
+    fmt - image format (default "png")
+
+    Returns a dictionary name -> list of written files
+    """
+    from bigants.results_processing import _layouts, cache_layout, layout, layout_key
+    assert n_proc > 0, "Set a correct number for n_proc, right now the value is {0}".format(n_proc)
+    for kind in kinds:
+        assert kind in KINDS, "Unknown figure {0}, use any of {1}".format(kind, KINDS)
+    if names == None:
+        names = ["run{0}".format(i) for i in range(len(results))]
+    if scores == None:
+        scores = [None] * len(results)
+    assert len(names) == len(results) and len(scores) == len(results), "names and scores need one entry per solution"
+    os.makedirs(output, exist_ok = True)
+
+    # distinct subnetworks are laid out once (in parallel) and the positions are cached
+    positions = [None] * len(results)
+    if "networks" in kinds:
+        subnets = [r.subnetwork(G) for r in results]
+        keys = [layout_key(g) for g in subnets]
+        todo = dict()
+        for key, g in zip(keys, subnets):
+            if key not in _layouts and key not in todo:
+                todo[key] = g
+        computed = dict()
+        if n_proc > 1 and len(todo) > 1:
+            with mp.Pool(n_proc) as pool:
+                for key, pos in zip(todo, pool.map(_layout, list(todo.values()))):
+                    computed[key] = cache_layout(key, pos)
+        positions = [computed[key] if key in computed else layout(g) for key, g in zip(keys, subnets)]
+
+    tasks = [(names[i], results[i], scores[i], positions[i], kinds, output) for i in range(len(results))]
+    written = dict()
+    if n_proc == 1:
+        # figures are closed without being shown, the backend of the session is kept
+        _init_worker(GE, G, dpi, fmt, headless = False)
+        for task in tasks:
+            name, files = _render(task)
+            written[name] = files
+    else:
+        with mp.Pool(n_proc, initializer = _init_worker, initargs = (GE, G, dpi, fmt)) as pool:
+            for name, files in pool.imap_unordered(_render, tasks):
+                written[name] = files
+    return written
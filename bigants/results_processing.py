@@ -1,13 +1,42 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import collections
 import pandas as pd
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import mygene
 import networkx as nx
 import numpy as np
-import seaborn as sns; sns.set(color_codes=True)
-import gseapy
+# mygene, gseapy and the plotting libraries are imported on first use
+from bigants import _plotting
+from bigants.labels import decode
+
+# spring layouts of recently drawn subnetworks, keyed by their nodes and edges. The least recently
+# used ones are dropped beyond LAYOUT_CACHE entries, so long running processes do not grow
+LAYOUT_CACHE = 256
+_layouts = collections.OrderedDict()
+
+
+def layout_key(G_small):
+    # identifies a subnetwork by its nodes and edges
+    return (tuple(sorted(map(str, G_small.nodes()))), tuple(sorted(tuple(sorted(map(str, e))) for e in G_small.edges())))
+
+
+def layout(G_small):
+    """
+    Spring layout of a (small) network, computed once per distinct subnetwork
+    """
+    key = layout_key(G_small)
+    if key in _layouts:
+        _layouts.move_to_end(key)
+        return _layouts[key]
+    return cache_layout(key, nx.spring_layout(G_small))
+
+
+def cache_layout(key, pos):
+    # adds a layout to the cache and drops the least recently used ones
+    _layouts[key] = pos
+    _layouts.move_to_end(key)
+    while len(_layouts) > LAYOUT_CACHE:
+        _layouts.popitem(last = False)
+    return pos
 
 
 class results_analysis():
@@ -17,7 +46,7 @@ class results_analysis():
         Attributes:
         -----------
         solution - the output file of BiGAnts.run_search() function
-        labels - data preprocessing labels from data_preprocessing() function
+        labels - data preprocessing labels from data_preprocessing() function (IDIndex or a dictionary internal ID -> original ID)
         convert - indicates if gene IDs should be converted to gene names 
         for the further results analysis (default - False)
         origID - indicates the original gene ids used. This field is mandatory for the enrichment analysis.
@@ -25,22 +54,33 @@ class results_analysis():
             'entrezgene', 'ensembl.gene', 'symbol', 'refseq', 'unigene', etc
             for all possibe option please check  the reference for MyGene.info gene query web service
             http://docs.mygene.info/en/latest/doc/query_service.html#available_fields
+        id_store - GeneIDStore for offline ID conversion. MyGene.info is then queried only for
+        IDs missing in the store and the answers are saved in it (default - None, always query MyGene.info)
+        client - AnnotationClient for batched, retried and cached MyGene.info queries (default - None, use the mygene package).
+        To annotate many solutions at once see AnnotationClient.annotate()
     '''
-    def __init__(self, solution, labels, convert = False, origID = None):
+    def __init__(self, solution, labels, convert = False, origID = None, id_store = None, client = None):
         self.solution = solution
         self.labels = labels
-        self.patients1 = [str(self.labels[x]) for x in self.solution[1][0]]
-        self.patients2 = [str(self.labels[x]) for x in self.solution[1][1]]
-        self.genes1 = [str(self.labels[x]) for x in self.solution[0][0]]    
-        self.genes2 = [str(self.labels[x]) for x in self.solution[0][1]]
+        self.patients1 = decode(self.labels, self.solution[1][0])
+        self.patients2 = decode(self.labels, self.solution[1][1])
+        self.genes1 = decode(self.labels, self.solution[0][0])
+        self.genes2 = decode(self.labels, self.solution[0][1])
         self.convert = convert
         self.origID = origID
         
         if convert == True:
             assert origID != None, "Please specify the original gene ID or set 'convert' to False"
             all_genes  = self.genes1 + self.genes2
-            mg = mygene.MyGeneInfo()
-            out = mg.querymany(all_genes, scopes=self.origID, fields='symbol', species='human', verbose = False)
+            if id_store != None:
+                out = id_store.convert(all_genes, self.origID, "symbol", remote = True)
+                out = [{"query": q, "symbol": s} if isinstance(s, str) else {"query": q} for q, s in zip(out.index, out.values)]
+            elif client != None:
+                out = client.query(all_genes, self.origID, "symbol")
+            else:
+                import mygene
+                mg = mygene.MyGeneInfo()
+                out = mg.querymany(all_genes, scopes=self.origID, fields='symbol', species='human', verbose = False)
             mapping =dict()
             rev_mapping = dict()
             for line in out:
@@ -83,7 +123,18 @@ class results_analysis():
         #Saving the solution
         pd.DataFrame([[gs1,gs2,patients1_str,patients2_str]],columns = ["genes1","genes2","patients1","patients2"]).to_csv(output)
     
-    def show_networks(self, GE, G, output = None):
+    def subnetwork(self, G):
+        '''
+        Returns the subnetwork of the solution genes relabeled to the original IDs (or gene names if convert is True)
+        '''
+        all_genes = self.solution[0][0] + self.solution[0][1]
+        G_small = nx.subgraph(G, all_genes)
+        G_small = nx.relabel_nodes(G_small, self.labels)
+        if self.convert:
+            G_small = nx.relabel_nodes(G_small, self.mapping)
+        return G_small
+    
+    def show_networks(self, GE, G, output = None, show = True, pos = None, dpi = 300):
         '''
         Shows the resulting subnetworks coloured wrt to their difference in expression patterns in patients subgroups
         
@@ -92,6 +143,9 @@ class results_analysis():
         GE - processed gene expression data from data_preprocessing() function
         G - processed PPI network from data_preprocessing() function
         output - str or PathLike or file-like object (png, eps, pdf, etc)    
+        show - if False the figure is only saved and closed (default - True)
+        pos - node positions, by default a spring layout that is computed once per distinct subnetwork
+        dpi - resolution of the saved figure (default 300)
         '''
         # relabel solution IDs to the actual IDs
 
@@ -103,12 +157,10 @@ class results_analysis():
             all_genes_names = genes1_name+genes2_name
         
         #relabel expression matrix and the graph to the actual patients ids and gene names
-        G_small = nx.subgraph(G, all_genes)
-        G_small=nx.relabel_nodes(G_small,self.labels)
+        G_small = self.subnetwork(G)
         GE_small = GE[self.solution[1][0]+self.solution[1][1]].loc[all_genes]
         if self.convert:
             GE_small.index = all_genes_names
-            G_small=nx.relabel_nodes(G_small,self.mapping)
         else:
             GE_small.index = all_genes_entr
             
@@ -120,32 +172,39 @@ class results_analysis():
         else:
             means = list(np.mean(GE_small[self.patients1].loc[all_genes_entr],axis = 1)-np.mean(GE_small[self.patients2].loc[all_genes_entr],axis = 1).values)
 
-        # set plotting settings
-        plt.rc('font', size=20)          # controls default text sizes
-        plt.rc('axes', titlesize=20)     # fontsize of the axes title
-        plt.rc('axes', labelsize=20)    # fontsize of the x and y labels
-        plt.rc('xtick', labelsize=15)    # fontsize of the tick labels
-        plt.rc('ytick', labelsize=25)    # fontsize of the tick labels
-        plt.rc('legend', fontsize=30)
-        fig = plt.figure(figsize=(15,15))
-        vmin = -2
-        vmax = 2
-        cmap = plt.cm.coolwarm(np.linspace(-0.45,0.8,20))
-        cmap = mpl.colors.ListedColormap(cmap[10:,:-1])
-        pos = nx.spring_layout(G_small)
-        nx.draw_networkx_edges(G_small,pos)
-        nc1 = nx.draw_networkx_nodes(G_small, pos = pos,node_color=means, node_size=1700,alpha=.7,
-                                     vmin=vmin, vmax=vmax,cmap =cmap, node_shape = "s")
-        nx.draw_networkx_labels(G_small,pos,font_size = 22,font_weight = "heavy")
-        plt.colorbar(nc1)
-        plt.axis('off')
-        fig.tight_layout()
-        #save if required
-        if output != None:
-            plt.savefig(output,dpi = 300)
-        plt.show()
+        # set plotting settings (only for this figure)
+        import matplotlib as mpl
+        plt = _plotting.pyplot()
+        rc = {'font.size': 20,          # controls default text sizes
+              'axes.titlesize': 20,     # fontsize of the axes title
+              'axes.labelsize': 20,     # fontsize of the x and y labels
+              'xtick.labelsize': 15,    # fontsize of the tick labels
+              'ytick.labelsize': 25,    # fontsize of the tick labels
+              'legend.fontsize': 30}
+        with plt.rc_context(rc):
+            fig = plt.figure(figsize=(15,15))
+            vmin = -2
+            vmax = 2
+            cmap = plt.cm.coolwarm(np.linspace(-0.45,0.8,20))
+            cmap = mpl.colors.ListedColormap(cmap[10:,:-1])
+            if pos == None:
+                pos = layout(G_small)
+            nx.draw_networkx_edges(G_small,pos)
+            nc1 = nx.draw_networkx_nodes(G_small, pos = pos,node_color=means, node_size=1700,alpha=.7,
+                                         vmin=vmin, vmax=vmax,cmap =cmap, node_shape = "s")
+            nx.draw_networkx_labels(G_small,pos,font_size = 22,font_weight = "heavy")
+            plt.colorbar(nc1)
+            plt.axis('off')
+            fig.tight_layout()
+            #save if required
+            if output != None:
+                plt.savefig(output,dpi = dpi)
+            if show:
+                plt.show()
+            else:
+                plt.close(fig)
     
-    def show_clustermap(self, GE, G, true_labels = None, output = None):
+    def show_clustermap(self, GE, G, true_labels = None, output = None, show = True, dpi = 300):
         '''
         Shows a clustermap of the achieved solution alone or also along with the known patients groups
         
@@ -155,6 +214,8 @@ class results_analysis():
         G - processed PPI network from data_preprocessing() function
         output - str or PathLike or file-like object (png, eps, pdf, etc)
         true_labels    
+        show - if False the figure is only saved and closed (default - True)
+        dpi - resolution of the saved figure (default 300)
         '''
         
         if true_labels !=None:
@@ -232,52 +293,58 @@ class results_analysis():
         
         
         
-        plt.rc('font', size=5)          # controls default text sizes
-        plt.rc('axes', titlesize=20)     # fontsize of the axes title
-        plt.rc('axes', labelsize=20)    # fontsize of the x and y labels
-        plt.rc('xtick', labelsize=20)    # fontsize of the tick labels
-        plt.rc('ytick', labelsize=20)    # fontsize of the tick labels
-        plt.rc('legend', fontsize=20)
+        plt = _plotting.pyplot()
+        sns = _plotting.seaborn()
+        rc = {'font.size': 5,           # controls default text sizes
+              'axes.titlesize': 20,     # fontsize of the axes title
+              'axes.labelsize': 20,     # fontsize of the x and y labels
+              'xtick.labelsize': 20,    # fontsize of the tick labels
+              'ytick.labelsize': 20,    # fontsize of the tick labels
+              'legend.fontsize': 20}
         
-        if true_labels != None:
-            g = sns.clustermap(GE_small.T, row_colors=[row_colors1,row_colors2],row_cluster = False,col_cluster = False, col_colors = col_colors,figsize=(15, 10),cbar_kws=dict(ticks=[5, 0, -5]),
-                           cmap = "Spectral",yticklabels=False)
-            g.ax_row_dendrogram.set_visible(False)
-            g.cax.set_visible(False)
+        with plt.rc_context(rc):
+            if true_labels != None:
+                g = sns.clustermap(GE_small.T, row_colors=[row_colors1,row_colors2],row_cluster = False,col_cluster = False, col_colors = col_colors,figsize=(15, 10),cbar_kws=dict(ticks=[5, 0, -5]),
+                               cmap = "Spectral",yticklabels=False)
+                g.ax_row_dendrogram.set_visible(False)
+                g.cax.set_visible(False)
 
         
-            values = ["true class1","true class2", "cluster1", "cluster2"]
-            colors = ['#F3FF33','m','#4FB6D3', '#22863E']
-            for i in range(len(values)):
-                l = values[i]
-                c = colors[i]
-                g.ax_col_dendrogram.bar(0, 0, color=c,
-                                        label=l, linewidth=0)
-            g.ax_col_dendrogram.legend(loc="upper center", ncol=2,bbox_to_anchor=(0.72, 0.87),
-                                        borderaxespad=0.)
-        else:
-            g = sns.clustermap(GE_small.T, row_colors=row_colors1,row_cluster = False,col_cluster = False, col_colors = col_colors,figsize=(15, 10),cbar_kws=dict(ticks=[5, 0, -5]),
-                           cmap = "Spectral",yticklabels=False)
-            g.ax_row_dendrogram.set_visible(False)
-            g.cax.set_visible(False)
+                values = ["true class1","true class2", "cluster1", "cluster2"]
+                colors = ['#F3FF33','m','#4FB6D3', '#22863E']
+                for i in range(len(values)):
+                    l = values[i]
+                    c = colors[i]
+                    g.ax_col_dendrogram.bar(0, 0, color=c,
+                                            label=l, linewidth=0)
+                g.ax_col_dendrogram.legend(loc="upper center", ncol=2,bbox_to_anchor=(0.72, 0.87),
+                                            borderaxespad=0.)
+            else:
+                g = sns.clustermap(GE_small.T, row_colors=row_colors1,row_cluster = False,col_cluster = False, col_colors = col_colors,figsize=(15, 10),cbar_kws=dict(ticks=[5, 0, -5]),
+                               cmap = "Spectral",yticklabels=False)
+                g.ax_row_dendrogram.set_visible(False)
+                g.cax.set_visible(False)
 
         
-            values = ["cluster1", "cluster2"]
-            colors = ['#4FB6D3', '#22863E']
-            for i in range(len(values)):
-                l = values[i]
-                c = colors[i]
-                g.ax_col_dendrogram.bar(0, 0, color=c,
-                                        label=l, linewidth=0)
-            g.ax_col_dendrogram.legend(loc="upper center", ncol=2,bbox_to_anchor=(0.72, 0.87),
-                                        borderaxespad=0.)
+                values = ["cluster1", "cluster2"]
+                colors = ['#4FB6D3', '#22863E']
+                for i in range(len(values)):
+                    l = values[i]
+                    c = colors[i]
+                    g.ax_col_dendrogram.bar(0, 0, color=c,
+                                            label=l, linewidth=0)
+                g.ax_col_dendrogram.legend(loc="upper center", ncol=2,bbox_to_anchor=(0.72, 0.87),
+                                            borderaxespad=0.)
             
-        ax = g.ax_heatmap
-        ax.set_xlabel("Genes")
-        ax.set_ylabel("Patients")
-        if output != None:
-            g.savefig(output,dpi = 300)
-        plt.show()
+            ax = g.ax_heatmap
+            ax.set_xlabel("Genes")
+            ax.set_ylabel("Patients")
+            if output != None:
+                g.savefig(output,dpi = dpi)
+            if show:
+                plt.show()
+            else:
+                plt.close(g.fig)
     
     def jaccard_index(self, true_labels): 
         def jac(x,y):
@@ -300,8 +367,9 @@ class results_analysis():
         ids = jac_matrix([self.patients1, self.patients2],true_labels)
     
         print("Jaccard indices for two groups are {0} and {1}".format(round(ids[0],2),round(ids[1],2)))   
+        return ids
     
-    def enrichment_analysis(self, library, output):
+    def enrichment_analysis(self, library, output, engine = None, client = None):
         '''
         Saves the results of enrichment analysis
         
@@ -314,17 +382,37 @@ class results_analysis():
             for more options check available libraries by typing gseapy.get_library_name()
             
         output - directory name where results should be saved    
+        engine - LocalEnrichment object with the library loaded. If given, the analysis is done
+            offline and the table is saved as <output>/<library>.enrichment.tsv (default - None, use Enrichr)
+        client - AnnotationClient. If given, Enrichr is queried through it and the table is saved as
+            <output>/<library>.enrichr.tsv (default - None, use gseapy)
         '''
-        libs = gseapy.get_library_name()
-        assert library in libs, "the library is not available, check gseapy.get_library_name() for available options"
         assert (self.convert == True) or (self.origID == "symbol"), "EnrichR accepts only gene names as an input, thus please set 'convert' to True and indicate the original gene ID"
-
-        genes1_name = [self.mapping[x] for x in self.genes1]
-        genes2_name = [self.mapping[x] for x in self.genes2]
+        if self.convert:
+            genes1_name = [self.mapping[x] for x in self.genes1]
+            genes2_name = [self.mapping[x] for x in self.genes2]
+        else:
+            genes1_name, genes2_name = self.genes1, self.genes2
         all_genes_names = genes1_name+genes2_name
+        if engine != None:
+            import os
+            assert library in engine.libraries, "the library is not loaded in the enrichment engine"
+            res = engine.enrich({"pathway": all_genes_names}, libraries = [library])
+            os.makedirs(output, exist_ok = True)
+            res.to_csv(os.path.join(output, library + ".enrichment.tsv"), sep = "\t", index = False)
+            return res
+        if client != None:
+            import os
+            res = client.enrich({"pathway": all_genes_names}, library)
+            os.makedirs(output, exist_ok = True)
+            res.to_csv(os.path.join(output, library + ".enrichr.tsv"), sep = "\t", index = False)
+            return res
+        import gseapy
+        libs = gseapy.get_library_name()
+        assert library in libs, "the library is not available, check gseapy.get_library_name() for available options"
         gseapy.enrichr(gene_list=all_genes_names, description='pathway', gene_sets=library, cutoff = 0.05, outdir = output)
     
-    def convergence_plot(self, scores, output = None):
+    def convergence_plot(self, scores, output = None, show = True):
         '''
         Shows the convergence plot
         
@@ -333,24 +421,29 @@ class results_analysis():
         scores - the output of run_search() function
             
         output - directory name where results should be saved    
+        show - if False the figure is only saved and closed (default - True)
         '''                
 
         count_big, scores, avs = scores
-        plt.figure(figsize=(10,6))
-
-        sns.set(style="whitegrid")
-        plt.rc('font', size=13)          # controls default text sizes
-        plt.rc('axes', titlesize=13)     # fontsize of the axes title
-        plt.rc('xtick', labelsize=13)    # fontsize of the tick labels
-        plt.rc('ytick', labelsize=13)    # fontsize of the tick labels
-        plt.rc('legend', fontsize=13)
-        zippedList =  list(zip(scores, avs))
-        wg = pd.DataFrame(zippedList, columns = ["best score","average score"])
-        ax = sns.lineplot(data=wg, palette="tab10", linewidth=2.5)
-        ax.set(xlabel="Iterations")
-        ax.set(ylabel="Score")
+        plt = _plotting.pyplot()
+        sns = _plotting.seaborn()
+        rc = {'font.size': 13,          # controls default text sizes
+              'axes.titlesize': 13,     # fontsize of the axes title
+              'xtick.labelsize': 13,    # fontsize of the tick labels
+              'ytick.labelsize': 13,    # fontsize of the tick labels
+              'legend.fontsize': 13}
+        with sns.axes_style("whitegrid"), plt.rc_context(rc):
+            fig = plt.figure(figsize=(10,6))
+            zippedList =  list(zip(scores, avs))
+            wg = pd.DataFrame(zippedList, columns = ["best score","average score"])
+            ax = sns.lineplot(data=wg, palette="tab10", linewidth=2.5)
+            ax.set(xlabel="Iterations")
+            ax.set(ylabel="Score")
 
-        if output != None:
-            plt.savefig(output)
-        plt.show()        
+            if output != None:
+                plt.savefig(output)
+            if show:
+                plt.show()
+            else:
+                plt.close(fig)        
         
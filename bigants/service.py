@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local BiGAnts service: datasets are preprocessed once and kept in memory together
+with their heuristic information, searches are queued and run in separate processes.
+
+Usage:
+    bigants-serve datasets.json --port 8765 --cores 8
+    bigants-serve datasets.json --socket /tmp/bigants.sock
+
+Datasets (JSON, same keys as the jobs of a bigants-batch manifest):
+    {"datasets": [{"name": "lung", "expr": "data/gse30219_lung.csv",
+                   "net": "data/biogrid.human.entrez.tsv",
+                   "preprocessing": {"log2": false, "size": 2000}}]}
+
+HTTP interface (JSON in, JSON out):
+    GET  /datasets              loaded datasets
+    POST /datasets              load a dataset: {"name", "expr", "net", "preprocessing"}
+    POST /jobs                  queue a job: {"dataset", "kind": "search" | "consensus",
+                                "model": {"L_g_min", "L_g_max"}, "search": {run_search() arguments},
+                                "runs": number of searches for "consensus"}
+    GET  /jobs                  status of all jobs
+    GET  /jobs/<id>             status and, once finished, the result of a job
+
+A finished search returns the solution with internal IDs, the original IDs of its
+genes and patients, the table written by results_analysis.save() and the scores of
+run_search(). load_result() turns it into a results_analysis object.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import TCPServer, ThreadingMixIn
+
+from bigants.labels import decode
+
+KINDS = ["search", "consensus"]
+# run_search() arguments that determine the shared precomputation (see BiGAnts.prepare())
+_prep_args = [("th", 0.5), ("cand_k", None), ("cand_net", False), ("compact", False), ("precision", "short")]
+
+
+def _ids(solution):
+    # solution with plain int IDs
+    return [[[int(x) for x in group] for group in part] for part in solution]
+
+
+def _output(solution, sc, labels, stats):
+    # JSON friendly search result; columns of the table are the ones of results_analysis.save()
+    solution = _ids(solution)
+    nodes = [x for part in solution for group in part for x in group]
+    table = dict()
+    for j in range(len(solution[0])):
+        table["genes{0}".format(j + 1)] = "|".join(decode(labels, solution[0][j]))
+        table["patients{0}".format(j + 1)] = "|".join(decode(labels, solution[1][j]))
+    return {"solution": solution,
+            "labels": dict(zip([str(x) for x in nodes], decode(labels, nodes))),
+            "table": table,
+            "scores": {"iterations": sc[0], "best": [float(x) for x in sc[1]], "average": [float(x) for x in sc[2]]},
+            "run_stats": {k: v for k, v in stats.items() if isinstance(v, (int, float, str))}}
+
+
+def _run_job(model, prep, job, labels, conn):
+    # runs in a separate process, sends ("done", result, log) or ("failed", traceback, log)
+    log = io.StringIO()
+    try:
+        model.L_g_min, model.L_g_max = job["model"]["L_g_min"], job["model"]["L_g_max"]
+        with contextlib.redirect_stdout(log):
+            if job["kind"] == "search":
+                solution, sc = model.run_search(prep = prep, **job["search"])
+                result = _output(solution, sc, labels, model.run_stats)
+            else:
+                import numpy as np
+                from bigants.consensus import ConsensusAnalysis
+                solutions = []
+                for r in range(job.get("runs", 10)):
+                    solution, sc = model.run_search(prep = prep, **job["search"])
+                    solutions.append(solution)
+                n, m = model.GE.shape
+                ca = ConsensusAnalysis(solutions, n, m)
+                summary = ca.summary(labels)
+                off = ~np.eye(len(solutions), dtype = bool)
+                result = {"solutions": [_ids(s) for s in solutions],
+                          "gene_frequency": [[str(g), float(f)] for g, f in zip(summary["gene"], summary["frequency"])],
+                          "consensus_patients": [decode(labels, group) for group in ca.consensus_partition()],
+                          "mean_ari": float(ca.ari()[off].mean()) if ca.S > 1 else 1.0,
+                          "mean_jaccard": float(ca.jaccard()[off].mean()) if ca.S > 1 else 1.0}
+        conn.send(("done", result, log.getvalue()))
+    except Exception:
+        conn.send(("failed", traceback.format_exc(), log.getvalue()))
+    conn.close()
+
+
+def load_result(output):
+    """
+    results_analysis object for the result of a search job
+    """
+    from bigants.results_processing import results_analysis
+    labels = {int(k): v for k, v in output["labels"].items()}
+    return results_analysis(output["solution"], labels)
+
+
+class Service(object):
+    '''
+        Keeps preprocessed datasets, their heuristic information, shared precomputations and initial probabilities in memory
+        and runs queued jobs in separate processes within a budget of cores
+
+        Attributes:
+        -----------
+        cores - number of cores that running jobs can use together, a job needs search["n_proc"] cores (default 1)
+    '''
+    def __init__(self, cores = 1):
+        assert cores > 0, "Set a correct number of cores, right now the value is {0}".format(cores)
+        self.cores = cores
+        self.datasets = dict()
+        self.jobs = dict()
+        self.queue = []
+        self.lock = threading.RLock()
+        self.count = 0
+        self.running = True
+        self.dispatcher = threading.Thread(target = self._dispatch, daemon = True)
+        self.dispatcher.start()
+
+    def load(self, name, expr, net, preprocessing = None):
+        """
+        Preprocesses a dataset, computes its heuristic information and keeps both in memory
+        """
+        from bigants.load_data import data_preprocessing
+        from bigants.ants import BiGAnts
+        st = time.time()
+        GE, G, labels, rev_labels = data_preprocessing(expr, net, **(preprocessing or {}))
+        model = BiGAnts(GE, G, 0, 0)
+        prep = model.prepare()
+        with self.lock:
+            self.datasets[name] = {"model": model, "labels": labels, "rev_labels": rev_labels,
+                                   "preps": {tuple(v for _, v in _prep_args): prep}}
+        print("dataset {0} loaded in {1}s: {2} genes, {3} patients".format(name, round(time.time() - st, 1), *GE.shape))
+        return self.describe(name)
+
+    def describe(self, name):
+        data = self.datasets[name]
+        n, m = data["model"].GE.shape
+        return {"name": name, "genes": n, "patients": m, "prepared": len(data["preps"])}
+
+    def submit(self, job):
+        """
+        Queues a job and returns its ID, see the module documentation for the fields of a job
+        """
+        job = dict(job)
+        job.setdefault("kind", "search")
+        job.setdefault("search", {})
+        assert job["kind"] in KINDS, "kind should be one of {0}".format(KINDS)
+        assert job.get("dataset") in self.datasets, "Unknown dataset {0}".format(job.get("dataset"))
+        assert "L_g_min" in job.get("model", {}) and "L_g_max" in job["model"], "model needs L_g_min and L_g_max"
+        assert "prep" not in job["search"], "prep is managed by the service"
+        cores = job["search"].get("n_proc", 1)
+        assert cores <= self.cores, "The job needs {0} cores, but the service has {1}".format(cores, self.cores)
+        with self.lock:
+            self.count = self.count + 1
+            job_id = str(self.count)
+            self.jobs[job_id] = {"id": job_id, "status": "queued", "job": job, "cores": cores, "submitted": time.time()}
+            self.queue.append(job_id)
+        return job_id
+
+    def status(self, job_id = None):
+        """
+        Status (and result, if finished) of a job, or the status of all jobs
+        """
+        with self.lock:
+            if job_id == None:
+                return [{k: v for k, v in j.items() if k in ["id", "status", "runtime"]} for j in self.jobs.values()]
+            assert job_id in self.jobs, "Unknown job {0}".format(job_id)
+            return {k: v for k, v in self.jobs[job_id].items() if k not in ["process", "conn", "started"]}
+
+    def _prep(self, data, search):
+        # shared precomputation of a dataset for the settings of a job and the initial probabilities of its a, b,
+        # computed once here so that every job process starts with them. Output of the jobs is only captured
+        # in the job processes, since redirecting stdout here would also swallow the output of other threads
+        key = tuple(search.get(k, v) for k, v in _prep_args)
+        if key not in data["preps"]:
+            data["preps"][key] = data["model"].prepare(*key)
+        prep = data["preps"][key]
+        a, b = search.get("a", 1), search.get("b", 1)
+        if "warm" not in search and (a, b) not in prep["probs"]:
+            t0 = prep["precision"].pheromone(prep["n"] + prep["m"], 5)
+            prep["probs"][(a, b)] = data["model"].prob_upd(prep["H"], t0, a, b, prep["n"], prep["th"], prep["N"], prep["rows"], prep["precision"])
+        return prep
+
+    def _dispatch(self):
+        # starts queued jobs in order as long as their cores fit and collects finished ones
+        while self.running:
+            while True:
+                with self.lock:
+                    running = [j for j in self.jobs.values() if j["status"] == "running"]
+                    free = self.cores - sum(j["cores"] for j in running)
+                    if len(self.queue) == 0 or self.jobs[self.queue[0]]["cores"] > free:
+                        break
+                    entry = self.jobs[self.queue.pop(0)]
+                    entry["status"] = "preparing"
+                job = entry["job"]
+                data = self.datasets[job["dataset"]]
+                # a new precomputation can take a while, status requests are answered in the meantime
+                try:
+                    prep = self._prep(data, job["search"])
+                except Exception:
+                    with self.lock:
+                        entry.update({"status": "failed", "error": traceback.format_exc()})
+                    continue
+                recv, send = mp.Pipe(duplex = False)
+                p = mp.Process(target = _run_job, args = (data["model"], prep, job, data["labels"], send))
+                p.start()
+                send.close()
+                with self.lock:
+                    entry.update({"status": "running", "process": p, "conn": recv, "started": time.time()})
+            with self.lock:
+                for entry in running:
+                    if entry["conn"].poll():
+                        try:
+                            state, value, log = entry["conn"].recv()
+                        except EOFError:
+                            state, value, log = "failed", "the job process stopped unexpectedly", ""
+                    elif not entry["process"].is_alive():
+                        state, value, log = "failed", "the job process stopped with code {0}".format(entry["process"].exitcode), ""
+                    else:
+                        continue
+                    entry["process"].join()
+                    entry.update({"status": state, "log": log, "runtime": round(time.time() - entry["started"], 2)})
+                    entry["result" if state == "done" else "error"] = value
+                    del entry["process"], entry["conn"]
+            time.sleep(0.05)
+
+    def close(self):
+        self.running = False
+        self.dispatcher.join()
+        for entry in self.jobs.values():
+            if "process" in entry:
+                entry["process"].terminate()
+
+
+def make_handler(service):
+    """
+    HTTP request handler class for a Service
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length).decode() or "{}")
+
+        def _handle(self, method):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            try:
+                if parts == ["datasets"] and method == "GET":
+                    return self._send(200, [service.describe(name) for name in service.datasets])
+                if parts == ["datasets"] and method == "POST":
+                    body = self._body()
+                    return self._send(200, service.load(body["name"], body["expr"], body["net"], body.get("preprocessing")))
+                if parts == ["jobs"] and method == "GET":
+                    return self._send(200, service.status())
+                if parts == ["jobs"] and method == "POST":
+                    return self._send(202, {"id": service.submit(self._body())})
+                if len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+                    return self._send(200, service.status(parts[1]))
+                self._send(404, {"error": "unknown request {0} {1}".format(method, self.path)})
+            except (AssertionError, KeyError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+            except Exception:
+                self._send(500, {"error": traceback.format_exc()})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            # the client address is empty for unix sockets
+            print("{0} {1}".format(self.log_date_time_string(), format % args))
+
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # HTTPServer.server_bind() expects a (host, port) address
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serve(service, port = 8765, host = "127.0.0.1", path = None):
+    """
+    Serves the HTTP interface of a service on a local port or, if path is given, on a unix socket
+    """
+    handler = make_handler(service)
+    if path != None:
+        server = UnixHTTPServer(path, handler)
+        print("serving on unix socket {0}".format(path))
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print("serving on http://{0}:{1}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if path != None and os.path.exists(path):
+            os.remove(path)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "bigants-serve", description = "Keeps datasets in memory and runs BiGAnts searches on request")
+    parser.add_argument("datasets", nargs = "?", default = None, help = "JSON file with datasets to load at start")
+    parser.add_argument("-p", "--port", type = int, default = 8765, help = "local port (default: 8765)")
+    parser.add_argument("--host", default = "127.0.0.1", help = "address to listen on (default: 127.0.0.1)")
+    parser.add_argument("-s", "--socket", default = None, help = "serve on this unix socket instead of a port")
+    parser.add_argument("-c", "--cores", type = int, default = max(1, mp.cpu_count() - 1), help = "total number of cores for running jobs (default: all but one)")
+    args = parser.parse_args(argv)
+    service = Service(args.cores)
+    if args.datasets != None:
+        with open(args.datasets, "r") as fh:
+            config = json.load(fh)
+        base = os.path.dirname(os.path.abspath(args.datasets))
+        for d in config.get("datasets", []):
+            service.load(d["name"], os.path.join(base, d["expr"]), os.path.join(base, d["net"]), d.get("preprocessing"))
+    serve(service, args.port, args.host, args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
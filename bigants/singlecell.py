@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# BiGAnts for single-cell data with many more cells than genes. The ants walk on a graph of the genes and
+# a fixed number of cell representatives, so the heuristic information, the pheromones and the probability
+# tables do not grow with the number of cells. Cells are assigned to the groups only for the final solution.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy import stats
+
+from bigants.ants import BiGAnts, indicator, flatten
+
+SAMPLES = ["metacells", "cells"]
+
+
+class SingleCellBiGAnts(BiGAnts):
+    '''
+        Bi-graph Ant Colony Optimisation for single-cell data
+
+        The walkers start from representatives of the cells: metacells (k-means clusters of the cells,
+        their mean expression) or a random sample of cells. Representative-representative heuristic
+        information comes from a sparse k-nearest-neighbour graph instead of a correlation matrix.
+        Peak memory depends on the number of genes and representatives, the cells are only kept in the
+        sparse expression matrix.
+
+        Attributes:
+        -----------
+        X - genes x cells expression matrix, scipy.sparse or numpy array (see singlecell_preprocessing())
+        G - networkx graph with a network
+        L_g_min - minimal number of genes in one subnetwork
+        L_g_max - maximal number of genes in one subnetwork
+        representatives - number of metacells or sampled cells (default 500)
+        knn - number of neighbours of each representative in the kNN graph (default 15)
+        sample - "metacells" or "cells" (default "metacells")
+        seed - random seed of the k-means clustering or the sample (default - None)
+    '''
+    wide = True
+
+    def __init__(self, X, G, L_g_min, L_g_max, representatives = 500, knn = 15, sample = "metacells", seed = None):
+        assert sample in SAMPLES, "sample should be one of {0}, the value was: {1}".format(SAMPLES, sample)
+        assert knn > 0, "knn should be positive, the value was: {0}".format(knn)
+        X = sparse.csr_matrix(X, dtype = np.float32)
+        n, cells = X.shape
+        representatives = min(representatives, cells)
+        assert representatives > knn, "There should be more representatives than knn"
+        if sample == "metacells":
+            from sklearn.cluster import MiniBatchKMeans
+            kmeans = MiniBatchKMeans(n_clusters = representatives, random_state = seed, n_init = 3).fit(X.T.tocsr())
+            members = [np.where(kmeans.labels_ == r)[0] for r in range(representatives)]
+            members = [x for x in members if len(x) > 0]
+        else:
+            rng = np.random.RandomState(seed)
+            members = [np.array([c]) for c in np.sort(rng.choice(cells, representatives, replace = False))]
+        r = len(members)
+        # mean expression of each representative, z-scores per representative as for bulk data
+        profiles = (X @ indicator(members, cells).T).toarray()
+        profiles = np.nan_to_num(stats.zscore(profiles))
+        GE = pd.DataFrame(profiles, index = np.arange(n), columns = np.arange(n, n+r))
+        BiGAnts.__init__(self, GE, G, L_g_min, L_g_max)
+        self.X = X
+        # cells of each representative
+        self.members = members
+        self.knn = knn
+
+    def run_search(self, **kwargs):
+        """
+        run_search() on the representatives, all arguments are the same as for BiGAnts.run_search().
+        The patient groups of the returned solution are cells (internal IDs n...n+cells-1): every cell
+        is assigned to the closest group centroid on the genes of the solution (see assign_cells())
+        """
+        solution, sc = BiGAnts.run_search(self, **kwargs)
+        return [solution[0], self.assign_cells(solution[0], solution[1])], sc
+
+    def assign_cells(self, gene_groups, rep_groups):
+        """
+        Assigns all cells to the groups of representatives: the centroid of a group is the mean of its cells
+        on the genes of the solution (scaled per gene), each cell goes to the closest centroid
+        """
+        n, cells = self.X.shape
+        data = self.X[flatten(gene_groups),:].toarray()
+        data = np.nan_to_num(stats.zscore(data, axis = 1))
+        dist = np.full((cells, len(rep_groups)), np.inf)
+        for j, group in enumerate(rep_groups):
+            if len(group) > 0:
+                members = np.concatenate([self.members[p-n] for p in group])
+                centroid = data[:,members].mean(axis = 1)
+                dist[:,j] = centroid @ centroid - 2 * (centroid @ data)
+        labels = np.argmin(dist, axis = 1)
+        return [list(np.where(labels == j)[0] + n) for j in range(len(rep_groups))]
+
+    def knn_graph(self, ge):
+        # symmetric sparse kNN graph of the representatives, similarity 10*(1 - correlation distance/2)
+        from sklearn.neighbors import NearestNeighbors
+        nn = NearestNeighbors(n_neighbors = self.knn, metric = "correlation").fit(ge.T)
+        S = nn.kneighbors_graph(mode = "distance")
+        S.data = np.clip(1 - S.data/2, 0, 1)*10
+        return S.maximum(S.T).tocsr()
+
+    def HI_big(self, data_aco, A_new, precision = None):
+        # gene-gene and gene-representative blocks as for bulk data, the representative block from the kNN graph.
+        # The dense representative-representative correlation matrix of BiGAnts.HI_big() is never computed
+        from sklearn import preprocessing
+        scaler = preprocessing.MinMaxScaler(feature_range=(0, 1))#
+        store = (lambda block: block) if precision == None else precision.heuristic
+        n,r = data_aco.shape
+        H_full = np.empty((n+r, n+r), dtype = np.float64 if precision == None else precision.H_dtype)
+        H_g_to_g = scaler.fit_transform(data_aco.T.corr())*10
+        np.fill_diagonal(H_g_to_g, 0)
+        H_full[:n,:n] = store(np.multiply(H_g_to_g, A_new))
+        del H_g_to_g
+        H_full[:n,n:] = store(scaler.fit_transform(data_aco)*10)
+        H_full[n:,:n] = H_full[:n,n:].T
+        H_full[n:,n:] = store(self.knn_graph(data_aco.values).toarray())
+        return(H_full)
+
+    def add_patients(self, GE_new):
+        raise NotImplementedError("Cells can not be added to a single-cell model: the representatives (k-means metacells "
+                                  "or the cell sample), their z-scores and the kNN graph are computed from all cells. "
+                                  "Create a new SingleCellBiGAnts model with all cells instead")
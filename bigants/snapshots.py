@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pheromone snapshots of run_search(record = ...) and the offline tool to look at them.
+
+A snapshot file starts with MAGIC followed by records: a 4 byte little endian length
+and a compressed .npz archive with the iteration, the scores, statistics of the
+pheromone matrix, a downsampled matrix or its top-k entries and statistics of the
+probability tables. Records are only appended, so a file can be read while the
+search is still running.
+
+Usage:
+    bigants-snapshots run.snap summary [--csv summary.csv]
+    bigants-snapshots run.snap plot --output frames/
+"""
+
+import argparse
+import io
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"BIGANTS-SNAPSHOTS\x01"
+MODES = ["downsample", "topk"]
+# entries of the pheromone matrix processed at once (top-k search and moments)
+CHUNK = 2**22
+
+
+def downsample(t, size):
+    # block means of t on a (at most) size x size grid, without a float copy of t
+    dim = t.shape[0]
+    edges = np.unique(np.linspace(0, dim, min(size, dim) + 1).astype(int))
+    starts, lens = edges[:-1], np.diff(edges)
+    grid = np.add.reduceat(np.add.reduceat(t, starts, axis = 0, dtype = np.float64), starts, axis = 1)
+    return (grid / np.outer(lens, lens)).astype(np.float32), edges
+
+
+def topk(t, k):
+    # row, column and value of the k largest entries of t, searched in chunks of rows
+    rows, cols, values = np.empty(0, dtype = np.int64), np.empty(0, dtype = np.int64), np.empty(0)
+    step = max(1, CHUNK // t.shape[1])
+    for st in range(0, t.shape[0], step):
+        block = t[st:st + step].ravel()
+        idx = np.argpartition(block, -k)[-k:] if block.size > k else np.arange(block.size)
+        values = np.concatenate([values, block[idx]])
+        rows = np.concatenate([rows, st + idx // t.shape[1]])
+        cols = np.concatenate([cols, idx % t.shape[1]])
+        if len(values) > k:
+            keep = np.argpartition(values, -k)[-k:]
+            values, rows, cols = values[keep], rows[keep], cols[keep]
+    order = np.argsort(-values, kind = "stable")
+    return rows[order].astype(np.int32), cols[order].astype(np.int32), values[order].astype(np.float32)
+
+
+def moments(t):
+    # mean and standard deviation of t, summed in chunks of rows to avoid full size temporaries
+    total, squares = 0.0, 0.0
+    step = max(1, CHUNK // t.shape[1])
+    for st in range(0, t.shape[0], step):
+        block = t[st:st + step].astype(np.float64)
+        total = total + block.sum()
+        squares = squares + (block * block).sum()
+    mean = total / t.size
+    return mean, np.sqrt(max(squares / t.size - mean**2, 0))
+
+
+def table_stats(probs):
+    # mean row entropy and mean maximal probability of the probability table of every patient
+    entropy = np.zeros(len(probs), dtype = np.float32)
+    p_max = np.zeros(len(probs), dtype = np.float32)
+    for w, P in enumerate(probs):
+        P = np.asarray(P, dtype = np.float64)
+        total = P.sum(axis = 1, keepdims = True)
+        P = P[total[:, 0] > 0] / total[total[:, 0] > 0]
+        if len(P) > 0:
+            logs = np.log(P, out = np.zeros_like(P), where = P > 0)
+            entropy[w] = -np.mean((P * logs).sum(axis = 1))
+            p_max[w] = np.mean(P.max(axis = 1))
+    return entropy, p_max
+
+
+class SnapshotRecorder(object):
+    '''
+        Writes snapshots of the pheromone matrix and of the probability tables to an append-only file
+        every N iterations of run_search(). Only the reduced snapshot is kept, so the cost is one pass
+        over the matrices per snapshot. Read the file with read_snapshots(), summary() and plot()
+        or the bigants-snapshots command
+
+        Attributes:
+        -----------
+        path - snapshot file, records are appended if it exists
+        every - record every N iterations, the final state is always recorded (default 10)
+        mode - "downsample" - block means of the pheromone matrix on a size x size grid,
+            "topk" - the k largest pheromone entries (default "downsample")
+        size - grid size for "downsample" (default 256)
+        k - number of entries for "topk" (default 10000)
+        probs - record the entropy and the maximal probability of the probability tables of every patient (default True)
+    '''
+    def __init__(self, path, every = 10, mode = "downsample", size = 256, k = 10000, probs = True):
+        assert mode in MODES, "mode should be one of {0}, the value was: {1}".format(MODES, mode)
+        assert every > 0, "every should be positive, the value was: {0}".format(every)
+        self.path = path
+        self.every = every
+        self.mode = mode
+        self.size = size
+        self.k = k
+        self.probs = probs
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as fh:
+                fh.write(MAGIC)
+        # seconds spent on writing snapshots
+        self.overhead = 0
+
+    def record(self, iteration, t, probs = None, best = None, average = None, n = None, scale = 1, force = False):
+        """
+        Appends a snapshot if iteration is a multiple of every (or force is set)
+
+        Attributes:
+        -----------
+        iteration - number of finished iterations
+        t - pheromone matrix
+        probs - probability tables of the patients (default - None, not recorded)
+        best, average - best and average ant score of the iteration
+        n - number of genes (rows and columns 0...n-1 of t)
+        scale - fixed point scale of t (precision policy t_scale, default 1)
+        """
+        if not force and iteration % self.every != 0:
+            return False
+        st = time.time()
+        mean, std = moments(t)
+        record = {"iteration": iteration, "time": time.time(), "dim": t.shape[0], "n": -1 if n == None else n,
+                  "best": np.nan if best == None else best, "average": np.nan if average == None else average,
+                  "t_min": t.min() / scale, "t_max": t.max() / scale, "t_mean": mean / scale,
+                  "t_std": std / scale, "mode": self.mode}
+        if self.mode == "downsample":
+            record["grid"], record["edges"] = downsample(t, self.size)
+            record["grid"] /= scale
+        else:
+            record["rows"], record["cols"], record["values"] = topk(t, self.k)
+            record["values"] /= scale
+        if self.probs and probs != None:
+            record["entropy"], record["p_max"] = table_stats(probs)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **record)
+        data = buffer.getvalue()
+        with open(self.path, "ab") as fh:
+            fh.write(struct.pack("<I", len(data)))
+            fh.write(data)
+        self.overhead = self.overhead + time.time() - st
+        return True
+
+
+def read_snapshots(path):
+    """
+    Yields the snapshots of a file as dictionaries (a record that is still being written is skipped)
+    """
+    with open(path, "rb") as fh:
+        assert fh.read(len(MAGIC)) == MAGIC, "{0} is not a snapshot file".format(path)
+        while True:
+            head = fh.read(4)
+            if len(head) < 4:
+                return
+            size = struct.unpack("<I", head)[0]
+            data = fh.read(size)
+            if len(data) < size:
+                return
+            with np.load(io.BytesIO(data)) as arrays:
+                yield {key: arrays[key][()] if arrays[key].ndim == 0 else arrays[key] for key in arrays.files}
+
+
+def summary(path):
+    """
+    Pandas data frame with the scalar statistics of every snapshot (and the mean entropy and maximal probability of the tables)
+    """
+    rows = []
+    for snap in read_snapshots(path):
+        row = {key: value for key, value in snap.items() if np.ndim(value) == 0 and key != "mode"}
+        if "entropy" in snap:
+            row["entropy"] = float(np.mean(snap["entropy"]))
+            row["p_max"] = float(np.mean(snap["p_max"]))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def plot(path, output, show = False, dpi = 100):
+    """
+    Saves one heatmap (downsampled snapshots) or scatter plot (top-k snapshots) of the pheromones per snapshot
+    as <output>/pher_<iteration>.png and the statistics over the iterations as <output>/trajectory.png
+    """
+    from bigants import _plotting
+    plt = _plotting.pyplot()
+    os.makedirs(output, exist_ok = True)
+    for snap in read_snapshots(path):
+        fig = plt.figure(figsize = (10, 8))
+        ax = fig.add_subplot(111)
+        if snap["mode"] == "downsample":
+            extent = (0, snap["dim"], snap["dim"], 0)
+            cax = ax.imshow(snap["grid"], interpolation = "nearest", cmap = plt.cm.RdPu, extent = extent)
+        else:
+            cax = ax.scatter(snap["cols"], snap["rows"], c = snap["values"], s = 2, cmap = plt.cm.RdPu)
+            ax.set_xlim(0, snap["dim"])
+            ax.set_ylim(snap["dim"], 0)
+        if snap["n"] >= 0:
+            #genes | patients
+            ax.axhline(snap["n"], c = "k", lw = 0.5)
+            ax.axvline(snap["n"], c = "k", lw = 0.5)
+        plt.colorbar(cax)
+        plt.title("Pheromones after iteration {0}".format(snap["iteration"]))
+        fig.savefig(os.path.join(output, "pher_{0:05d}.png".format(int(snap["iteration"]))), dpi = dpi)
+        if show:
+            plt.show(block = False)
+        plt.close(fig)
+    table = summary(path)
+    columns = [c for c in ["best", "average", "t_max", "t_mean", "entropy", "p_max"] if c in table.columns]
+    fig, axes = plt.subplots(len(columns), 1, figsize = (10, 2.5*len(columns)), sharex = True, squeeze = False)
+    for ax, c in zip(axes[:, 0], columns):
+        ax.plot(table["iteration"], table[c], "o-")
+        ax.set_ylabel(c)
+    axes[-1, 0].set_xlabel("iteration")
+    fig.savefig(os.path.join(output, "trajectory.png"), dpi = dpi)
+    if show:
+        plt.show(block = False)
+    plt.close(fig)
+    return table
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "bigants-snapshots", description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help = "snapshot file written by run_search(record = ...)")
+    parser.add_argument("command", choices = ["summary", "plot"])
+    parser.add_argument("--csv", default = None, help = "save the summary table")
+    parser.add_argument("-o", "--output", default = "snapshots", help = "directory for the plots (default: snapshots)")
+    args = parser.parse_args(argv)
+    if args.command == "plot":
+        table = plot(args.path, args.output)
+        print("{0} snapshots were plotted to {1}".format(len(table), args.output))
+    else:
+        table = summary(args.path)
+        pd.set_option("display.width", 200)
+        print(table.round(4).to_string(index = False))
+    if args.csv != None:
+        table.to_csv(args.csv, index = False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
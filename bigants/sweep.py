@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import itertools
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pandas as pd
+
+# model attributes that can be swept together with the run_search() parameters
+_model_params = ["L_g_min", "L_g_max"]
+
+# state shared with the sweep workers, set once per worker by _init_worker()
+_shared = {}
+
+
+def expand_grid(grid):
+    """
+    Turns a grid into a list of configurations
+
+    Attributes:
+    -----------
+    grid - either a dictionary parameter -> list of values (all combinations are used)
+    or a list of dictionaries (used as they are)
+    """
+    if isinstance(grid, dict):
+        keys = list(grid)
+        values = [v if isinstance(v, (list, tuple, np.ndarray)) else [v] for v in grid.values()]
+        return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    return [dict(c) for c in grid]
+
+
+def _init_worker(model, preps, verbose):
+    _shared["model"] = model
+    _shared["preps"] = preps
+    _shared["verbose"] = verbose
+
+
+def _run_config(args):
+    i, config, seed = args
+    model = _shared["model"]
+    params = dict(config)
+    for key in _model_params:
+        if key in params:
+            setattr(model, key, params.pop(key))
+    key = (params.get("th", 0.5), params.get("cand_k", None), params.get("cand_net", False), params.get("compact", False), params.get("precision", "short"))
+    if seed != None:
+        np.random.seed(seed + i)
+    st = time.time()
+    if _shared["verbose"]:
+        solution, sc = model.run_search(prep = _shared["preps"][key], **params)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            solution, sc = model.run_search(prep = _shared["preps"][key], **params)
+    runtime = time.time() - st
+    return i, solution, sc, runtime, model.run_stats.get("ants")
+
+
+def parameter_sweep(model, grid, n_workers = 1, seed = None, verbose = False, return_solutions = False, **fixed):
+    """
+    Runs the search for every configuration of a parameter grid. Heuristic information,
+    search areas and initial probabilities are computed once (per th, candidate list, table and precision setting and (a, b)) and shared
+    by all configurations, which are distributed over a pool of processes.
+
+    Attributes:
+    -----------
+    model - BiGAnts object
+    grid - dictionary parameter -> list of values or a list of configurations (dictionaries).
+    Any run_search() parameter can be used as well as L_g_min and L_g_max, e.g.
+        {"K": [20, 40], "evaporation": [0.3, 0.5], "L_g_min": [10], "L_g_max": [15, 20]}
+    n_workers - number of processes that run configurations in parallel (default 1).
+    Every configuration then runs with n_proc = 1
+    seed - if given, configuration i uses the numpy random seed seed + i (default - None)
+    verbose - print the output of run_search() (default - False)
+    return_solutions - if True solutions are returned as well (default - False)
+    fixed - run_search() parameters used for all configurations
+
+    Returns a pandas data frame with one row per configuration: its parameters, the best
+    score, the number of iterations until convergence, the run time in seconds and the number of evaluated ants
+    (and a list of solutions in the same order if return_solutions is True)
+    """
+    configs = []
+    for config in expand_grid(grid):
+        full = dict(fixed)
+        full.update(config)
+        configs.append(full)
+    assert len(configs) > 0, "The parameter grid is empty"
+    assert n_workers > 0, "Set a correct number for n_workers, right now the value is {0}".format(n_workers)
+    if n_workers > 1:
+        # pool workers can not start processes of their own
+        assert all(c.get("n_proc", 1) == 1 for c in configs), "n_proc has to be 1 when n_workers > 1"
+
+    # everything that depends only on the data or on th is computed here once
+    st = time.time()
+    preps = dict()
+    for config in configs:
+        th = config.get("th", 0.5)
+        key = (th, config.get("cand_k", None), config.get("cand_net", False), config.get("compact", False), config.get("precision", "short"))
+        if key not in preps:
+            preps[key] = model.prepare(*key)
+        a, b = config.get("a", 1), config.get("b", 1)
+        prep = preps[key]
+        if (a, b) not in prep["probs"]:
+            t0 = prep["precision"].pheromone(prep["n"] + prep["m"], 5)
+            prep["probs"][(a, b)] = model.prob_upd(prep["H"], t0, a, b, prep["n"], th, prep["N"], prep["rows"], prep["precision"])
+    print("shared precomputation for {0} configurations took {1}s".format(len(configs), round(time.time() - st, 2)))
+
+    L_g = (model.L_g_min, model.L_g_max)
+    tasks = [(i, c, seed) for i, c in enumerate(configs)]
+    results = [None] * len(configs)
+    if n_workers == 1:
+        _init_worker(model, preps, verbose)
+        for task in tasks:
+            i, solution, sc, runtime, ants = _run_config(task)
+            results[i] = (solution, sc, runtime, ants)
+        model.L_g_min, model.L_g_max = L_g
+    else:
+        with mp.Pool(n_workers, initializer = _init_worker, initargs = (model, preps, verbose)) as pool:
+            for i, solution, sc, runtime, ants in pool.imap_unordered(_run_config, tasks):
+                results[i] = (solution, sc, runtime, ants)
+                print("configuration {0} of {1} finished".format(i + 1, len(configs)))
+
+    rows = []
+    for config, (solution, sc, runtime, ants) in zip(configs, results):
+        row = dict(config)
+        count_big, scores, avs = sc
+        row["best_score"] = np.max(scores) if len(scores) > 0 else np.nan
+        row["iterations"] = count_big
+        row["runtime"] = runtime
+        row["ants"] = ants
+        for j in range(len(solution[0])):
+            row["genes{0}".format(j + 1)] = len(solution[0][j])
+            row["patients{0}".format(j + 1)] = len(solution[1][j])
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    if return_solutions:
+        return table, [r[0] for r in results]
+    return table
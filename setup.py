@@ -18,7 +18,7 @@ setuptools.setup(
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         'pandas',
         'numpy',
@@ -30,6 +30,16 @@ setuptools.setup(
 	'mygene',
 	'scikit_learn'
 ],
+    extras_require={
+        'numba': ['numba'],
+    },
+    entry_points={
+        'console_scripts': [
+            'bigants-batch=bigants.batch:main',
+            'bigants-serve=bigants.service:main',
+            'bigants-snapshots=bigants.snapshots:main',
+        ],
+    },
 	
 
 )
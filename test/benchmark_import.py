@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Import time regression benchmark.
+
+Measures the wall-clock time of "import bigants" and of loading the search API
+in a fresh interpreter and checks that plotting, annotation and JIT libraries are
+not pulled in by them. Exits with a non-zero status if a heavy module is
+imported or if the median import time exceeds --limit seconds.
+
+    python benchmark_import.py --repeat 10 --limit 1.5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ["matplotlib", "seaborn", "gseapy", "mygene", "sklearn", "numba"]
+
+STATEMENTS = {
+    "import bigants": "import bigants",
+    "search API": "from bigants import BiGAnts, data_preprocessing",
+}
+
+
+def timed_import(statement):
+    code = "{0}\nimport sys\nprint(','.join(m for m in {1!r} if m in sys.modules))".format(statement, HEAVY)
+    st = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    end = time.perf_counter()
+    loaded = [m for m in out.stdout.strip().split(",") if m]
+    return end - st, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=float, default=None, help="maximal allowed median time in seconds")
+    args = parser.parse_args()
+
+    # interpreter start-up without bigants is the baseline
+    baseline = statistics.median(timed_import("pass")[0] for _ in range(args.repeat))
+    print("interpreter start-up: {0:.3f}s".format(baseline))
+    failed = False
+    for name, statement in STATEMENTS.items():
+        times = []
+        for _ in range(args.repeat):
+            t, loaded = timed_import(statement)
+            times.append(t)
+        med = statistics.median(times)
+        print("{0}: {1:.3f}s (median of {2}, {3:.3f}s above start-up)".format(name, med, args.repeat, med - baseline))
+        if loaded:
+            print("    heavy modules imported: {0}".format(", ".join(loaded)))
+            failed = True
+        if args.limit is not None and med > args.limit:
+            print("    slower than the limit of {0}s".format(args.limit))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
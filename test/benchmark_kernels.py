@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the compiled walk and deposit kernels (bigants.kernels, needs numba)
+give the same results as the NumPy implementation and compares their speed
+on random data.
+
+    python benchmark_kernels.py --genes 2000 --patients 200 --ants 5
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bigants import BiGAnts
+from bigants import kernels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--genes", type=int, default=1000)
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--ants", type=int, default=5)
+    parser.add_argument("--th", type=float, default=0.5)
+    parser.add_argument("--cost_limit", type=float, default=5)
+    args = parser.parse_args()
+    if not kernels.available():
+        print("numba is not installed, nothing to compare")
+        sys.exit(0)
+
+    n, m = args.genes, args.patients
+    rng = np.random.RandomState(0)
+    H = rng.rand(n + m, n + m) * 10
+    np.fill_diagonal(H, 0)
+    H = H.astype(np.short)
+    model = BiGAnts(None, None, 10, 15)
+    N = model.neigborhood(H, n, args.th)
+    cost = H / 10
+    cost = np.max(cost) - cost
+    t0 = (np.ones((n + m, n + m)) * 5).astype(np.short)
+    probs = model.prob_upd(H, t0, 1, 1, n, args.th, N)
+    patients = np.arange(n, n + m)
+    flat = kernels.flatten_probs(probs, N)
+    # compile once before timing
+    kernels.walks(flat, patients[:1], cost, args.cost_limit, n, 0)
+
+    mismatches = 0
+    t_np, t_jit = 0, 0
+    for seed in range(args.ants):
+        st = time.time()
+        np.random.seed(seed)
+        ref = [model.walk(patients[w], N[w], probs[w], cost, args.cost_limit, n) for w in range(m)]
+        t_np += time.time() - st
+        st = time.time()
+        res = kernels.walks(flat, patients, cost, args.cost_limit, n, seed)
+        t_jit += time.time() - st
+        mismatches += sum(not np.array_equal(x, y) for x, y in zip(ref, res))
+    print("walks: {0} of {1} paths differ".format(mismatches, args.ants * m))
+    print("NumPy: {0:.4f}s per ant, numba: {1:.4f}s per ant ({2:.1f}x)".format(t_np / args.ants, t_jit / args.ants, t_np / max(t_jit, 1e-9)))
+
+    # gene groups of a solution are disjoint
+    perm = rng.permutation(n)
+    genes = [list(perm[:12]), list(perm[12:24])]
+    pats = [list(patients[:m // 2]), list(patients[m // 2:])]
+    solution = (genes, pats)
+    scores = [0.8, 0.6]
+    st = time.time()
+    ref = model.pher_upd(t0, 0, 0.5, scores, solution, "numpy")
+    t_np = time.time() - st
+    model.pher_upd(t0, 0, 0.5, scores, solution, "numba")
+    st = time.time()
+    res = model.pher_upd(t0, 0, 0.5, scores, solution, "numba")
+    t_jit = time.time() - st
+    print("deposit: max difference {0}, NumPy {1:.4f}s, numba {2:.4f}s".format(np.abs(ref - res).max(), t_np, t_jit))
+    sys.exit(1 if mismatches > 0 or not np.allclose(ref, res) else 0)
+
+
+if __name__ == "__main__":
+    main()
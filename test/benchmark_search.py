@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Search quality benchmark: runs run_search() with the configurations of a suite
+on a dataset and reports the best score, the number of iterations, the run
+time and the number of evaluated ants (mean and standard deviation over
+--repeat seeded runs per configuration).
+
+    python benchmark_search.py candidates --repeat 5 --max_iter 30
+
+The "stopping" suite also prints the iterations saved by each stopping rule
+compared with the eps / times rule (max_iter should be high, e.g. 200).
+
+The "incremental" suite holds out the last --new patients, runs the search on the
+others, adds the held out patients with add_patients() and compares the warm
+started search with a cold search on all patients.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from bigants import data_preprocessing
+from bigants import BiGAnts
+from bigants import parameter_sweep
+
+# each suite is a list of run_search() settings that are compared with each other
+SUITES = {
+    # threshold search areas vs. top-k candidate lists
+    "candidates": [{}, {"cand_k": 50}, {"cand_k": 100}, {"cand_k": 200}, {"cand_k": 100, "cand_net": True}],
+    # storage precision of heuristic information, pheromones and probabilities
+    "precision": [{"precision": "short"}, {"precision": "float32"}, {"precision": "int16"},
+                  {"precision": "float32", "compact": True}, {"precision": "int16", "compact": True},
+                  # all max_iter iterations (no eps / times stop), fixed point pheromones reach their floor after about 20
+                  {"precision": "float32", "eps": -1, "times": 1000}, {"precision": "int16", "eps": -1, "times": 1000},
+                  {"precision": "int16", "compact": True, "eps": -1, "times": 1000}],
+    # compact tables and candidate lists on the pure NumPy walks (also the fallback without numba)
+    "numpy": [{"backend": "numpy"}, {"backend": "numpy", "compact": True}, {"backend": "numpy", "cand_k": 20},
+              {"backend": "numpy", "compact": True, "precision": "int16"}],
+    # lockstep vs. asynchronous parallel search (run with --workers 1, the searches start their own processes)
+    "asynchronous": [{"n_proc": 4}, {"n_proc": 4, "asynchronous": True}, {"n_proc": 4, "asynchronous": True, "staleness": 0},
+                     {"n_proc": 4, "asynchronous": True, "precision": "int16"}],
+    # fixed number of ants vs. adaptive number of ants per iteration (compare the ants column)
+    "adaptive": [{"K": 20}, {"K": 20, "K_min": 5, "K_max": 40}, {"K": 20, "K_min": 10, "K_max": 20}],
+    # eps / times stopping rule vs. convergence monitors (reports the iterations saved against the first setting)
+    "stopping": [{}, {"monitor": "stagnation"}],
+    # cold search on all patients vs. warm start after adding patients (see incremental())
+    "incremental": [],
+}
+
+
+def _search(model, **params):
+    st = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        solution, sc = model.run_search(**params)
+    return {"best_score": max(sc[1]), "iterations": sc[0], "runtime": time.time() - st, "ants": model.run_stats.get("ants")}
+
+
+def incremental(GE, G, args):
+    n, m = GE.shape
+    m_old = m - args.new
+    assert m_old > 0, "--new should be lower than the number of patients"
+    rows = []
+    for r in range(args.repeat):
+        np.random.seed(r)
+        model = BiGAnts(GE.iloc[:, :m_old], G, args.L_g_min, args.L_g_max)
+        _search(model, max_iter=args.max_iter)
+        st = time.time()
+        model.add_patients(GE.iloc[:, m_old:])
+        update = time.time() - st
+        row = _search(model, max_iter=args.max_iter, warm=model.state)
+        row.update({"setting": "warm", "update": update})
+        rows.append(row)
+        cold = BiGAnts(GE, G, args.L_g_min, args.L_g_max)
+        st = time.time()
+        cold.prepare()
+        update = time.time() - st
+        row = _search(cold, max_iter=args.max_iter)
+        row.update({"setting": "cold", "update": update})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=sorted(SUITES))
+    parser.add_argument("--expr", default="../bigants/data/gse30219_lung.csv")
+    parser.add_argument("--net", default="../bigants/data/biogrid.human.entrez.tsv")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--L_g_min", type=int, default=10)
+    parser.add_argument("--L_g_max", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max_iter", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--new", type=int, default=10, help="number of held out patients for the incremental suite")
+    parser.add_argument("--output", default=None, help="csv file for the results of all runs")
+    args = parser.parse_args()
+
+    GE, G, labels, _ = data_preprocessing(args.expr, args.net, log2=False, size=args.size)
+    if args.suite == "incremental":
+        table = incremental(GE, G, args)
+        columns = ["best_score", "iterations", "runtime", "ants", "update"]
+    else:
+        model = BiGAnts(GE, G, args.L_g_min, args.L_g_max)
+        configs = []
+        for config in SUITES[args.suite]:
+            for r in range(args.repeat):
+                c = dict(config)
+                c["max_iter"] = args.max_iter
+                configs.append(c)
+        table = parameter_sweep(model, configs, n_workers=args.workers, seed=0)
+        table["setting"] = [", ".join("{0}={1}".format(k, v) for k, v in c.items() if k != "max_iter") or "default" for c in configs]
+        columns = ["best_score", "iterations", "runtime", "ants"]
+    if args.output != None:
+        table.to_csv(args.output, index=False)
+    summary = table.groupby("setting", sort=False)[columns].agg(["mean", "std"])
+    pd.set_option("display.width", 200)
+    print(summary.round(3))
+    if args.suite == "stopping":
+        means = table.groupby("setting", sort=False)[["iterations", "best_score"]].mean()
+        base = means.iloc[0]
+        for setting, row in means.iloc[1:].iterrows():
+            print("{0}: {1:.1f} iterations saved ({2:.1%}), best score change {3:+.3f}".format(
+                setting, base["iterations"] - row["iterations"], 1 - row["iterations"] / base["iterations"], row["best_score"] - base["best_score"]))
+
+
+if __name__ == "__main__":
+    main()
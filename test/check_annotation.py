@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checks bigants.annotation.AnnotationClient against a local stand-in for the
+MyGene.info and Enrichr endpoints (http.server on a free port, no internet needed):
+
+    - gene IDs are sent in batches of batch_size
+    - a 5xx answer is retried after at least the backoff delay
+    - a second client with the same cache directory sends no requests
+
+Exits with a non-zero status if a check fails.
+
+    python check_annotation.py --genes 2500 --batch_size 1000
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+from bigants.annotation import AnnotationClient
+
+LIBRARY = "GO_Biological_Process_2018"
+# the first request to each of these paths is answered with the status
+FAIL_FIRST = {"/v3/query": 503, "/Enrichr/enrich": 502}
+
+
+class StandIn(object):
+    '''
+        Answers of the stand-in server and a log of every request it received
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.log = []
+        self.lists = dict()
+        self.failed = set()
+
+    def answer(self, method, path, body):
+        # returns (status, JSON answer)
+        parts = urlsplit(path)
+        with self.lock:
+            self.log.append({"time": time.time(), "method": method, "path": parts.path, "url": path, "body": body})
+            if parts.path in FAIL_FIRST and parts.path not in self.failed:
+                self.failed.add(parts.path)
+                self.log[-1]["status"] = FAIL_FIRST[parts.path]
+                return FAIL_FIRST[parts.path], {"error": "temporarily unavailable"}
+            self.log[-1]["status"] = 200
+            if parts.path == "/v3/query":
+                ids = parse_qs(body.decode())["q"][0].split(",")
+                self.log[-1]["ids"] = len(ids)
+                return 200, [{"query": x, "symbol": "SYM" + x} for x in ids]
+            if parts.path == "/Enrichr/addList":
+                list_id = len(self.lists) + 1
+                self.lists[list_id] = form_field(body, "list").split("\n")
+                return 200, {"userListId": list_id, "shortId": str(list_id)}
+            if parts.path == "/Enrichr/enrich":
+                query = parse_qs(parts.query)
+                genes = self.lists[int(query["userListId"][0])]
+                return 200, {query["backgroundType"][0]: [[1, "term of " + genes[0], 0.001, 2.5, 17.3, genes[:2], 0.01]]}
+            return 404, {"error": "unknown path " + parts.path}
+
+
+def form_field(body, name):
+    # value of a text field of a multipart/form-data body
+    for part in body.decode().split("\r\n--"):
+        head, _, value = part.partition("\r\n\r\n")
+        if 'name="{0}"'.format(name) in head:
+            return value
+    return None
+
+
+def make_handler(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self, method):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length > 0 else b""
+            code, answer = stand_in.answer(method, self.path, body)
+            data = json.dumps(answer).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run(client, ids, gene_lists):
+    symbols = client.query(ids, "entrezgene")
+    table = client.enrich(gene_lists, LIBRARY)
+    client.close()
+    return symbols, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--genes", type=int, default=2500)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--lists", type=int, default=4)
+    parser.add_argument("--backoff", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stand_in = StandIn()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(stand_in))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{0}".format(server.server_port)
+    ids = [str(1000 + i) for i in range(args.genes)]
+    gene_lists = {"solution{0}".format(i): ["GENE{0}_{1}".format(i, j) for j in range(10)] for i in range(args.lists)}
+    failed = []
+
+    with tempfile.TemporaryDirectory() as cache:
+        settings = dict(mygene_url=base + "/v3", enrichr_url=base + "/Enrichr", cache=cache,
+                        batch_size=args.batch_size, backoff=args.backoff, concurrency=4)
+        st = time.time()
+        client = AnnotationClient(**settings)
+        symbols, table = run(client, ids, gene_lists)
+        print("first run: {0:.2f}s, {1}".format(time.time() - st, client.stats))
+
+        # batching: every ID exactly once, in batches of at most batch_size
+        answered = [r for r in stand_in.log if r["path"] == "/v3/query" and r["status"] == 200]
+        expected = -(-args.genes // args.batch_size)
+        sizes = sorted((r["ids"] for r in answered), reverse=True)
+        print("MyGene.info batches: {0}".format(sizes))
+        if len(answered) != expected or sum(sizes) != args.genes or max(sizes) > args.batch_size:
+            failed.append("expected {0} batches of at most {1} IDs".format(expected, args.batch_size))
+        if sorted(x["query"] for x in symbols) != sorted(ids) or any(x["symbol"] != "SYM" + x["query"] for x in symbols):
+            failed.append("the symbols do not match the queried IDs")
+        if sorted(set(table["list"])) != sorted(gene_lists):
+            failed.append("Enrichr results are missing for some lists")
+
+        # retries: the failed request is sent again with the same body after at least the backoff delay
+        for path, code in FAIL_FIRST.items():
+            requests = [r for r in stand_in.log if r["path"] == path]
+            first = next(r for r in requests if r["status"] == code)
+            retry = [r for r in requests if r["time"] > first["time"] and (r["url"], r["body"]) == (first["url"], first["body"]) and r["status"] == 200]
+            if len(retry) == 0:
+                failed.append("the {0} answer of {1} was not retried".format(code, path))
+                continue
+            delay = retry[0]["time"] - first["time"]
+            print("{0}: HTTP {1} retried after {2:.3f}s".format(path, code, delay))
+            if delay < args.backoff:
+                failed.append("{0} was retried after {1:.3f}s, before the backoff of {2}s".format(path, delay, args.backoff))
+        if client.stats["retried"] != len(FAIL_FIRST):
+            failed.append("{0} retries were counted instead of {1}".format(client.stats["retried"], len(FAIL_FIRST)))
+
+        # cache: the second run is answered from disk
+        sent = len(stand_in.log)
+        st = time.time()
+        client = AnnotationClient(**settings)
+        symbols_2, table_2 = run(client, ids, gene_lists)
+        print("second run: {0:.2f}s, {1}".format(time.time() - st, client.stats))
+        if len(stand_in.log) != sent or client.stats["sent"] != 0:
+            failed.append("the second run sent {0} requests instead of none".format(len(stand_in.log) - sent))
+        if client.stats["cached"] != expected + 2 * args.lists:
+            failed.append("{0} cache hits instead of {1}".format(client.stats["cached"], expected + 2 * args.lists))
+        if symbols_2 != symbols or not table_2.equals(table):
+            failed.append("cached answers differ from the first run")
+
+    server.shutdown()
+    for message in failed:
+        print("FAILED: " + message)
+    if len(failed) == 0:
+        print("all checks passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()